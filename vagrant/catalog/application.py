@@ -12,41 +12,587 @@ you CANNOT have a ball under the category of baseball and a ball under the
 category of soccer.
 """
 from flask import Flask, render_template, url_for, request, redirect, flash
-from flask import jsonify, g
+from flask import jsonify, g, abort
 from flask import session as login_session
-from flask import make_response
-from sqlalchemy import create_engine, func
-from sqlalchemy.orm import sessionmaker
-from models import Base, Item, Category, User
-from oauth2client.client import flow_from_clientsecrets
+from flask import make_response, Response, stream_with_context
+from sqlalchemy import and_, or_, delete, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from models import Item, Category, User
+from database import DBSession, engine
+from cache import DatabaseVersion, categoryCache, pageCache, userCache
+from cache import forgetOnCommit, invalidateOnCommit, markStale
+from search import searchItems
+from metrics import metrics
+from logconfig import configureLogging
+from compression import compressResponse
+from werkzeug.http import is_resource_modified
+from sweeper import startSweeper
+from oauth2client.client import OAuth2WebServerFlow
 from oauth2client.client import FlowExchangeError
 
-import httplib2
+import base64
+import datetime
+import functools
+import hashlib
+import oauth
 import random
+import secrets
 import string
 import json
 import requests
 import logging
+import os
 
 
-# Store off Google CLIENT_ID and APPLICATION_NAME
-CLIENT_ID = json.loads(open("google_client_secrets.json", "r").read())[
-    "web"]["client_id"]
+# Store off the Google and Facebook secrets, read once at startup rather than
+# on every login, and APPLICATION_NAME
+GOOGLE_SECRETS = json.loads(open("google_client_secrets.json", "r").read())[
+    "web"]
+FACEBOOK_SECRETS = json.loads(open("fb_client_secrets.json", "r").read())[
+    "web"]
+CLIENT_ID = GOOGLE_SECRETS["client_id"]
 APPLICATION_NAME = "Catalog Project Application"
 
-# Create the connections and sessions to the catalog database
-engine = create_engine("sqlite:///catalog.db")
-Base.metadata.bind = engine
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+# Every request gets its own session from the thread scoped DBSession
+# registry, which is released again in removeSession once the request is done.
+session = DBSession
+
+# The sidebar category list is cached and dropped whenever a commit touches
+# the Category table, and reloaded when another process has moved the catalog
+# version on.
+invalidateOnCommit(DBSession, categoryCache, (Category,))
+# Rendered catalog pages are cached per catalog version, which database
+# triggers move on with every change to an item or category, made by this
+# process or any other.
+catalogVersion = DatabaseVersion(engine)
+# User ids are cached by email address, under both the old and the new address
+# of a user whose email changes.
+forgetOnCommit(DBSession, userCache, User, lambda user: [
+    "email:{0}".format(email) for email in
+    set(inspect(user).attrs.email.history.deleted or ()) | {user.email}])
 
 # Create debug log for capturing events that happen during execution
-# Log output to file and to the console for now
-logging.basicConfig(filename='debug.log', filemode='w', level=logging.DEBUG)
-consoleHandler = logging.StreamHandler()
-logging.getLogger('').addHandler(consoleHandler)
+# Log output to a rotating JSON file and to the console, written by a
+# background thread so requests never wait on the log file.
+configureLogging()
+log = logging.getLogger("application")
 
 app = Flask(__name__)
+# Sessions are signed with CATALOG_SECRET_KEY. Without it a random key is used,
+# so that sessions can never be forged with a known key, but they then last
+# only as long as the process and are not shared between workers.
+app.secret_key = os.environ.get("CATALOG_SECRET_KEY")
+if not app.secret_key:
+    log.warning("CATALOG_SECRET_KEY is not set, signing sessions with a "
+                "random key")
+    app.secret_key = secrets.token_hex(32)
+
+
+@app.teardown_appcontext
+def removeSession(exception=None):
+    """
+    Function that runs at the end of every request to roll back anything left
+    uncommitted and hand the request's database session back to the pool.
+
+    Parameters
+    =======================================================
+    exception - Exception
+        The exception raised while handling the request, if any.
+
+    Returns
+    =======================================================
+    None
+    """
+    DBSession.remove()
+
+
+# The JSON API endpoints can stream their output instead of building the whole
+# payload in memory. Streaming is enabled for every request by setting
+# STREAM_JSON or per request by passing ?stream=1.
+app.config["STREAM_JSON"] = False
+# jsonify would indent its output in debug mode. It is kept compact so that
+# the buffered and streamed documents are the same bytes whatever the mode.
+app.json.compact = True
+# Number of rows fetched per round trip from the server side cursor when
+# streaming, and the approximate number of bytes buffered before a chunk is
+# written out to the client.
+app.config["STREAM_BATCH_SIZE"] = 1000
+app.config["STREAM_CHUNK_SIZE"] = 64 * 1024
+# Item listings are paged with ?after=<cursor>&limit=<n>. Pages default to
+# PAGE_SIZE items and callers may ask for at most MAX_PAGE_SIZE.
+app.config["PAGE_SIZE"] = 50
+app.config["MAX_PAGE_SIZE"] = 500
+# '/catalog/items/bulk' accepts at most BULK_MAX_ITEMS operations per request.
+app.config["BULK_MAX_ITEMS"] = 500
+# Categories left empty by editItem and deleteItem are removed in the same
+# transaction, unless SWEEP_INTERVAL is a number of seconds, in which case
+# they are left for the background sweeper in sweeper.py to remove in batches.
+app.config["SWEEP_INTERVAL"] = float(
+    os.environ.get("CATALOG_SWEEP_INTERVAL", "0"))
+if app.config["SWEEP_INTERVAL"]:
+    startSweeper(engine, app.config["SWEEP_INTERVAL"])
+# The JSON API sends ETag and Last-Modified headers and may be cached by
+# browsers and reverse proxies for JSON_MAX_AGE seconds before they have to
+# revalidate. Responses of at least COMPRESS_MIN_SIZE bytes are compressed.
+app.config["JSON_MAX_AGE"] = int(os.environ.get("CATALOG_JSON_MAX_AGE", "0"))
+app.config["COMPRESS_MIN_SIZE"] = 1024
+app.config["COMPRESS_LEVEL"] = 6
+# Every request is timed and its SQL statements counted for '/metrics'.
+# Setting PROFILE lets callers run a request under cProfile with ?profile=1.
+app.config["PROFILE"] = os.environ.get("CATALOG_PROFILE", "") not in ("", "0")
+metrics.instrument(app, engine)
+metrics.watchCache("categories", categoryCache)
+metrics.watchCache("pages", pageCache)
+metrics.watchCache("users", userCache)
+metrics.watchCache("tokens", oauth.tokenCache)
+
+
+@app.after_request
+def compress(response):
+    """
+    Function that runs after every request to compress large JSON and HTML
+    responses for clients that accept it.
+
+    Parameters
+    =======================================================
+    response - flask Response
+        The response to send.
+
+    Returns
+    =======================================================
+    The response, compressed when worthwhile.
+    """
+    return compressResponse(request, response,
+                            app.config["COMPRESS_MIN_SIZE"],
+                            app.config["COMPRESS_LEVEL"])
+
+
+def wantsStream():
+    """
+    Function to decide whether the current JSON API request should be served
+    as a streamed response.
+
+    Parameters
+    =======================================================
+    None
+
+    Returns
+    =======================================================
+    bool -
+        True if streaming is enabled for the app or requested by the caller.
+    """
+    return app.config["STREAM_JSON"] or request.args.get("stream") == "1"
+
+
+def catalogState():
+    """
+    Function to read the catalog version and last modified time, once per
+    request.
+
+    Parameters
+    =======================================================
+    None
+
+    Returns
+    =======================================================
+    tuple -
+        The catalog version number and the datetime of the last change.
+    """
+    if "catalogState" not in g:
+        g.catalogState = catalogVersion.current()
+    return g.catalogState
+
+
+def getCategories():
+    """
+    Function to retrieve the list of categories, ordered by name, that is
+    drawn in the sidebar of every page. The list is served from categoryCache
+    and only read from the DB on a miss, or when it was read at an older
+    catalog version than the current one.
+
+    Parameters
+    =======================================================
+    None
+
+    Returns
+    =======================================================
+    list of dictionaries -
+        The serialized categories ordered by name.
+    """
+    version = catalogState()[0]
+
+    def loadCategories():
+        return {"version": version, "categories": [
+            entry.serialize
+            for entry in session.query(Category).order_by(Category.name)]}
+
+    cached = categoryCache.get(loadCategories)
+    if cached["version"] != version:
+        categoryCache.invalidate()
+        cached = categoryCache.get(loadCategories)
+    return cached["categories"]
+
+
+def encodeCursor(item):
+    """
+    Function to build the opaque cursor that points just past an item in the
+    (name, id) ordering used by every item listing.
+
+    Parameters
+    =======================================================
+    item - Item
+        The last item on the current page.
+
+    Returns
+    =======================================================
+    string -
+        A URL safe cursor for the ?after= parameter.
+    """
+    raw = json.dumps([item.name, item.id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decodeCursor(cursor):
+    """
+    Function to unpack a cursor made by encodeCursor. A malformed cursor
+    aborts the request with a 400.
+
+    Parameters
+    =======================================================
+    cursor - string
+        The value of the ?after= parameter.
+
+    Returns
+    =======================================================
+    tuple -
+        The (name, id) of the item the next page starts after.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        name, item_id = json.loads(base64.urlsafe_b64decode(
+            padded.encode("ascii")).decode("utf-8"))
+        return name, int(item_id)
+    except Exception:
+        abort(400)
+
+
+def pageOfItems(query, defaultLimit):
+    """
+    Function to cut one page out of an item query with keyset (seek)
+    pagination on (Item.name, Item.id). The page is found by seeking the
+    index past the ?after= cursor rather than skipping rows with OFFSET, so
+    every page costs the same however deep the caller pages.
+
+    Parameters
+    =======================================================
+    query - sqlalchemy Query
+        The query for the items to page through.
+    defaultLimit - int
+        The page size to use when the caller does not pass ?limit=.
+
+    Returns
+    =======================================================
+    tuple -
+        The list of items on the page and the cursor for the next page, or
+        None when this is the last page.
+    """
+    limit = request.args.get("limit", defaultLimit, type=int)
+    limit = max(1, min(limit, app.config["MAX_PAGE_SIZE"]))
+    after = request.args.get("after")
+    if after:
+        name, item_id = decodeCursor(after)
+        query = query.filter(or_(Item.name > name,
+                                 and_(Item.name == name, Item.id > item_id)))
+    items = query.order_by(Item.name, Item.id).limit(limit + 1).all()
+    if len(items) > limit:
+        return items[:limit], encodeCursor(items[limit - 1])
+    return items, None
+
+
+def wantsPage():
+    """
+    Function to decide whether the current JSON API request asked for a
+    single page of items rather than the whole catalog.
+
+    Parameters
+    =======================================================
+    None
+
+    Returns
+    =======================================================
+    bool -
+        True if the caller passed ?after= or ?limit=.
+    """
+    return "after" in request.args or "limit" in request.args
+
+
+# The query parameters the cached listing pages read. Any others are left
+# out of the cache key, so that they cannot fill the cache with copies of the
+# same page.
+PAGE_PARAMS = ("after", "limit", "q")
+
+
+def cachedPage(view):
+    """
+    Decorator for views that render catalog listings. The rendered page is
+    cached under the current catalog version, the logged in user (the edit and
+    delete icons depend on who is looking), the requested path and the
+    PAGE_PARAMS it was asked for with, and is sent with an ETag so browsers
+    that already hold it get a 304 back.
+
+    Pages are rendered fresh, and not cached, while flash messages are waiting
+    to be shown.
+
+    Parameters
+    =======================================================
+    view - function
+        The view function rendering the page.
+
+    Returns
+    =======================================================
+    function -
+        The wrapped view function.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if "_flashes" in login_session:
+            return view(*args, **kwargs)
+
+        params = dict((name, request.args[name]) for name in PAGE_PARAMS
+                      if name in request.args)
+        if "limit" in params:
+            params["limit"] = request.args.get("limit", type=int)
+        key = "{0}:{1}:{2}:{3}".format(catalogState()[0],
+                                       login_session.get("user_id", ""),
+                                       request.path,
+                                       json.dumps(params, sort_keys=True))
+        etag = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        if request.if_none_match.contains_weak(etag):
+            response = make_response("", 304)
+        else:
+            response = make_response(
+                pageCache.get(key, lambda: view(*args, **kwargs)))
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    return wrapper
+
+
+def notModified(etag, lastModified):
+    """
+    Function to answer a conditional GET with a 304 when the client already
+    holds the current representation.
+
+    Parameters
+    =======================================================
+    etag - string
+        The weak ETag of the current representation.
+    lastModified - datetime or float
+        When the representation last changed.
+
+    Returns
+    =======================================================
+    A flask 304 response, or None if the full response has to be sent.
+    """
+    if is_resource_modified(request.environ, etag=etag,
+                            last_modified=lastModified):
+        return None
+    return withValidators(make_response("", 304), etag, lastModified)
+
+
+def withValidators(response, etag, lastModified):
+    """
+    Function to set the ETag, Last-Modified and Cache-Control headers of a
+    JSON API response. The responses are public, so reverse proxies may keep
+    them and revalidate them once JSON_MAX_AGE seconds have passed.
+
+    Parameters
+    =======================================================
+    response - flask Response
+        The response to send.
+    etag - string
+        The weak ETag of the representation.
+    lastModified - datetime or float
+        When the representation last changed.
+
+    Returns
+    =======================================================
+    The response with its headers set.
+    """
+    response.set_etag(etag, weak=True)
+    response.last_modified = lastModified
+    response.headers["Cache-Control"] = "public, max-age={0}, " \
+        "must-revalidate".format(app.config["JSON_MAX_AGE"])
+    return response
+
+
+def catalogValidated(view):
+    """
+    Decorator for JSON API views whose output only changes with the catalog.
+    Their ETag is derived from the catalog version and the requested URL, and
+    their Last-Modified from the time of the last change, so that a client
+    holding the current document gets a 304 before any query is run.
+
+    Parameters
+    =======================================================
+    view - function
+        The view function returning the JSON document.
+
+    Returns
+    =======================================================
+    function -
+        The wrapped view function.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version, lastModified = catalogState()
+        key = "{0}:{1}".format(version, request.full_path)
+        etag = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        response = notModified(etag, lastModified)
+        if response is None:
+            response = make_response(view(*args, **kwargs))
+            # Errors are neither cached nor revalidated.
+            if response.status_code == 200:
+                withValidators(response, etag, lastModified)
+        return response
+
+    return wrapper
+
+
+def dumpJSON(obj):
+    """
+    Function to encode an object the same way jsonify does (sorted keys, no
+    extra whitespace, as app.json.compact asks for) so that streamed and
+    buffered responses match.
+
+    Parameters
+    =======================================================
+    obj - any JSON serializable object
+        The object to encode.
+
+    Returns
+    =======================================================
+    string -
+        The JSON encoding of obj.
+    """
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"))
+
+
+def streamJSON(fragments):
+    """
+    Function to wrap a generator of JSON text fragments in a chunked flask
+    response. Fragments are coalesced into chunks of roughly
+    STREAM_CHUNK_SIZE bytes so the client is not sent one tiny write per row.
+
+    Parameters
+    =======================================================
+    fragments - generator of strings
+        The pieces of the JSON document in order.
+
+    Returns
+    =======================================================
+    A flask response object streaming the JSON document.
+    """
+    chunkSize = app.config["STREAM_CHUNK_SIZE"]
+
+    def generate():
+        buffered = []
+        size = 0
+        for fragment in fragments:
+            buffered.append(fragment)
+            size += len(fragment)
+            if size >= chunkSize:
+                yield "".join(buffered)
+                buffered = []
+                size = 0
+        if buffered:
+            yield "".join(buffered)
+
+    return Response(stream_with_context(generate()),
+                    mimetype="application/json")
+
+
+def generateCatalogJSON():
+    """
+    Generator that walks every category and its items through a server side
+    cursor and yields the '/catalog/JSON' document piece by piece. The output
+    is identical to the buffered jsonify response.
+
+    Parameters
+    =======================================================
+    None
+
+    Returns
+    =======================================================
+    generator of strings -
+        The pieces of the JSON document in order.
+    """
+    rows = session.query(Category, Item).outerjoin(Category.items).order_by(
+        Category.name, Category.id, Item.name).yield_per(
+        app.config["STREAM_BATCH_SIZE"])
+
+    # jsonify sorts keys, so each category's "Item" list is written before
+    # its "id" and "name" which are emitted once the category is complete.
+    yield '{"Category":['
+    current = None
+    for category, item in rows:
+        if current is None or category.id != current["id"]:
+            if current is not None:
+                yield '],{0}}},'.format(dumpJSON(current)[1:-1])
+            current = category.serialize
+            yield '{"Item":['
+            separator = ""
+        if item is not None:
+            yield separator + dumpJSON(item.serialize)
+            separator = ","
+    if current is not None:
+        yield '],{0}}}'.format(dumpJSON(current)[1:-1])
+    yield ']}\n'
+
+
+def generateCategoriesJSON():
+    """
+    Generator that walks every category through a server side cursor and
+    yields the '/catalog/category/JSON' document piece by piece.
+
+    Parameters
+    =======================================================
+    None
+
+    Returns
+    =======================================================
+    generator of strings -
+        The pieces of the JSON document in order.
+    """
+    categories = session.query(Category).order_by(Category.name).yield_per(
+        app.config["STREAM_BATCH_SIZE"])
+    yield '{"Category":['
+    separator = ""
+    for entry in categories:
+        yield separator + dumpJSON(entry.serialize)
+        separator = ","
+    yield ']}\n'
+
+
+@app.route('/metrics')
+def showMetrics():
+    """
+    Function that handles the route to '/metrics' and will return the request,
+    SQL and cache measurements in the Prometheus text format.
+
+    Parameters
+    =======================================================
+    None
+
+    Returns
+    =======================================================
+    A plain text response for Prometheus to scrape.
+    """
+    return Response(metrics.render(),
+                    mimetype="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.route('/page')
@@ -68,6 +614,7 @@ def showPage():
 
 @app.route('/')
 @app.route('/catalog/')
+@cachedPage
 def showItems():
     """
     Function that handles the routes to '/' and '/catalog' and will render the
@@ -82,14 +629,18 @@ def showItems():
     =======================================================
     A flask template for items.html.
     """
-    categories = session.query(Category).order_by(Category.name).all()
-    items = session.query(Item).order_by(Item.name)
-    users = session.query(User)
+    categories = getCategories()
+    # The template shows every item's category, so load them in the same
+    # query rather than one lazy load per item.
+    items, nextCursor = pageOfItems(
+        session.query(Item).options(joinedload(Item.category)),
+        app.config["PAGE_SIZE"])
     return render_template("items.html", items=items, categories=categories,
-                           users=users)
+                           nextCursor=nextCursor)
 
 
 @app.route('/catalog/category/<int:category_id>/')
+@cachedPage
 def showItemsForCategory(category_id):
     """
     Function that handles the routes to 'catalog/category/<someCategory>' and
@@ -105,17 +656,20 @@ def showItemsForCategory(category_id):
     =======================================================
     A flask template for categoryItems.html.
     """
-    categories = session.query(Category).order_by(Category.name).all()
+    categories = getCategories()
     targetCategory = session.query(Category).filter_by(id=category_id).one()
-    items = session.query(Item).filter_by(
-        category_id=category_id).order_by(Item.name)
-    users = session.query(User)
+    items, nextCursor = pageOfItems(
+        session.query(Item).options(joinedload(Item.category)).filter_by(
+            category_id=category_id),
+        app.config["PAGE_SIZE"])
     return render_template("categoryItems.html",
                            items=items, categories=categories,
-                           targetCategory=targetCategory, users=users)
+                           targetCategory=targetCategory,
+                           nextCursor=nextCursor)
 
 
 @app.route('/catalog/JSON')
+@catalogValidated
 def allItemsByAllCategoryJSON():
     """
     Function that handles the routes to 'catalog/JSON' and will return a JSON
@@ -129,19 +683,89 @@ def allItemsByAllCategoryJSON():
     Returns
     =======================================================
     JSON formatted stream for all the categories and their items.
+    Passing ?after= or ?limit= returns one page of items, grouped under their
+    categories, along with the cursor for the "next" page.
     """
-    categories = session.query(Category).order_by(Category.name).all()
-    cate_dict = [entry.serialize for entry in categories]
-    index = 0
-    for entry in cate_dict:
-        items = session.query(Item).filter_by(
-            category_id=entry["id"]).order_by(Item.name).all()
-        items_dict = {"Item": [item.serialize for item in items]}
-        cate_dict[index].update(items_dict)
-        index += 1
+    if wantsPage():
+        items, nextCursor = pageOfItems(
+            session.query(Item).options(joinedload(Item.category)),
+            app.config["MAX_PAGE_SIZE"])
+        grouped = {}
+        for item in items:
+            if item.category_id not in grouped:
+                grouped[item.category_id] = (item.category, [])
+            grouped[item.category_id][1].append(item.serialize)
+        cate_dict = []
+        for category, itemList in sorted(
+                grouped.values(),
+                key=lambda entry: (entry[0].name, entry[0].id)):
+            entry_dict = category.serialize
+            entry_dict["Item"] = itemList
+            cate_dict.append(entry_dict)
+        return jsonify(Category=cate_dict, next=nextCursor)
+
+    if wantsStream():
+        return streamJSON(generateCatalogJSON())
+
+    # Pull every category along with its items in a single joined query
+    # rather than issuing one item query per category.
+    categories = session.query(Category).options(
+        joinedload(Category.items)).order_by(Category.name).all()
+    cate_dict = []
+    for entry in categories:
+        entry_dict = entry.serialize
+        entry_dict["Item"] = [item.serialize for item in entry.items]
+        cate_dict.append(entry_dict)
     return jsonify(Category=cate_dict)
 
 
+@app.route('/catalog/search')
+@cachedPage
+def showSearchResults():
+    """
+    Function that handles the routes to 'catalog/search?q=<terms>' and will
+    render a page that shows the items whose name or description match the
+    search terms, best match first.
+
+    Parameters
+    =======================================================
+    None
+
+    Returns
+    =======================================================
+    A flask template for items.html.
+    """
+    terms = request.args.get("q", "")
+    limit = request.args.get("limit", app.config["PAGE_SIZE"], type=int)
+    items = searchItems(session, terms,
+                        max(1, min(limit, app.config["MAX_PAGE_SIZE"])))
+    return render_template("items.html", items=items,
+                           categories=getCategories(),
+                           heading="Items matching '{0}'".format(terms))
+
+
+@app.route('/catalog/search/JSON')
+def searchResultsJSON():
+    """
+    Function that handles the routes to 'catalog/search/JSON?q=<terms>' and
+    will return a JSON formatted stream to the caller of the items whose name
+    or description match the search terms, best match first.
+
+    Parameters
+    =======================================================
+    None
+
+    Returns
+    =======================================================
+    JSON formatted stream of the matching items.
+    """
+    terms = request.args.get("q", "")
+    limit = request.args.get("limit", app.config["PAGE_SIZE"], type=int)
+    items = searchItems(session, terms,
+                        max(1, min(limit, app.config["MAX_PAGE_SIZE"])))
+    return jsonify(Item=[item.serialize for item in items])
+
+
 @app.route('/catalog/item/<int:item_id>/JSON')
 def itemDetailsJSON(item_id):
     """
@@ -159,10 +783,187 @@ def itemDetailsJSON(item_id):
     JSON formatted stream of the items details.
     """
     item = session.query(Item).filter_by(id=item_id).one()
-    return jsonify(Item=item.serialize)
+    etag = hashlib.sha1("{0}:{1}".format(
+        item.id, item.updated_at).encode("utf-8")).hexdigest()
+    lastModified = item.updated_at or datetime.datetime.utcnow()
+    response = notModified(etag, lastModified)
+    if response is None:
+        response = withValidators(jsonify(Item=item.serialize), etag,
+                                  lastModified)
+    return response
+
+
+@app.route('/catalog/items/JSON')
+@catalogValidated
+def itemsDetailsJSON():
+    """
+    Function that handles the routes to 'catalog/items/JSON?ids=1,2,3' and
+    will return a JSON formatted stream to the caller for the details of
+    several items at once, looked up in a single query.
+
+    Parameters
+    =======================================================
+    None
+
+    Returns
+    =======================================================
+    JSON formatted stream of the items' details, in the order they were
+    asked for, and the ids of any items that do not exist.
+    """
+    try:
+        ids = [int(item_id) for item_id in
+               request.args.get("ids", "").split(",") if item_id.strip()]
+    except ValueError:
+        return jsonError("ids must be a comma separated list of item ids.",
+                         400)
+    if len(ids) > app.config["MAX_PAGE_SIZE"]:
+        return jsonError("At most {0} items can be fetched at once.".format(
+            app.config["MAX_PAGE_SIZE"]), 400)
+    found = {}
+    if ids:
+        found = dict((item.id, item) for item in
+                     session.query(Item).filter(Item.id.in_(set(ids))))
+    return jsonify(Item=[found[item_id].serialize for item_id in ids
+                         if item_id in found],
+                   missing=[item_id for item_id in ids
+                            if item_id not in found])
+
+
+@app.route('/catalog/items/bulk', methods=['POST'])
+def bulkItems():
+    """
+    Function that handles the route to 'catalog/items/bulk' and will create,
+    update and delete up to BULK_MAX_ITEMS items in a single transaction.
+
+    The request body is a JSON object holding a list of "operations", each
+    one of
+      * {"op": "create", "name": ..., "description": ..., "category": ...}
+      * {"op": "update", "id": ..., "description": ..., "category": ...}
+      * {"op": "delete", "id": ...}
+    Operations are checked as the item forms are - only the owner of an item
+    may update or delete it, and item names must be unique. Operations that
+    fail their checks are reported and skipped, the rest are committed
+    together.
+
+    Parameters
+    =======================================================
+    None
+
+    Returns
+    =======================================================
+    JSON formatted stream holding the result of each operation, in order,
+    with its HTTP style status and the id of the item it applied to.
+    """
+    if "username" not in login_session:
+        return jsonError("Log in to change items.", 401)
+    body = request.get_json(silent=True)
+    operations = body.get("operations") if isinstance(body, dict) else None
+    if not isinstance(operations, list) or not all(
+            isinstance(operation, dict) for operation in operations):
+        return jsonError("Expected a JSON object with a list of operations.",
+                         400)
+    if len(operations) > app.config["BULK_MAX_ITEMS"]:
+        return jsonError("At most {0} operations can be sent at once.".format(
+            app.config["BULK_MAX_ITEMS"]), 413)
+    for index, operation in enumerate(operations):
+        if any(not isinstance(operation[key], str) for key in
+               ("name", "description", "category") if key in operation) or \
+                not isinstance(operation.get("id", 0), int) or \
+                isinstance(operation.get("id"), bool):
+            return jsonError("Operation {0} has a field of the wrong type.".
+                             format(index), 400)
+    user_id = login_session["user_id"]
+
+    # Look up every item, item name and category the operations refer to
+    # up front, one query each.
+    ids = set(operation.get("id") for operation in operations
+              if operation.get("op") in ("update", "delete"))
+    items = {}
+    if ids:
+        items = dict((item.id, item) for item in
+                     session.query(Item).filter(Item.id.in_(ids)))
+    names = set(operation.get("name") for operation in operations
+                if operation.get("op") == "create")
+    takenNames = set()
+    if names:
+        takenNames = set(row[0] for row in session.query(Item.name).filter(
+            Item.name.in_(names)))
+    categoryNames = set(operation["category"] for operation in operations
+                        if operation.get("category"))
+    categoryIds = {}
+    if categoryNames:
+        categoryIds = dict(session.query(Category.name, Category.id).filter(
+            Category.name.in_(categoryNames)))
+
+    results = []
+    created = []
+    emptied = set()
+    try:
+        for index, operation in enumerate(operations):
+            op = operation.get("op")
+            result = {"index": index, "op": op}
+            results.append(result)
+            if op == "create":
+                name = operation.get("name")
+                if not name or not operation.get("category"):
+                    result.update(status=400,
+                                  error="name and category are required")
+                    continue
+                if name in takenNames:
+                    result.update(status=409, error="name already exists")
+                    continue
+                takenNames.add(name)
+                newItem = Item(name=name,
+                               description=operation.get("description", ""),
+                               category_id=bulkCategory(
+                                   categoryIds, operation["category"]),
+                               user_id=user_id)
+                session.add(newItem)
+                created.append((result, newItem))
+                result["status"] = 201
+                continue
+            if op not in ("update", "delete"):
+                result.update(status=400, error="unknown op")
+                continue
+            item = items.get(operation.get("id"))
+            result["id"] = operation.get("id")
+            if item is None:
+                result.update(status=404, error="no such item")
+                continue
+            if item.user_id != user_id:
+                result.update(status=403, error="not the item's owner")
+                continue
+            if op == "delete":
+                emptied.add(item.category_id)
+                session.delete(item)
+                del items[item.id]
+            else:
+                if "description" in operation:
+                    item.description = operation["description"]
+                if operation.get("category"):
+                    category_id = bulkCategory(categoryIds,
+                                               operation["category"])
+                    if category_id != item.category_id:
+                        emptied.add(item.category_id)
+                        item.category_id = category_id
+            result["status"] = 200
+        session.flush()
+        for category_id in emptied:
+            removeIfEmpty(category_id)
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        log.exception("Bulk change of %s items failed", len(operations))
+        return jsonError("The changes could not be saved, none were made.",
+                         409)
+    for result, newItem in created:
+        result["id"] = newItem.id
+    log.debug("Bulk change of %s items by user %s", len(operations), user_id)
+    return jsonify(results=results)
 
 
 @app.route('/catalog/category/JSON')
+@catalogValidated
 def allCategoriesJSON():
     """
     Function that handles the routes to 'catalog/category/JSON' and will
@@ -177,8 +978,10 @@ def allCategoriesJSON():
     =======================================================
     JSON formatted stream of the categories.
     """
-    categories = session.query(Category).order_by(Category.name).all()
-    return jsonify(Category=[entry.serialize for entry in categories])
+    if wantsStream():
+        return streamJSON(generateCategoriesJSON())
+
+    return jsonify(Category=getCategories())
 
 
 @app.route('/catalog/item/new/', methods=['GET', 'POST'])
@@ -199,11 +1002,10 @@ def newItem():
     if "username" not in login_session:
         return redirect(url_for("showAuth"))
 
-    categories = session.query(Category).order_by(Category.name).all()
+    categories = getCategories()
     if request.method == "POST":
         if request.form["name"]:
-            logging.debug("attempting to add item - {0}".
-                          format(request.form["name"]))
+            log.debug("attempting to add item - %s", request.form["name"])
             try:
                 existingItem = session.query(Item).filter_by(
                     name=request.form["name"]).one()
@@ -230,8 +1032,8 @@ def newItem():
                         existingCategory = session.query(Category).filter_by(
                             name=request.form["category"]).one()
                     except:
-                        logging.debug("Unable to add {0} category to the DB".
-                                      format(newCategory))
+                        log.debug("Unable to add %s category to the DB",
+                                  newCategory)
                         flash("Failed to add item {0}".
                               format(request.form["name"]))
                         return redirect(url_for("showItems"))
@@ -244,18 +1046,16 @@ def newItem():
                     session.add(newItem)
                     session.commit()
                 except:
-                    logging.debug("Unable to add {0} item to the DB".
-                                  format(newItem))
+                    log.debug("Unable to add %s item to the DB", newItem)
                     flash("Failed to add item {0}".
                           format(request.form["name"]))
                     pass
             else:
-                logging.debug("{0} already exists with category {1}".
-                              format(request.form["name"],
-                                     existingItem.category))
+                log.debug("%s already exists with category %s",
+                          request.form["name"], existingItem.category)
                 flash("Failed to add item {0}".format(request.form["name"]))
                 return redirect(url_for("showItems"))
-        logging.debug("Item {0} was added".format(request.form["name"]))
+        log.debug("Item %s was added", request.form["name"])
         flash("Item {0} added to the catalog".format(request.form["name"]))
         return redirect(url_for("showItems"))
     else:
@@ -266,9 +1066,10 @@ def newItem():
 def editItem(item_id):
     """
     Function that handles the routes to 'catalog/item/<someItem>/edit' and will
-    render a page that shows the input form for editing a specific item. Due to
-    table dependencies an edit action will be processed as a delete->add
-    action.
+    render a page that shows the input form for editing a specific item. The
+    item is updated in place, keeping its id, and the change to its category
+    (creating the new one and removing the old one if it is left empty) is
+    made in the same transaction.
 
     Parameters
     =======================================================
@@ -283,90 +1084,40 @@ def editItem(item_id):
     if "username" not in login_session:
         return redirect(url_for("showAuth"))
 
-    categories = session.query(Category).order_by(Category.name).all()
+    categories = getCategories()
     editedItem = session.query(Item).filter_by(id=item_id).one()
     item_name = editedItem.name
 
     # check to see if the current user can edit the item
-    creator = getUserInfo(editedItem.user_id)
-    if creator.id != login_session["user_id"]:
-        logging.debug("{0} does have permission to edit the {1} item".
-                      format(login_session["username"], item_name))
+    if editedItem.user_id != login_session["user_id"]:
+        log.debug("%s does have permission to edit the %s item",
+                  login_session["username"], item_name)
         flash("{0} does have permission to edit the {1} item".format(
             login_session["username"], item_name))
         return redirect(url_for("showItems"))
 
     if request.method == "POST":
-        logging.debug("attempting to edit an item {0}".format(item_name))
-
-        # remove the previous item and cleanup any empty category
-        category = editedItem.category
-        logging.debug("Deleting item {0}".format(item_name))
-        session.delete(editedItem)
-        # now check to see if the category needs to be removed
-        itemsForCat = session.query(Item.id).join(
-            Category).filter_by(name=category.name)
-        count = session.query(func.count(itemsForCat)).scalar()
-        if count == 0:
-            try:
-                logging.debug("Deleting {0} from the DB".format(category.name))
-                session.delete(category)
-            except:
-                logging.debug("Unable to delete {0} from the DB".
-                              format(category))
-                pass
-        session.commit()
-
-        # add the new item and category if they don't exist
-        logging.debug("attempting to add item {0}".format(item_name))
+        log.debug("attempting to edit an item %s", item_name)
+        oldCategory_id = editedItem.category_id
+        categoryNames = dict((entry["id"], entry["name"])
+                             for entry in categories)
         try:
-            existingItem = session.query(Item).filter_by(name=item_name).one()
+            # only look up the category when it has been changed
+            category_id = oldCategory_id
+            if request.form["category"] != categoryNames.get(category_id):
+                category_id = upsertCategory(request.form["category"])
+            editedItem.description = request.form["description"]
+            editedItem.category_id = category_id
+            session.flush()
+            if category_id != oldCategory_id:
+                removeIfEmpty(oldCategory_id)
+            session.commit()
         except:
-            existingItem = ""
-            pass
-        if not existingItem:
-            try:
-                existingCategory = session.query(Category).filter_by(
-                    name=request.form["category"]).one()
-            except:
-                existingCategory = ""
-                pass
-            if not existingCategory:
-                newCategory = Category(name=request.form["category"])
-                try:
-                    session.add(newCategory)
-                    # You think you need to commit this new category
-                    # before adding the item because you need the unique
-                    # id for the item -> category relationship.
-                    # SqlAlchemy is smart enough to not need that commit
-                    # call.
-                    # session.commit()
-                    existingCategory = session.query(Category).filter_by(
-                        name=request.form["category"]).one()
-                    logging.debug("New category {0} created".
-                                  format(newCategory.name))
-                except:
-                    logging.debug("Unable to add {0} category to the DB".
-                                  format(newCategory))
-                    flash("Failed to edit item {0}".format(item_name))
-                    return redirect(url_for("showItems"))
-
-            newItem = Item(user_id=login_session["user_id"], name=item_name,
-                           description=request.form["description"],
-                           category_id=existingCategory.id)
-            try:
-                session.add(newItem)
-                session.commit()
-            except:
-                logging.debug("Unable to add {0} item to the DB".
-                              format(newItem))
-                flash("Failed to edit item {0}".format(item_name))
-                pass
-        else:
-            loggin.debug("{0} already exists with category {1}".
-                         format(item_name, existingItem.category))
+            session.rollback()
+            log.debug("Unable to edit %s item in the DB", item_name)
             flash("Failed to edit item {0}".format(item_name))
-        logging.debug("Item {0} has been editted".format(item_name))
+            return redirect(url_for("showItems"))
+        log.debug("Item %s has been editted", item_name)
         flash("Item {0} has been modified".format(item_name))
         return redirect(url_for("showItems"))
     else:
@@ -394,43 +1145,33 @@ def deleteItem(item_id):
     if "username" not in login_session:
         return redirect(url_for("showAuth"))
 
-    categories = session.query(Category).order_by(Category.name).all()
+    categories = getCategories()
     item = session.query(Item).filter_by(id=item_id).one()
     item_name = item.name
-    category = item.category
 
     # check to see if the current user can delete the item
-    creator = getUserInfo(item.user_id)
-    if creator.id != login_session["user_id"]:
-        logging.debug("{0} does have permission to delete the {1} item".
-                      format(login_session["username"], item_name))
+    if item.user_id != login_session["user_id"]:
+        log.debug("%s does have permission to delete the %s item",
+                  login_session["username"], item_name)
         flash("{0} does have permission to delete the {1} item".format(
             login_session["username"], item_name))
         return redirect(url_for("showItems"))
 
     if request.method == "POST":
-        logging.debug("attempting to delete an item")
+        log.debug("attempting to delete an item")
         try:
+            # remove the item and any category it leaves empty together
             session.delete(item)
+            session.flush()
+            removeIfEmpty(item.category_id)
             session.commit()
         except:
-            logging.debug("Unable to delete {0} from the DB".format(item))
+            session.rollback()
+            log.debug("Unable to delete %s from the DB", item)
             flash("Failed to delete item {0}".format(item_name))
-            pass
-        # now check to see if the category needs to be removed
-        itemsForCat = session.query(Item.id).join(
-            Category).filter_by(name=category.name)
-        count = session.query(func.count(itemsForCat)).scalar()
-        if count == 0:
-            try:
-                session.delete(category)
-                session.commit()
-            except:
-                logging.debug("Unable to delete {0} from the DB".
-                              format(category))
-                pass
+            return redirect(url_for("showItems"))
 
-        logging.debug("Item {0} has been deleted".format(item_name))
+        log.debug("Item %s has been deleted", item_name)
         flash("Item {0} has been removed".format(item_name))
         return redirect(url_for("showItems"))
     else:
@@ -485,53 +1226,37 @@ def gconnect():
 
     try:
         # Upgrade the authorization code into a credentials object
-        oauth_flow = flow_from_clientsecrets(
-            "google_client_secrets.json", scope='')
-        oauth_flow.redirect_uri = "postmessage"
-        credentials = oauth_flow.step2_exchange(code)
+        oauth_flow = OAuth2WebServerFlow(
+            client_id=CLIENT_ID, client_secret=GOOGLE_SECRETS["client_secret"],
+            scope='', redirect_uri="postmessage",
+            token_uri=oauth.googleTokenURI())
+        credentials = oauth_flow.step2_exchange(code, http=oauth.httpClient)
     except FlowExchangeError:
-        logging.debug("Failed to upgrade the auth code")
+        log.debug("Failed to upgrade the auth code")
         response = make_response(json.dumps(
             "Failed to upgrade the authorization code."), 401)
         response.headers["Content-Type"] = "application/json"
         return response
+    except requests.RequestException as e:
+        return providerUnavailable("Google", e)
 
-    # Check that the access token is valid.
-    access_token = credentials.access_token
-    url = ("https://www.googleapis.com/"
-           "oauth2/v1/tokeninfo?access_token={0}".format(access_token))
-
-    h = httplib2.Http()
-    result = json.loads(h.request(url, "GET")[1])
-    # If there was an error in the access token info, abort.
-    if result.get("error") is not None:
-        logging.debug("Error in the access info token")
-        logging.debug(result)
-        response = make_response(json.dumps(result.get("error")), 500)
+    # Check that the credentials are valid, belong to the user and were issued
+    # for this app.
+    try:
+        status, message = oauth.checkGoogleToken(credentials, CLIENT_ID)
+    except requests.RequestException as e:
+        return providerUnavailable("Google", e)
+    if status is not None:
+        log.debug("Google credentials rejected: %s", message)
+        response = make_response(json.dumps(message), status)
         response.headers["Content-Type"] = "application/json"
         return response
-
-    # Verify that the access token is used for the intended user.
     gplus_id = credentials.id_token["sub"]
-    if result["user_id"] != gplus_id:
-        logging.debug("Access token from Google doesn't match user ID")
-        response = make_response(json.dumps(
-            "Token's user ID doesn't match given user ID."), 401)
-        response.headers["Content-Type"] = "application/json"
-        return response
-
-    # Verify that the access token is valid for this app.
-    if result["issued_to"] != CLIENT_ID:
-        logging.debug("Access token clientID from Google doesn't match app's")
-        response = make_response(json.dumps(
-            "Token's client ID does not match app's."), 401)
-        response.headers["Content-Type"] = "application/json"
-        return response
 
     stored_access_token = login_session.get("access_token")
     stored_gplus_id = login_session.get("gplus_id")
     if stored_access_token is not None and gplus_id == stored_gplus_id:
-        logging.debug("User has already connected")
+        log.debug("User has already connected")
         response = make_response(json.dumps(
             "Current user is already connected."), 200)
         response.headers["Content-Type"] = "application/json"
@@ -542,11 +1267,11 @@ def gconnect():
     login_session["gplus_id"] = gplus_id
 
     # Get user info
-    userinfo_url = "https://www.googleapis.com/oauth2/v1/userinfo"
-    params = {"access_token": credentials.access_token, "alt": "json"}
-    answer = requests.get(userinfo_url, params=params)
-
-    data = answer.json()
+    try:
+        data = oauth.googleUser(credentials.access_token,
+                                credentials.token_response.get("expires_in"))
+    except requests.RequestException as e:
+        return providerUnavailable("Google", e)
 
     login_session["provider"] = "google"
     login_session["username"] = data["name"]
@@ -557,9 +1282,9 @@ def gconnect():
     user_id = getUserID(login_session["email"])
     if user_id is None:
         user_id = createUser(login_session)
-        logging.debug("New user signed up {0}".format(user_id))
+        log.debug("New user signed up %s", user_id)
     else:
-        logging.debug("User {0} has connected".format(user_id))
+        log.debug("User %s has connected", user_id)
     login_session["user_id"] = user_id
 
     output = ''
@@ -593,17 +1318,16 @@ def gdisconnect():
     """
     access_token = login_session.get("access_token")
     if access_token is None:
-        logging.debug("Access Token is None")
+        log.debug("Access Token is None")
         flash("There was an issue logging out")
         return redirect(url_for("showItems"))
-    logging.debug("In gdisconnect access token is {0}".format(access_token))
-    logging.debug("User name is: ")
-    logging.debug(login_session["username"])
-    url = ("https://accounts.google.com/"
-           "o/oauth2/revoke?token={0}".format(login_session["access_token"]))
-    h = httplib2.Http()
-    result = h.request(url, "GET")[0]
-    logging.debug("result is {0}".format(result))
+    log.debug("In gdisconnect access token is %s", access_token)
+    log.debug("User name is: %s", login_session["username"])
+    try:
+        result = oauth.revokeGoogle(access_token)
+        log.debug("result is %s", result.status_code)
+    except requests.RequestException as e:
+        log.debug("Unable to revoke the Google token %s", e)
     return
 
 
@@ -624,43 +1348,26 @@ def fbconnect():
     authenticate.html page to indicate success or failure.
     """
     if request.args.get("state") != login_session["state"]:
-        logging.debug("Invalid state parameter")
+        log.debug("Invalid state parameter")
         response = make_response(json.dumps("Invalid state parameter."), 401)
         response.headers["Content-Type"] = "application/json"
         return response
     access_token = request.data
-    logging.debug("access token received {0} ".format(access_token))
-
-    app_id = json.loads(open("fb_client_secrets.json", "r").read())[
-        "web"]["app_id"]
-    app_secret = json.loads(open("fb_client_secrets.json", "r").read())[
-        "web"]["app_secret"]
-    url = ("https://graph.facebook.com/"
-           "oauth/access_token?grant_type=fb_exchange_token"
-           "&client_id={0}&client_secret={1}&fb_exchange_token={2}".
-           format(app_id, app_secret, access_token))
-
-    h = httplib2.Http()
-    result = h.request(url, "GET")[1]
-
-    # Use token to get user info from API
-    userinfo_url = "https://graph.facebook.com/v2.10/me"
-
-    # Due to the formatting for the result from the server token exchange we
-    # have to split the token first on commas and select the first index which
-    # gives us the key : value for the server access token then we split it on
-    # colons to pull out the actual token value  and replace the remaining
-    # quotes with nothing so that it can be used directly in the graph api
-    # calls
-
-    token = result.split(',')[0].split(':')[1].replace('"', '')
-
-    url = ("https://graph.facebook.com/"
-           "v2.10/me?access_token={0}&fields=name,id,email".format(token))
-    h = httplib2.Http()
-    result = h.request(url, "GET")[1]
-    data = json.loads(result)
-    logging.debug(data)
+    log.debug("access token received %s ", access_token)
+
+    try:
+        token, data, picture = oauth.facebookLogin(
+            FACEBOOK_SECRETS["app_id"], FACEBOOK_SECRETS["app_secret"],
+            access_token)
+    except requests.RequestException as e:
+        return providerUnavailable("Facebook", e)
+    if token is None or "error" in data or "error" in picture:
+        log.debug("Failed to fetch the Facebook user %s", data)
+        response = make_response(json.dumps(
+            "Failed to fetch the Facebook user."), 401)
+        response.headers["Content-Type"] = "application/json"
+        return response
+    log.debug(data)
     login_session["provider"] = "facebook"
     login_session["username"] = data["name"]
     login_session["email"] = data["email"]
@@ -669,23 +1376,15 @@ def fbconnect():
     # The token must be stored in the login_session in order to properly logout
     login_session["access_token"] = token
 
-    # Get user picture
-    url = ("https://graph.facebook.com/"
-           "v2.10/me/picture?access_token={0}"
-           "&redirect=0&height=200&width=200".format(token))
-    h = httplib2.Http()
-    result = h.request(url, "GET")[1]
-    data = json.loads(result)
-
-    login_session["picture"] = data["data"]["url"]
+    login_session["picture"] = picture["data"]["url"]
 
     # check to see if user already exists and add into the User table if not
     user_id = getUserID(login_session["email"])
     if user_id is None:
         user_id = createUser(login_session)
-        logging.debug("New user signed up {0}".format(user_id))
+        log.debug("New user signed up %s", user_id)
     else:
-        logging.debug("User {0} has connected".format(user_id))
+        log.debug("User %s has connected", user_id)
 
     login_session["user_id"] = user_id
 
@@ -721,12 +1420,11 @@ def fbdisconnect():
     facebook_id = login_session["facebook_id"]
     # The access token must me included to successfully logout
     access_token = login_session["access_token"]
-    url = ("https://graph.facebook.com/"
-           "{0}/permissions?access_token={1}".
-           format(facebook_id, access_token))
-    h = httplib2.Http()
-    result = h.request(url, "DELETE")[1]
-    logging.debug("result is {0}".format(result))
+    try:
+        result = oauth.revokeFacebook(facebook_id, access_token)
+        log.debug("result is %s", result.text)
+    except requests.RequestException as e:
+        log.debug("Unable to revoke the Facebook token %s", e)
     return
 
 
@@ -747,8 +1445,7 @@ def disconnect():
     A response object to redirect the user to the items.html page.
     """
     if "provider" in login_session:
-        logging.debug("User {0} is logging out".
-                      format(login_session["user_id"]))
+        log.debug("User %s is logging out", login_session["user_id"])
         if login_session["provider"] == "google":
             gdisconnect()
             del login_session["gplus_id"]
@@ -764,10 +1461,53 @@ def disconnect():
         flash("You are a mere mortal")
         return redirect(url_for("showItems"))
     else:
-        logging.debug("None auth'd user attempting to logout")
+        log.debug("None auth'd user attempting to logout")
         flash("You were not logged in")
         return redirect(url_for("showItems"))
 
+
+def jsonError(message, status):
+    """
+    Function to build a JSON API error response.
+
+    Parameters
+    =======================================================
+    message - string
+        What went wrong.
+    status - int
+        The HTTP status code.
+
+    Returns
+    =======================================================
+    A flask response object holding message as JSON.
+    """
+    response = make_response(json.dumps(message), status)
+    response.headers["Content-Type"] = "application/json"
+    return response
+
+
+def providerUnavailable(provider, error):
+    """
+    Function to build the response sent when an OAuth provider could not be
+    reached or did not answer in time.
+
+    Parameters
+    =======================================================
+    provider - string
+        The name of the provider.
+    error - requests.RequestException
+        The error raised by the HTTP client.
+
+    Returns
+    =======================================================
+    A 503 response object with a JSON body.
+    """
+    log.debug("Unable to reach %s: %s", provider, error)
+    response = make_response(json.dumps(
+        "Unable to reach {0}, please try again.".format(provider)), 503)
+    response.headers["Content-Type"] = "application/json"
+    return response
+
 # User Helper Functions
 # Create a new user
 
@@ -791,9 +1531,11 @@ def createUser(login_session):
                    email=login_session["email"],
                    picture=login_session["picture"])
     session.add(newUser)
+    session.flush()
+    user_id = newUser.id
     session.commit()
-    user = session.query(User).filter_by(email=login_session["email"]).one()
-    return user.id
+    userCache.set("email:{0}".format(login_session["email"]), user_id)
+    return user_id
 
 
 def getUserInfo(user_id):
@@ -831,14 +1573,112 @@ def getUserID(email):
         The user.id value of the User object associated with the specified
         email address
     """
-    try:
-        user = session.query(User).filter_by(email=email).one()
-        return user.id
-    except:
-        return None
+    def loadUserID():
+        try:
+            return session.query(User.id).filter_by(email=email).one()[0]
+        except:
+            return None
+
+    return userCache.get("email:{0}".format(email), loadUserID)
+
+
+# Category maintenance
+
+
+def upsertCategory(name):
+    """
+    Function to find the Category called name, creating it if it does not
+    exist yet, inside the current transaction. On sqlite and Postgres the
+    category is created with INSERT ... ON CONFLICT DO NOTHING, so two
+    requests adding the same new category at once cannot trip over each
+    other.
+
+    Parameters
+    =======================================================
+    name - string
+        The name of the category.
+
+    Returns
+    =======================================================
+    int -
+        The category.id value of the existing or new category.
+    """
+    table = Category.__table__
+    dialect = session.get_bind().dialect.name
+    category_id = None
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        category_id = session.execute(
+            insert(table).values(name=name).
+            on_conflict_do_nothing(index_elements=["name"]).
+            returning(table.c.id)).scalar()
+    if category_id is None:
+        category_id = session.execute(
+            select(table.c.id).where(table.c.name == name)).scalar()
+        if category_id is not None:
+            return category_id
+        category_id = session.execute(
+            table.insert().values(name=name)).inserted_primary_key[0]
+
+    log.debug("New category %s created", name)
+    markStale(session, categoryCache)
+    return category_id
+
+
+def bulkCategory(categoryIds, name):
+    """
+    Function to find the id of the Category called name for bulkItems,
+    creating the category the first time a missing one is asked for.
+
+    Parameters
+    =======================================================
+    categoryIds - dictionary
+        The ids of the categories looked up so far, by name. Updated in
+        place.
+    name - string
+        The name of the category.
+
+    Returns
+    =======================================================
+    int -
+        The category.id value of the existing or new category.
+    """
+    if name not in categoryIds:
+        categoryIds[name] = upsertCategory(name)
+    return categoryIds[name]
+
+
+def removeIfEmpty(category_id):
+    """
+    Function to delete a Category inside the current transaction if no item
+    falls under it any more. The maintained item_count is checked in the
+    DELETE itself, so an item added to the category by another request at the
+    same time keeps its category. Does nothing when the background sweeper
+    is enabled.
+
+    Parameters
+    =======================================================
+    category_id - int
+        The category.id value of the category to check.
+
+    Returns
+    =======================================================
+    bool -
+        True if the category was deleted.
+    """
+    if app.config["SWEEP_INTERVAL"] or category_id is None:
+        return False
+    table = Category.__table__
+    result = session.execute(delete(table).where(
+        table.c.id == category_id, table.c.item_count <= 0))
+    if result.rowcount:
+        log.debug("Deleted empty category %s", category_id)
+        markStale(session, categoryCache)
+        return True
+    return False
 
 
 if __name__ == '__main__':
-    app.secret_key = "super_secret_key"
+    app.secret_key = os.environ.get("CATALOG_SECRET_KEY", "super_secret_key")
     app.debug = True
-    app.run(host="0.0.0.0", port=5000)
+    app.run(host="0.0.0.0", port=5000, threaded=True)
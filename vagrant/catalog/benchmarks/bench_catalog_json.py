@@ -0,0 +1,137 @@
+#!/usr/local/bin/python3
+"""
+The bench_catalog_json.py module is a standalone benchmark comparing the query
+count and latency of building the '/catalog/JSON' Category->Item tree the old
+way (one item query per category) against the single eager-loaded query used
+by application.py.
+
+The benchmark runs against a throwaway sqlite database so the catalog.db used
+for development is left untouched.
+
+Usage
+=======================================================
+$> python benchmarks/bench_catalog_json.py [--categories 1000] [--items 100000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+CATALOG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CATALOG_DIR)
+
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.orm import sessionmaker, joinedload  # noqa: E402
+from models import Base, Item, Category, User  # noqa: E402
+
+
+class QueryCounter(object):
+    """
+    Counts the SQL statements an engine executes while it is active.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _onExecute(self, conn, cursor, statement, parameters, context,
+                   executemany):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, "before_cursor_execute", self._onExecute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._onExecute)
+
+
+def populate(engine, numCategories, numItems):
+    """
+    Seed the benchmark database with a single user, numCategories categories
+    and numItems items spread evenly across them.
+    """
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(),
+                     [{"name": "bench", "email": "bench@example.com"}])
+        conn.execute(Category.__table__.insert(),
+                     [{"id": c + 1, "name": "category{0:05d}".format(c)}
+                      for c in range(numCategories)])
+        conn.execute(Item.__table__.insert(),
+                     [{"name": "item{0:07d}".format(i),
+                       "description": "description for item {0}".format(i),
+                       "category_id": (i % numCategories) + 1,
+                       "user_id": 1}
+                      for i in range(numItems)])
+
+
+def treeBefore(session):
+    """
+    The original N+1 implementation of allItemsByAllCategoryJSON.
+    """
+    categories = session.query(Category).order_by(Category.name).all()
+    cate_dict = [entry.serialize for entry in categories]
+    for entry in cate_dict:
+        items = session.query(Item).filter_by(
+            category_id=entry["id"]).order_by(Item.name).all()
+        entry["Item"] = [item.serialize for item in items]
+    return cate_dict
+
+
+def treeAfter(session):
+    """
+    The eager-loaded implementation of allItemsByAllCategoryJSON.
+    """
+    categories = session.query(Category).options(
+        joinedload(Category.items)).order_by(Category.name).all()
+    cate_dict = []
+    for entry in categories:
+        entry_dict = entry.serialize
+        entry_dict["Item"] = [item.serialize for item in entry.items]
+        cate_dict.append(entry_dict)
+    return cate_dict
+
+
+def run(engine, label, builder, repeat):
+    """
+    Time builder against a fresh session repeat times and report the best
+    latency along with the number of queries issued per call.
+    """
+    DBSession = sessionmaker(bind=engine)
+    best = None
+    for _ in range(repeat):
+        session = DBSession()
+        with QueryCounter(engine) as counter:
+            start = time.perf_counter()
+            tree = builder(session)
+            elapsed = time.perf_counter() - start
+        session.close()
+        best = elapsed if best is None else min(best, elapsed)
+    print("{0:<8} queries={1:<6} latency={2:8.1f} ms".
+          format(label, counter.count, best * 1000))
+    return tree
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--categories", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite:///" + os.path.join(
+        tempfile.mkdtemp(prefix="catalog-bench-"), "bench.db"))
+    Base.metadata.create_all(engine)
+    populate(engine, args.categories, args.items)
+    print("{0} categories, {1} items".format(args.categories, args.items))
+
+    before = run(engine, "before", treeBefore, args.repeat)
+    after = run(engine, "after", treeAfter, args.repeat)
+    if before != after:
+        raise ValueError("eager-loaded tree does not match the original")
+
+
+if __name__ == "__main__":
+    main()
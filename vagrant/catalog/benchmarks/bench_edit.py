@@ -0,0 +1,229 @@
+#!/usr/local/bin/python3
+"""
+The bench_edit.py module is a standalone benchmark measuring the throughput of
+'/catalog/item/<id>/edit' with several writers editing items at once, for the
+old delete-then-reinsert edit and for the in-place edit.
+
+Each writer thread owns its own items and moves them between categories,
+sometimes into a brand new one, so both the category upsert and the removal
+of emptied categories are exercised. The old edit is run by swapping a copy
+of it in for the editItem view. Each mode runs in a fresh child process
+against its own copy of the database.
+
+Usage
+=======================================================
+$> python benchmarks/bench_edit.py [--writers 1,4,8] [--edits 200]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+CATALOG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CATALOG_DIR)
+
+
+def populate(dbPath, numItems, numCategories, numWriters):
+    """
+    Create a throwaway sqlite database at dbPath holding numItems items spread
+    evenly across numCategories categories, plus the items the writers edit.
+    """
+    from sqlalchemy import create_engine
+    from models import Base, Item, Category, User
+
+    engine = create_engine("sqlite:///" + dbPath)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(),
+                     [{"name": "bench", "email": "bench@example.com"}])
+        conn.execute(Category.__table__.insert(),
+                     [{"id": c + 1, "name": "category{0:05d}".format(c)}
+                      for c in range(numCategories)])
+        conn.execute(Item.__table__.insert(), [
+            {"name": "item{0:07d}".format(i),
+             "description": "description for item {0}".format(i),
+             "category_id": (i % numCategories) + 1, "user_id": 1}
+            for i in range(numItems)])
+        conn.execute(Item.__table__.insert(), [
+            {"name": "writer{0}-{1}".format(w, k),
+             "description": "edited by writer {0}".format(w),
+             "category_id": (k % numCategories) + 1, "user_id": 1}
+            for w in range(numWriters) for k in range(10)])
+    engine.dispose()
+
+
+def legacyEditItem(item_id):
+    """
+    The editItem view as it was before edits were made in place, deleting
+    the item, committing, and adding it back under a new id.
+    """
+    from flask import session as login_session
+    from flask import request, redirect, url_for, flash
+    from sqlalchemy import func
+    from application import session, getUserInfo
+    from models import Item, Category
+
+    editedItem = session.query(Item).filter_by(id=item_id).one()
+    item_name = editedItem.name
+    creator = getUserInfo(editedItem.user_id)
+    if creator.id != login_session["user_id"]:
+        return redirect(url_for("showItems"))
+
+    category = editedItem.category
+    session.delete(editedItem)
+    itemsForCat = session.query(Item.id).join(
+        Category).filter_by(name=category.name)
+    count = session.query(func.count(itemsForCat.scalar_subquery())).scalar()
+    if count == 0:
+        session.delete(category)
+    session.commit()
+
+    existingItem = session.query(Item).filter_by(name=item_name).first()
+    if not existingItem:
+        existingCategory = session.query(Category).filter_by(
+            name=request.form["category"]).first()
+        if not existingCategory:
+            session.add(Category(name=request.form["category"]))
+            existingCategory = session.query(Category).filter_by(
+                name=request.form["category"]).one()
+        session.add(Item(user_id=login_session["user_id"], name=item_name,
+                         description=request.form["description"],
+                         category_id=existingCategory.id))
+        try:
+            session.commit()
+        except Exception:
+            session.rollback()
+            flash("Failed to edit item {0}".format(item_name))
+    return redirect(url_for("showItems"))
+
+
+def child(dbPath, mode, numWriters, numEdits, numCategories):
+    """
+    Run numEdits edits from each of numWriters threads against dbPath and
+    print the results as JSON.
+    """
+    os.environ["CATALOG_DATABASE_URL"] = "sqlite:///" + dbPath
+    os.chdir(CATALOG_DIR)
+    import logging
+    import application
+    from database import DBSession
+    from models import Item, Category
+    logging.disable(logging.CRITICAL)
+
+    if mode == "legacy":
+        application.app.view_functions["editItem"] = legacyEditItem
+
+    session = DBSession()
+    before = dict((item.name, item.id) for item in
+                  session.query(Item).filter(Item.name.like("writer%")))
+    DBSession.remove()
+
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def writer(index):
+        rand = random.Random(index)
+        client = application.app.test_client()
+        with client.session_transaction() as sess:
+            sess["username"] = "bench"
+            sess["user_id"] = 1
+        for edit in range(numEdits):
+            name = "writer{0}-{1}".format(index, rand.randrange(10))
+            # The old edit gives the item a new id, so look it up each time.
+            item_id = DBSession().query(Item.id).filter_by(name=name).scalar()
+            DBSession.remove()
+            if rand.random() < 0.1:
+                category = "fresh-{0}-{1}".format(index, edit)
+            else:
+                category = "category{0:05d}".format(
+                    rand.randrange(numCategories))
+            start = time.perf_counter()
+            response = client.post(
+                "/catalog/item/{0}/edit".format(item_id),
+                data={"description": "edit {0}".format(edit),
+                      "category": category})
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code != 302:
+                    failures.append(response.status_code)
+
+    pool = [threading.Thread(target=writer, args=(index,))
+            for index in range(numWriters)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    session = DBSession()
+    after = dict((item.name, item.id) for item in
+                 session.query(Item).filter(Item.name.like("writer%")))
+    orphans = session.query(Category).filter(
+        ~Category.items.any()).count()
+    DBSession.remove()
+
+    latencies.sort()
+    print(json.dumps({
+        "edits": len(latencies),
+        "failures": len(failures),
+        "edits_per_s": len(latencies) / wall,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "lost_items": len(before) - len(after),
+        "changed_ids": sum(1 for name, item_id in after.items()
+                           if before.get(name) != item_id),
+        "empty_categories": orphans,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--writers", default="1,4,8")
+    parser.add_argument("--edits", type=int, default=200,
+                        help="edits per writer")
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--categories", type=int, default=100)
+    parser.add_argument("--child", nargs=5, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        dbPath, mode, numWriters, numEdits, numCategories = args.child
+        child(dbPath, mode, int(numWriters), int(numEdits),
+              int(numCategories))
+        return
+
+    workDir = tempfile.mkdtemp(prefix="catalog-bench-")
+    print("{0:>7} {1:<8} {2:>9} {3:>9} {4:>9} {5:>9} {6:>11} {7:>7}".format(
+        "writers", "mode", "edits/s", "p50 ms", "p99 ms", "failures",
+        "changed ids", "orphans"))
+    for numWriters in [int(count) for count in args.writers.split(",")]:
+        seed = os.path.join(workDir, "seed{0}.db".format(numWriters))
+        populate(seed, args.items, args.categories, numWriters)
+        for mode in ("legacy", "inplace"):
+            dbPath = os.path.join(workDir, "{0}{1}.db".format(
+                mode, numWriters))
+            shutil.copyfile(seed, dbPath)
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), "--child",
+                 dbPath, mode, str(numWriters), str(args.edits),
+                 str(args.categories)], stderr=subprocess.DEVNULL)
+            result = json.loads(output.decode("utf-8").splitlines()[-1])
+            print("{0:>7} {1:<8} {2:>9.1f} {3:>9.2f} {4:>9.2f} {5:>9} "
+                  "{6:>11} {7:>7}".format(
+                      numWriters, mode, result["edits_per_s"],
+                      result["p50_ms"], result["p99_ms"],
+                      result["failures"] + result["lost_items"],
+                      result["changed_ids"], result["empty_categories"]))
+
+
+if __name__ == "__main__":
+    main()
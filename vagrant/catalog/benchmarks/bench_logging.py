@@ -0,0 +1,137 @@
+#!/usr/local/bin/python3
+"""
+The bench_logging.py module is a standalone benchmark measuring what logging
+adds to the latency of requests that log, with logging off, with records
+written straight to the log file and console by the request threads, and with
+records handed to the queued JSON pipeline in logconfig.py.
+
+Every request adds or edits an item, each of which logs a couple of DEBUG
+records. The synchronous mode installs the handlers the application used
+before logconfig.py, a plain file handler and a console handler on the root
+logger. Each mode runs in a fresh child process against its own database,
+with the console going to /dev/null.
+
+Usage
+=======================================================
+$> python benchmarks/bench_logging.py [--threads 1,4] [--requests 300]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+CATALOG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CATALOG_DIR)
+
+
+def child(workDir, mode, numThreads, numRequests):
+    """
+    Send numRequests requests from each of numThreads threads and print the
+    results as JSON.
+    """
+    os.environ["CATALOG_DATABASE_URL"] = "sqlite:///" + os.path.join(
+        workDir, "catalog.db")
+    os.environ["CATALOG_LOG_FILE"] = os.path.join(workDir, "debug.log")
+    if mode == "off":
+        os.environ["CATALOG_LOG_LEVEL"] = "WARNING"
+    os.chdir(CATALOG_DIR)
+    import logging
+    import application
+    import logconfig
+    from database import DBSession
+    from models import Item, User
+
+    if mode == "sync":
+        logconfig.stopLogging()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(logging.FileHandler(os.environ["CATALOG_LOG_FILE"]))
+        root.addHandler(logging.StreamHandler())
+
+    session = DBSession()
+    session.add(User(name="bench", email="bench@example.com"))
+    session.commit()
+    user_id = session.query(User.id).filter_by(name="bench").scalar()
+    DBSession.remove()
+
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(index):
+        client = application.app.test_client()
+        with client.session_transaction() as sess:
+            sess["username"] = "bench"
+            sess["user_id"] = user_id
+        client.post("/catalog/item/new/", data={
+            "name": "item-{0}".format(index), "description": "",
+            "category": "bench"})
+        item_id = DBSession().query(Item.id).filter_by(
+            name="item-{0}".format(index)).scalar()
+        DBSession.remove()
+        for count in range(numRequests):
+            start = time.perf_counter()
+            if count % 2 == 0:
+                client.post("/catalog/item/new/", data={
+                    "name": "item-{0}-{1}".format(index, count),
+                    "description": "", "category": "bench"})
+            else:
+                client.post("/catalog/item/{0}/edit".format(item_id), data={
+                    "description": "edit {0}".format(count),
+                    "category": "bench"})
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    pool = [threading.Thread(target=worker, args=(index,))
+            for index in range(numThreads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    wall = time.perf_counter() - start
+    logconfig.stopLogging()
+
+    latencies.sort()
+    print(json.dumps({
+        "requests_per_s": len(latencies) / wall,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--threads", default="1,4")
+    parser.add_argument("--requests", type=int, default=300,
+                        help="requests per thread")
+    parser.add_argument("--child", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        workDir, mode, numThreads, numRequests = args.child
+        child(workDir, mode, int(numThreads), int(numRequests))
+        return
+
+    print("{0:>7} {1:<7} {2:>11} {3:>9} {4:>9}".format(
+        "threads", "mode", "requests/s", "p50 ms", "p99 ms"))
+    for numThreads in [int(count) for count in args.threads.split(",")]:
+        for mode in ("off", "sync", "queued"):
+            workDir = tempfile.mkdtemp(prefix="catalog-bench-")
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), "--child",
+                 workDir, mode, str(numThreads), str(args.requests)],
+                stderr=subprocess.DEVNULL)
+            result = json.loads(output.decode("utf-8").splitlines()[-1])
+            print("{0:>7} {1:<7} {2:>11.1f} {3:>9.2f} {4:>9.2f}".format(
+                numThreads, mode, result["requests_per_s"],
+                result["p50_ms"], result["p99_ms"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/local/bin/python3
+"""
+The bench_login.py module is a standalone benchmark measuring the latency and
+throughput of the Google and Facebook login routes against the stub OAuth
+server in stub_oauth.py, with the provider connections kept alive and with a
+new connection opened for every call.
+
+The stub counts the connections it accepts, which shows how many provider
+calls reused a pooled connection, and the calls it answers. Logins are not
+followed by a logout, which would revoke the token, so the repeat mode can log
+in again with the tokens of the keepalive run and be answered from the token
+cache.
+
+Usage
+=======================================================
+$> python benchmarks/bench_login.py [--logins 200] [--threads 4] [--latency 20]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+CATALOG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CATALOG_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class FreshConnectionClient(object):
+    """
+    FreshConnectionClient class to send every provider call over a new
+    connection, the way the views did before oauth.py pooled them.
+    """
+
+    def __init__(self, timeout):
+        import requests
+        self.requests = requests
+        self.timeout = timeout
+
+    def send(self, call):
+        return self.requests.request(call.method, call.url,
+                                     params=call.params, timeout=self.timeout)
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        response = self.requests.request(method, uri, data=body,
+                                         headers=headers,
+                                         timeout=self.timeout)
+        response.status = response.status_code
+        return response, response.content
+
+
+def login(client, provider, user):
+    """
+    Log in as stub user number user and return the login latency.
+    """
+    with client.session_transaction() as sess:
+        sess["state"] = "bench"
+    route = "/gconnect" if provider == "google" else "/fbconnect"
+    start = time.perf_counter()
+    response = client.post(route + "?state=bench",
+                           data="user{0}".format(user))
+    elapsed = time.perf_counter() - start
+    if response.status_code != 200:
+        raise RuntimeError("{0} returned {1}: {2}".format(
+            route, response.status_code, response.data[:200]))
+    with client.session_transaction() as sess:
+        sess.pop("access_token", None)
+    return elapsed
+
+
+def run(application, stub, provider, numLogins, numThreads, firstUser):
+    """
+    Run numLogins logins spread over numThreads threads and return the
+    latencies, the wall time and the connections and calls the stub
+    accepted.
+    """
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(index):
+        client = application.app.test_client()
+        for count in range(index, numLogins, numThreads):
+            elapsed = login(client, provider, firstUser + count)
+            with lock:
+                latencies.append(elapsed)
+
+    connections, calls = stub.connections, stub.calls
+    pool = [threading.Thread(target=worker, args=(index,))
+            for index in range(numThreads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    wall = time.perf_counter() - start
+    return (sorted(latencies), wall, stub.connections - connections,
+            stub.calls - calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=20,
+                        help="milliseconds the stub delays every response")
+    args = parser.parse_args()
+
+    from stub_oauth import startStub
+    stub = startStub(args.latency / 1000.0)
+    os.environ["CATALOG_GOOGLE_API_URL"] = stub.url
+    os.environ["CATALOG_GOOGLE_ACCOUNTS_URL"] = stub.url
+    os.environ["CATALOG_FACEBOOK_URL"] = stub.url
+    os.environ["CATALOG_DATABASE_URL"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(prefix="catalog-bench-"), "catalog.db")
+    os.chdir(CATALOG_DIR)
+
+    import logging
+    import application
+    import oauth
+    logging.disable(logging.CRITICAL)
+
+    print("{0:<9} {1:<10} {2:>9} {3:>9} {4:>9} {5:>12} {6:>12}".format(
+        "provider", "mode", "logins/s", "p50 ms", "p99 ms", "conns/login",
+        "calls/login"))
+    pooled = oauth.httpClient
+    firstUser = 0
+    for provider in ("google", "facebook"):
+        for mode in ("new-conn", "keepalive", "repeat"):
+            if mode == "new-conn":
+                oauth.httpClient = FreshConnectionClient(oauth.TIMEOUT)
+            else:
+                oauth.httpClient = pooled
+            if mode == "repeat":
+                firstUser -= args.logins
+            latencies, wall, connections, calls = run(
+                application, stub, provider, args.logins, args.threads,
+                firstUser)
+            firstUser += args.logins
+            print("{0:<9} {1:<10} {2:>9.1f} {3:>9.2f} {4:>9.2f} {5:>12.2f} "
+                  "{6:>12.2f}".format(
+                      provider, mode, len(latencies) / wall,
+                      latencies[len(latencies) // 2] * 1000,
+                      latencies[int(len(latencies) * 0.99)] * 1000,
+                      float(connections) / len(latencies),
+                      float(calls) / len(latencies)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/local/bin/python3
+"""
+The bench_lookups.py module is a standalone benchmark measuring the latency of
+the by-value lookups application.py performs on every request (Item.name,
+Category.name, User.email, Item.category_id and Item.user_id) before and after
+the lookup indexes from migrations.py are applied.
+
+Usage
+=======================================================
+$> python benchmarks/bench_lookups.py [--items 1000000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+CATALOG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CATALOG_DIR)
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from models import Base, Item, Category, User  # noqa: E402
+from migrations import upgrade  # noqa: E402
+
+
+def populate(engine, numCategories, numItems, numUsers):
+    """
+    Seed the benchmark database and then drop the lookup indexes so that it
+    looks like a catalog.db built before they existed.
+    """
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(),
+                     [{"name": "user{0}".format(u),
+                       "email": "user{0}@example.com".format(u)}
+                      for u in range(numUsers)])
+        conn.execute(Category.__table__.insert(),
+                     [{"id": c + 1, "name": "category{0:05d}".format(c)}
+                      for c in range(numCategories)])
+        batch = []
+        for i in range(numItems):
+            batch.append({"name": "item{0:07d}".format(i),
+                          "description": "description for item {0}".format(i),
+                          "category_id": (i % numCategories) + 1,
+                          "user_id": (i % numUsers) + 1})
+            if len(batch) == 50000:
+                conn.execute(Item.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(Item.__table__.insert(), batch)
+        for table in (User.__table__, Category.__table__, Item.__table__):
+            for index in table.indexes:
+                index.drop(conn)
+
+
+def lookups(numCategories, numItems, numUsers):
+    """
+    The lookups to time, mirroring the queries made by application.py.
+    """
+    return [
+        ("Item by name (newItem/editItem)", lambda session: session.query(
+            Item).filter_by(name="item{0:07d}".format(numItems // 2)).one()),
+        ("Category by name (newItem/editItem)", lambda session: session.query(
+            Category).filter_by(
+            name="category{0:05d}".format(numCategories // 2)).one()),
+        ("User by email (getUserID)", lambda session: session.query(
+            User).filter_by(
+            email="user{0}@example.com".format(numUsers // 2)).one()),
+        ("Items by category (showItemsForCategory)",
+         lambda session: session.query(Item).filter_by(
+            category_id=numCategories // 2).order_by(Item.name).all()),
+        ("Items by user", lambda session: session.query(Item.id).filter_by(
+            user_id=numUsers // 2).all()),
+    ]
+
+
+def timeLookups(engine, cases, repeat):
+    """
+    Return the best latency in milliseconds for each lookup.
+    """
+    session = sessionmaker(bind=engine)()
+    results = []
+    for label, lookup in cases:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            lookup(session)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+            session.expunge_all()
+        results.append(best * 1000)
+    session.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--categories", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite:///" + os.path.join(
+        tempfile.mkdtemp(prefix="catalog-bench-"), "bench.db"))
+    populate(engine, args.categories, args.items, args.users)
+    cases = lookups(args.categories, args.items, args.users)
+
+    before = timeLookups(engine, cases, args.repeat)
+    start = time.perf_counter()
+    upgrade(engine)
+    migration = time.perf_counter() - start
+    after = timeLookups(engine, cases, args.repeat)
+
+    print("{0} items, {1} categories, {2} users - migration took {3:.1f} s".
+          format(args.items, args.categories, args.users, migration))
+    print("{0:<42} {1:>12} {2:>12}".format("lookup", "before ms", "after ms"))
+    for (label, _), beforeMs, afterMs in zip(cases, before, after):
+        print("{0:<42} {1:>12.3f} {2:>12.3f}".format(label, beforeMs, afterMs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/local/bin/python3
+"""
+The bench_search.py module is a standalone benchmark comparing item search
+with a LIKE '%term%' scan over Item.name and Item.description against the
+bm25 ranked full text index built by search.py.
+
+Usage
+=======================================================
+$> python benchmarks/bench_search.py [--items 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+CATALOG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CATALOG_DIR)
+
+from sqlalchemy import create_engine, or_  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from models import Base, Item, Category, User  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from search import searchItems  # noqa: E402
+
+VOCABULARY = ["alpine", "bamboo", "canvas", "copper", "denim", "ember",
+              "flannel", "granite", "harbor", "indigo", "juniper", "kestrel",
+              "linen", "maple", "nickel", "obsidian", "pewter", "quartz",
+              "russet", "saffron", "timber", "umber", "velvet", "walnut",
+              "yarrow", "zephyr"]
+
+
+def populate(engine, numCategories, numItems, seed):
+    """
+    Seed the benchmark database with items whose descriptions are drawn from
+    a small vocabulary plus one rare word per thousand items.
+    """
+    rand = random.Random(seed)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(),
+                     [{"name": "bench", "email": "bench@example.com"}])
+        conn.execute(Category.__table__.insert(),
+                     [{"id": c + 1, "name": "category{0:05d}".format(c)}
+                      for c in range(numCategories)])
+        batch = []
+        for i in range(numItems):
+            words = rand.sample(VOCABULARY, 6)
+            if i % 1000 == 0:
+                words.append("rareword{0}".format(i % 7))
+            batch.append({"name": "item{0:07d}".format(i),
+                          "description": " ".join(words),
+                          "category_id": (i % numCategories) + 1,
+                          "user_id": 1})
+            if len(batch) == 50000:
+                conn.execute(Item.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(Item.__table__.insert(), batch)
+
+
+def likeSearch(session, terms, limit):
+    """
+    The LIKE based search the full text index replaces.
+    """
+    query = session.query(Item)
+    for word in terms.split():
+        pattern = "%{0}%".format(word)
+        query = query.filter(or_(Item.name.like(pattern),
+                                 Item.description.like(pattern)))
+    return query.order_by(Item.name).limit(limit).all()
+
+
+def best(search, session, terms, limit, repeat):
+    """
+    Return the best latency in milliseconds and the number of results.
+    """
+    fastest = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = search(session, terms, limit)
+        elapsed = time.perf_counter() - start
+        fastest = elapsed if fastest is None else min(fastest, elapsed)
+        session.expunge_all()
+    return fastest * 1000, len(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--categories", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=1000000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite:///" + os.path.join(
+        tempfile.mkdtemp(prefix="catalog-bench-"), "bench.db"))
+    populate(engine, args.categories, args.items, args.seed)
+    start = time.perf_counter()
+    upgrade(engine)
+    print("{0} items - building the search index took {1:.1f} s".format(
+        args.items, time.perf_counter() - start))
+
+    session = sessionmaker(bind=engine)()
+    print("{0:<22} {1:>10} {2:>8} {3:>10} {4:>8}".format(
+        "terms", "like ms", "found", "fts ms", "found"))
+    for terms in ("rareword3", "copper", "copper walnut", "nomatch"):
+        likeMs, likeFound = best(likeSearch, session, terms, args.limit,
+                                 args.repeat)
+        ftsMs, ftsFound = best(searchItems, session, terms, args.limit,
+                               args.repeat)
+        print("{0:<22} {1:>10.2f} {2:>8} {3:>10.2f} {4:>8}".format(
+            terms, likeMs, likeFound, ftsMs, ftsFound))
+
+
+if __name__ == "__main__":
+    main()
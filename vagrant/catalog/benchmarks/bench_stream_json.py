@@ -0,0 +1,111 @@
+#!/usr/local/bin/python3
+"""
+The bench_stream_json.py module is a standalone benchmark measuring peak
+resident memory and time to first byte of the '/catalog/JSON' endpoint with
+the buffered jsonify response and with the streamed response.
+
+Each measurement runs in a fresh child process so that ru_maxrss reflects only
+that one request.
+
+Usage
+=======================================================
+$> python benchmarks/bench_stream_json.py [--sizes 10000,100000,1000000]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+CATALOG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CATALOG_DIR)
+
+
+def populate(dbPath, numItems, numCategories):
+    """
+    Create a throwaway sqlite database at dbPath holding numItems items spread
+    evenly across numCategories categories.
+    """
+    from sqlalchemy import create_engine
+    from models import Base, Item, Category, User
+
+    engine = create_engine("sqlite:///" + dbPath)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(),
+                     [{"name": "bench", "email": "bench@example.com"}])
+        conn.execute(Category.__table__.insert(),
+                     [{"id": c + 1, "name": "category{0:05d}".format(c)}
+                      for c in range(numCategories)])
+        batch = []
+        for i in range(numItems):
+            batch.append({"name": "item{0:07d}".format(i),
+                          "description": "description for item {0}".format(i),
+                          "category_id": (i % numCategories) + 1,
+                          "user_id": 1})
+            if len(batch) == 50000:
+                conn.execute(Item.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(Item.__table__.insert(), batch)
+    engine.dispose()
+
+
+def child(dbPath, mode):
+    """
+    Serve a single '/catalog/JSON' request against dbPath and print the peak
+    RSS, time to first byte, total time and response size.
+    """
+    os.environ["CATALOG_DATABASE_URL"] = "sqlite:///" + dbPath
+    os.chdir(CATALOG_DIR)
+    import application
+
+    client = application.app.test_client()
+    url = "/catalog/JSON?stream=1" if mode == "stream" else "/catalog/JSON"
+
+    start = time.perf_counter()
+    response = client.get(url, buffered=False)
+    firstByte = None
+    size = 0
+    for chunk in response.response:
+        if firstByte is None:
+            firstByte = time.perf_counter() - start
+        size += len(chunk)
+    total = time.perf_counter() - start
+    response.close()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("{0} {1} {2} {3}".format(peak, firstByte, total, size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--categories", type=int, default=1000)
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    workDir = tempfile.mkdtemp(prefix="catalog-bench-")
+    print("{0:>9} {1:<9} {2:>10} {3:>10} {4:>10} {5:>12}".format(
+        "items", "mode", "peak MiB", "ttfb ms", "total ms", "bytes"))
+    for numItems in [int(size) for size in args.sizes.split(",")]:
+        dbPath = os.path.join(workDir, "bench{0}.db".format(numItems))
+        populate(dbPath, numItems, args.categories)
+        for mode in ("buffered", "stream"):
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__),
+                 "--child", dbPath, mode], stderr=subprocess.DEVNULL)
+            peak, firstByte, total, size = output.split()[-4:]
+            print("{0:>9} {1:<9} {2:>10.1f} {3:>10.1f} {4:>10.1f} {5:>12}".
+                  format(numItems, mode, int(peak) / 1024.0,
+                         float(firstByte) * 1000, float(total) * 1000,
+                         int(size)))
+
+
+if __name__ == "__main__":
+    main()
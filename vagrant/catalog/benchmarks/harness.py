@@ -0,0 +1,310 @@
+#!/usr/local/bin/python3
+"""
+The harness.py module is a load test harness for the Catalog Application.
+
+It fills a throwaway sqlite database with synthetic data from synthetic.py,
+then drives the routes of application.py through the Flask test client from
+one or more threads and reports, per route, the p50/p95/p99 latency, the
+throughput and the number of SQL statements issued per request.
+
+The report is written as JSON so that runs against different commits can be
+compared. The login and logout routes ('/auth/', '/gconnect', '/fbconnect'
+and the disconnect routes) are left out as they need the Google and Facebook
+servers, and '/page' is left out as its template is missing. The deleteItem
+POSTs remove the items the newItem POSTs added.
+
+Usage
+=======================================================
+$> python benchmarks/harness.py --items 100000 --output run.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+CATALOG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CATALOG_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, fraction):
+    """
+    Return the nearest-rank percentile of a sorted list of values.
+    """
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1,
+                      int(round(fraction * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def gitCommit():
+    """
+    Return the commit the catalog code is checked out at, if known.
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=CATALOG_DIR,
+            stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except Exception:
+        return None
+
+
+class QueryCounter(object):
+    """
+    QueryCounter class to count the SQL statements each thread issues.
+    """
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.local = threading.local()
+        event.listen(engine, "before_cursor_execute", self._onExecute)
+
+    def _onExecute(self, conn, cursor, statement, parameters, context,
+                   executemany):
+        self.local.count = getattr(self.local, "count", 0) + 1
+
+    def reset(self):
+        self.local.count = 0
+
+    def value(self):
+        return getattr(self.local, "count", 0)
+
+
+def routes(rand, itemIds, ownedIds, categoryIds, fullExportRequests,
+           createdIds):
+    """
+    The routes to exercise as (name, method, weight, needs login, request
+    builder) tuples. Each builder returns the URL and the form data, or for
+    "POST JSON" routes the JSON body, of one request. createdIds returns the
+    ids of the items the newItem POSTs added, for the deleteItem POSTs.
+    """
+    counter = iter(range(10 ** 9))
+    words = ["copper", "walnut", "portable lamp", "velvet scarf", "nomatch"]
+    created = []
+
+    def category():
+        return "category{0:05d}".format(rand.randint(0, 50))
+
+    def deleteTarget():
+        if not created:
+            created.extend(createdIds())
+        return created.pop() if created else rand.choice(ownedIds)
+
+    return [
+        ("showItems", "GET", 1.0, False,
+         lambda: ("/catalog/", None)),
+        ("showItems page 2", "GET", 1.0, False,
+         lambda: ("/catalog/?limit=50&after=WyJtIiwgMF0", None)),
+        ("showItemsForCategory", "GET", 1.0, False,
+         lambda: ("/catalog/category/{0}/".format(
+             rand.choice(categoryIds)), None)),
+        ("showSearchResults", "GET", 1.0, False,
+         lambda: ("/catalog/search?q={0}".format(rand.choice(words)), None)),
+        ("allItemsByAllCategoryJSON page", "GET", 1.0, False,
+         lambda: ("/catalog/JSON?limit=100", None)),
+        ("allItemsByAllCategoryJSON", "GET", fullExportRequests, False,
+         lambda: ("/catalog/JSON", None)),
+        ("itemDetailsJSON", "GET", 1.0, False,
+         lambda: ("/catalog/item/{0}/JSON".format(rand.choice(itemIds)),
+                  None)),
+        ("allCategoriesJSON", "GET", 1.0, False,
+         lambda: ("/catalog/category/JSON", None)),
+        ("searchResultsJSON", "GET", 1.0, False,
+         lambda: ("/catalog/search/JSON?q={0}".format(rand.choice(words)),
+                  None)),
+        ("newItem form", "GET", 1.0, True,
+         lambda: ("/catalog/item/new/", None)),
+        ("newItem", "POST", 1.0, True,
+         lambda: ("/catalog/item/new/", {
+             "name": "harness item {0}".format(next(counter)),
+             "description": "added by the load test harness",
+             "category": category()})),
+        ("editItem form", "GET", 1.0, True,
+         lambda: ("/catalog/item/{0}/edit".format(rand.choice(ownedIds)),
+                  None)),
+        ("deleteItem form", "GET", 1.0, True,
+         lambda: ("/catalog/item/{0}/delete".format(rand.choice(ownedIds)),
+                  None)),
+        ("editItem", "POST", 1.0, True,
+         lambda: ("/catalog/item/{0}/edit".format(rand.choice(ownedIds)), {
+             "description": "edited by the load test harness",
+             "category": category()})),
+        ("itemsDetailsJSON", "GET", 1.0, False,
+         lambda: ("/catalog/items/JSON?ids={0}".format(",".join(
+             str(rand.choice(itemIds)) for _ in range(10))), None)),
+        ("bulkItems", "POST JSON", 1.0, True,
+         lambda: ("/catalog/items/bulk", {"operations": [
+             {"op": "create",
+              "name": "harness bulk item {0}".format(next(counter)),
+              "description": "added by the load test harness",
+              "category": category()},
+             {"op": "update", "id": rand.choice(ownedIds),
+              "description": "edited by the load test harness"},
+             {"op": "update", "id": rand.choice(ownedIds),
+              "category": category()}]})),
+        ("metrics", "GET", 1.0, False,
+         lambda: ("/metrics", None)),
+        ("deleteItem", "POST", 1.0, True,
+         lambda: ("/catalog/item/{0}/delete".format(deleteTarget()), {})),
+    ]
+
+
+def runRoute(app, counter, route, requests, threads, user):
+    """
+    Send requests requests for one route spread over threads threads and
+    return the route's report.
+    """
+    name, method, weight, needsLogin, build = route
+    total = max(1, int(requests * weight))
+    latencies = []
+    queries = []
+    statuses = {}
+    lock = threading.Lock()
+    buildLock = threading.Lock()
+
+    def worker(count):
+        client = app.test_client()
+        if needsLogin:
+            with client.session_transaction() as sess:
+                sess["username"] = user["name"]
+                sess["user_id"] = user["id"]
+        for _ in range(count):
+            with buildLock:
+                url, data = build()
+            counter.reset()
+            start = time.perf_counter()
+            if method == "POST JSON":
+                response = client.post(url, json=data)
+            elif method == "POST":
+                response = client.post(url, data=data)
+            else:
+                response = client.get(url)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                queries.append(counter.value())
+                statuses[response.status_code] = statuses.get(
+                    response.status_code, 0) + 1
+
+    shares = [total // threads + (1 if i < total % threads else 0)
+              for i in range(threads)]
+    pool = [threading.Thread(target=worker, args=(share,))
+            for share in shares if share]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "route": name,
+        "method": method,
+        "requests": len(latencies),
+        "statuses": dict((str(code), count)
+                         for code, count in statuses.items()),
+        "throughput_rps": len(latencies) / wall if wall else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": latencies[-1] * 1000,
+        },
+        "queries_per_request": {
+            "mean": float(sum(queries)) / len(queries),
+            "max": max(queries),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--categories", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--skew", type=float, default=1.1)
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests per route")
+    parser.add_argument("--full-export-requests", type=int, default=3,
+                        help="requests for the unpaged /catalog/JSON")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--no-cache", action="store_true",
+                        help="disable the category and page caches")
+    parser.add_argument("--output", default="-",
+                        help="JSON report file (default: stdout)")
+    args = parser.parse_args()
+
+    workDir = tempfile.mkdtemp(prefix="catalog-harness-")
+    os.environ["CATALOG_DATABASE_URL"] = "sqlite:///" + os.path.join(
+        workDir, "catalog.db")
+    if args.no_cache:
+        os.environ["CATALOG_CACHE_TTL"] = "0"
+    os.chdir(CATALOG_DIR)
+
+    import logging
+    import application
+    from database import engine
+    from models import Item, Category, User
+    from synthetic import loadCatalog
+    from sqlalchemy import select
+    logging.disable(logging.CRITICAL)
+
+    start = time.perf_counter()
+    loadCatalog(engine, args.users, args.categories, args.items, args.seed,
+                args.skew)
+    loadSeconds = time.perf_counter() - start
+
+    with engine.connect() as conn:
+        itemIds = [row[0] for row in conn.execute(select(Item.id))]
+        categoryIds = [row[0] for row in conn.execute(select(Category.id))]
+        user_id, name = conn.execute(select(User.id, User.name).where(
+            User.email == "user00000@example.com")).one()
+        ownedIds = [row[0] for row in conn.execute(
+            select(Item.id).where(Item.user_id == user_id).limit(10000))]
+
+    def createdIds():
+        with engine.connect() as conn:
+            return [row[0] for row in conn.execute(select(Item.id).where(
+                Item.name.like("harness item %")))]
+
+    rand = random.Random(args.seed)
+    counter = QueryCounter(engine)
+    report = {
+        "commit": gitCommit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "parameters": vars(args),
+        "load_seconds": loadSeconds,
+        "routes": [],
+    }
+    for route in routes(rand, itemIds, ownedIds, categoryIds,
+                        float(args.full_export_requests) / args.requests,
+                        createdIds):
+        result = runRoute(application.app, counter, route, args.requests,
+                          args.threads, {"id": user_id, "name": name})
+        sys.stderr.write("{0:<32} p50 {1:9.2f} ms  p99 {2:9.2f} ms  "
+                         "{3:6.1f} queries\n".format(
+                             result["route"], result["latency_ms"]["p50"],
+                             result["latency_ms"]["p99"],
+                             result["queries_per_request"]["mean"]))
+        report["routes"].append(result)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as stream:
+            stream.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#!/usr/local/bin/python3
+"""
+The stub_oauth.py module is a stand in for the Google and Facebook OAuth
+servers, so that the login and logout routes of the Catalog Application can
+be exercised and benchmarked offline.
+
+It answers every provider call made through oauth.py with canned but
+consistent data. The authorization code or Facebook token the browser would
+have posted names the user, so posting "user42" logs in as stub user 42.
+Responses can be delayed to mimic the round trip to a real provider, and the
+server counts the connections it accepts so that connection reuse can be
+checked.
+
+Google id_tokens are signed with an RSA key made up when the server starts,
+whose self-signed certificate is served at /oauth2/v1/certs, so the tokens
+pass the same checks as Google's.
+
+Point the application at it with CATALOG_GOOGLE_API_URL,
+CATALOG_GOOGLE_ACCOUNTS_URL and CATALOG_FACEBOOK_URL.
+
+Usage
+=======================================================
+$> python benchmarks/stub_oauth.py --port 8765 --latency 50
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from pyasn1.codec.der import encoder
+from pyasn1.type import univ, useful
+from pyasn1_modules import rfc2459
+
+import argparse
+import base64
+import json
+import os
+import rsa
+import threading
+import time
+
+CATALOG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def encodeSegment(value):
+    """
+    Encode a JWT header or payload segment.
+    """
+    return base64.urlsafe_b64encode(json.dumps(value).encode(
+        "utf-8")).rstrip(b"=").decode("ascii")
+
+
+def algorithm(oid):
+    """
+    Return an X.509 AlgorithmIdentifier for oid with NULL parameters.
+    """
+    identifier = rfc2459.AlgorithmIdentifier()
+    identifier["algorithm"] = univ.ObjectIdentifier(oid)
+    identifier["parameters"] = univ.Null("")
+    return identifier
+
+
+def makeCertificate(publicKey, privateKey):
+    """
+    Return a minimal self-signed PEM certificate for publicKey, which is all
+    oauth2client needs to check a token's signature.
+    """
+    name = rfc2459.Name()
+    name.setComponentByPosition(0, rfc2459.RDNSequence())
+    validity = rfc2459.Validity()
+    validity["notBefore"]["utcTime"] = useful.UTCTime("200101000000Z")
+    validity["notAfter"]["utcTime"] = useful.UTCTime("491231235959Z")
+    keyInfo = rfc2459.SubjectPublicKeyInfo()
+    keyInfo["algorithm"] = algorithm("1.2.840.113549.1.1.1")
+    keyInfo["subjectPublicKey"] = univ.BitString.fromOctetString(
+        publicKey.save_pkcs1("DER"))
+
+    tbs = rfc2459.TBSCertificate()
+    tbs["version"] = "v3"
+    tbs["serialNumber"] = 1
+    tbs["signature"] = algorithm("1.2.840.113549.1.1.11")
+    tbs["issuer"] = name
+    tbs["validity"] = validity
+    tbs["subject"] = name
+    tbs["subjectPublicKeyInfo"] = keyInfo
+
+    certificate = rfc2459.Certificate()
+    certificate["tbsCertificate"] = tbs
+    certificate["signatureAlgorithm"] = algorithm("1.2.840.113549.1.1.11")
+    certificate["signatureValue"] = univ.BitString.fromOctetString(
+        rsa.sign(encoder.encode(tbs), privateKey, "SHA-256"))
+    return rsa.pem.save_pem(encoder.encode(certificate),
+                            "CERTIFICATE").decode("ascii")
+
+
+def subject(token):
+    """
+    Return the user number named by a code or token, such as "user42" or
+    "stub-google-42".
+    """
+    return "".join(ch for ch in token if ch.isdigit()) or "0"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    StubHandler class to answer the provider calls made by oauth.py.
+    """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, body, status=200, maxAge=None):
+        with self.server.lock:
+            self.server.calls += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if maxAge is not None:
+            self.send_header("Cache-Control",
+                             "public, max-age={0}".format(maxAge))
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        if url.path != "/o/oauth2/token":
+            return self.reply({"error": "not found"}, 404)
+        sub = subject(form.get("code", [""])[0])
+        now = int(time.time())
+        signed = ".".join([
+            encodeSegment({"alg": "RS256", "typ": "JWT",
+                           "kid": self.server.keyId}),
+            encodeSegment({"iss": "accounts.google.com", "sub": sub,
+                           "aud": self.server.clientId, "iat": now,
+                           "exp": now + 3600,
+                           "email": "stub{0}@example.com".format(sub)})])
+        signature = rsa.sign(signed.encode("ascii"), self.server.privateKey,
+                             "SHA-256")
+        idToken = signed + "." + base64.urlsafe_b64encode(
+            signature).rstrip(b"=").decode("ascii")
+        self.reply({"access_token": "stub-google-" + sub,
+                    "token_type": "Bearer", "expires_in": 3600,
+                    "id_token": idToken})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = dict((key, values[0]) for key, values in
+                     parse_qs(url.query).items())
+        token = query.get("access_token", "")
+        sub = subject(token)
+        if url.path == "/oauth2/v1/certs":
+            self.reply({self.server.keyId: self.server.certificate},
+                       maxAge=3600)
+        elif url.path == "/oauth2/v1/tokeninfo":
+            self.reply({"user_id": sub, "issued_to": self.server.clientId,
+                        "audience": self.server.clientId,
+                        "expires_in": 3599})
+        elif url.path == "/oauth2/v1/userinfo":
+            self.reply({"name": "Stub User {0}".format(sub),
+                        "picture": "https://example.com/{0}.png".format(sub),
+                        "email": "stub{0}@example.com".format(sub)})
+        elif url.path == "/o/oauth2/revoke":
+            self.reply({})
+        elif url.path == "/oauth/access_token":
+            self.reply({"access_token": "stub-fb-" + subject(
+                query.get("fb_exchange_token", "")),
+                "token_type": "bearer", "expires_in": 5183944})
+        elif url.path == "/v2.10/me":
+            self.reply({"name": "Stub User {0}".format(sub), "id": sub,
+                        "email": "stub{0}@example.com".format(sub)})
+        elif url.path == "/v2.10/me/picture":
+            self.reply({"data": {"url": "https://example.com/{0}.png".
+                                 format(sub)}})
+        else:
+            self.reply({"error": "not found"}, 404)
+
+    def do_DELETE(self):
+        self.reply({"success": True})
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    StubServer class serving StubHandler and counting accepted connections
+    and answered calls.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, latency=0.0, clientId=None):
+        ThreadingHTTPServer.__init__(self, address, StubHandler)
+        self.latency = latency
+        self.clientId = clientId or json.load(open(os.path.join(
+            CATALOG_DIR, "google_client_secrets.json")))["web"]["client_id"]
+        self.connections = 0
+        self.calls = 0
+        self.lock = threading.Lock()
+        publicKey, self.privateKey = rsa.newkeys(1024)
+        self.certificate = makeCertificate(publicKey, self.privateKey)
+        self.keyId = "stub-key"
+
+    def get_request(self):
+        request = ThreadingHTTPServer.get_request(self)
+        with self.lock:
+            self.connections += 1
+        return request
+
+    @property
+    def url(self):
+        return "http://{0}:{1}".format(*self.server_address[:2])
+
+
+def startStub(latency=0.0, port=0):
+    """
+    Start a stub server on a background thread and return it. Its url
+    attribute is the base URL to point the application at.
+    """
+    server = StubServer(("127.0.0.1", port), latency)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="milliseconds to delay every response")
+    args = parser.parse_args()
+
+    server = StubServer(("127.0.0.1", args.port), args.latency / 1000.0)
+    print("stub OAuth server on {0}".format(server.url))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
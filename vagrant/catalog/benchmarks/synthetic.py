@@ -0,0 +1,149 @@
+#!/usr/local/bin/python3
+"""
+The synthetic.py module is a deterministic generator of catalog data for
+benchmarking the Catalog Application at realistic sizes.
+
+Given a seed it always produces the same N users, M categories and K items.
+Category sizes and the number of items each user owns follow a Zipf
+distribution, so a handful of categories and users hold most of the items and
+there is a long tail of small ones, much like a real catalog.
+
+The records are in the layout read by catalogImport.py, so they can either be
+written out as NDJSON or loaded straight into a database.
+
+Usage
+=======================================================
+$> python benchmarks/synthetic.py --items 100000 --output items.ndjson
+$> python benchmarks/synthetic.py --items 100000 --load
+"""
+import argparse
+import bisect
+import io
+import itertools
+import json
+import os
+import random
+import sys
+
+CATALOG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CATALOG_DIR)
+
+WORDS = ["alpine", "bamboo", "canvas", "copper", "denim", "ember", "flannel",
+         "granite", "harbor", "indigo", "juniper", "kestrel", "linen",
+         "maple", "nickel", "obsidian", "pewter", "quartz", "russet",
+         "saffron", "timber", "umber", "velvet", "walnut", "yarrow", "zephyr",
+         "compact", "deluxe", "folding", "heavy", "light", "portable",
+         "rugged", "classic", "modern", "vintage", "wireless", "waterproof"]
+NOUNS = ["bag", "bottle", "brush", "cable", "chair", "clock", "cup", "desk",
+         "drill", "glove", "hammer", "jacket", "kettle", "knife", "lamp",
+         "mat", "mug", "pan", "pen", "pot", "rack", "rope", "saw", "scarf",
+         "shelf", "shoe", "spoon", "stool", "tent", "towel", "tray", "vase"]
+
+
+class ZipfSampler(object):
+    """
+    ZipfSampler class to draw indexes 0..n-1 where index k is drawn with
+    probability proportional to 1 / (k + 1) ** exponent.
+    """
+
+    def __init__(self, n, exponent, rand):
+        self.rand = rand
+        self.cumulative = list(itertools.accumulate(
+            1.0 / (k + 1) ** exponent for k in range(n)))
+
+    def sample(self):
+        """
+        Return the next index.
+        """
+        point = self.rand.random() * self.cumulative[-1]
+        return bisect.bisect_left(self.cumulative, point)
+
+
+def generateRecords(numUsers, numCategories, numItems, seed=1, skew=1.1):
+    """
+    Generator of synthetic item records.
+
+    Parameters
+    =======================================================
+    numUsers - int
+        Number of distinct item owners.
+    numCategories - int
+        Number of distinct categories.
+    numItems - int
+        Number of items to generate.
+    seed - int
+        Seed for the random number generator; the same seed always gives the
+        same records.
+    skew - float
+        Zipf exponent for category sizes and items per user. 0 spreads items
+        evenly, larger values concentrate them in fewer categories and users.
+
+    Returns
+    =======================================================
+    generator of dictionaries -
+        Item records keyed by catalogImport.FIELDS.
+    """
+    rand = random.Random(seed)
+    categories = ZipfSampler(numCategories, skew, rand)
+    users = ZipfSampler(numUsers, skew, rand)
+    for index in range(numItems):
+        words = rand.sample(WORDS, 2)
+        noun = rand.choice(NOUNS)
+        description = "A {0} {1} {2}. {3}".format(
+            words[0], words[1], noun,
+            " ".join(rand.choice(WORDS) for _ in range(rand.randint(4, 24))))
+        yield {"name": "{0} {1} {2:07d}".format(words[0], noun, index),
+               "description": description,
+               "category": "category{0:05d}".format(categories.sample()),
+               "user": "user{0:05d}@example.com".format(users.sample())}
+
+
+def loadCatalog(engine, numUsers, numCategories, numItems, seed=1, skew=1.1):
+    """
+    Function to fill the database behind engine with synthetic records
+    through the catalogImport.py bulk loader.
+
+    Returns
+    =======================================================
+    int -
+        The number of records loaded.
+    """
+    from catalogImport import importRecords
+    return importRecords(engine, generateRecords(
+        numUsers, numCategories, numItems, seed, skew),
+        "user00000@example.com")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--categories", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--skew", type=float, default=1.1)
+    parser.add_argument("--output", default="-",
+                        help="NDJSON file to write (default: stdout)")
+    parser.add_argument("--load", action="store_true",
+                        help="load into CATALOG_DATABASE_URL instead")
+    args = parser.parse_args()
+
+    if args.load:
+        from database import engine
+        count = loadCatalog(engine, args.users, args.categories, args.items,
+                            args.seed, args.skew)
+        sys.stderr.write("loaded {0} records\n".format(count))
+        return
+
+    records = generateRecords(args.users, args.categories, args.items,
+                              args.seed, args.skew)
+    stream = sys.stdout if args.output == "-" else io.open(
+        args.output, "w", encoding="utf-8")
+    for record in records:
+        stream.write(json.dumps(record))
+        stream.write("\n")
+    if stream is not sys.stdout:
+        stream.close()
+
+
+if __name__ == "__main__":
+    main()
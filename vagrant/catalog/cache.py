@@ -0,0 +1,398 @@
+#!/usr/local/bin/python3
+"""
+The cache.py module is a module intended to hold read-through caches for data
+the Catalog Application reads on nearly every request but rarely changes.
+
+Cached values are kept in a backend. LocalBackend keeps them in the memory of
+the current process. RedisBackend keeps them in a Redis server (or anything
+that speaks the Redis protocol) so every worker process shares, and
+invalidates, the same copy. The backend is chosen from the environment -
+
+CATALOG_CACHE_URL
+    redis:// URL of the shared cache. Defaults to the in-process backend.
+CATALOG_CACHE_TTL
+    Seconds a cached value may be served before it is reloaded. Default 300.
+CATALOG_PAGE_CACHE_SIZE
+    Rendered pages the in-process backend holds, in an LRU of their own so
+    that pages never push the category list or user ids out. Default 256.
+
+Values must be JSON serializable so that either backend can hold them.
+"""
+from collections import OrderedDict
+
+import datetime
+import json
+import os
+import threading
+import time
+
+
+class LocalBackend(object):
+    """
+    LocalBackend class to hold cached values in a dictionary in the memory of
+    the current process. Once more than maxEntries values are held the least
+    recently used ones are dropped.
+    """
+
+    def __init__(self, maxEntries=1024):
+        self._lock = threading.Lock()
+        self._values = OrderedDict()
+        self.maxEntries = maxEntries
+
+    def get(self, key):
+        """
+        Return the value stored under key, or None if it is missing or has
+        expired.
+        """
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._values[key]
+                return None
+            self._values.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        """
+        Store value under key for ttl seconds.
+        """
+        with self._lock:
+            self._values[key] = (value, time.monotonic() + ttl)
+            self._values.move_to_end(key)
+            while len(self._values) > self.maxEntries:
+                self._values.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Drop the value stored under key.
+        """
+        with self._lock:
+            self._values.pop(key, None)
+
+
+class RedisBackend(object):
+    """
+    RedisBackend class to hold cached values in a Redis server so that they
+    are shared by every process serving the site.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def fromURL(cls, url):
+        """
+        Create a backend connected to the Redis server at url.
+        """
+        import redis
+        return cls(redis.StrictRedis.from_url(url))
+
+    def get(self, key):
+        """
+        Return the value stored under key, or None if it is missing or has
+        expired.
+        """
+        value = self.client.get(key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def set(self, key, value, ttl):
+        """
+        Store value under key for ttl seconds.
+        """
+        self.client.set(key, json.dumps(value), ex=max(1, int(ttl)))
+
+    def delete(self, key):
+        """
+        Drop the value stored under key.
+        """
+        self.client.delete(key)
+
+
+def makeBackend(url=None, maxEntries=1024):
+    """
+    Function to create the cache backend described by url.
+
+    Parameters
+    =======================================================
+    url - string
+        A redis:// URL, or None for the in-process backend.
+    maxEntries - int
+        The number of values the in-process backend holds.
+
+    Returns
+    =======================================================
+    LocalBackend or RedisBackend -
+        The backend to store cached values in.
+    """
+    if url:
+        return RedisBackend.fromURL(url)
+    return LocalBackend(maxEntries)
+
+
+class ReadThroughCache(object):
+    """
+    ReadThroughCache class to serve a single value from a backend, loading it
+    on a miss and keeping hit and miss counts.
+    """
+
+    def __init__(self, key, backend, ttl):
+        self.key = key
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, loader):
+        """
+        Return the cached value, calling loader() to build and store it when
+        the backend does not hold a current copy.
+
+        Parameters
+        =======================================================
+        loader - callable
+            Returns the current value when called with no arguments.
+
+        Returns
+        =======================================================
+        The cached or freshly loaded value.
+        """
+        value = self.backend.get(self.key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = loader()
+        self.backend.set(self.key, value, self.ttl)
+        return value
+
+    def invalidate(self):
+        """
+        Drop the cached value so the next get() reloads it.
+        """
+        self.backend.delete(self.key)
+
+    def stats(self):
+        """
+        Return the hit and miss counters as a dictionary.
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class KeyedCache(object):
+    """
+    KeyedCache class to serve many values, such as rendered pages, from a
+    backend under a common key prefix, loading each on a miss and keeping hit
+    and miss counts.
+    """
+
+    def __init__(self, prefix, backend, ttl):
+        self.prefix = prefix
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        """
+        Return the value cached under key, calling loader() to build and
+        store it when the backend does not hold a current copy.
+
+        Parameters
+        =======================================================
+        key - string
+            Identifies the value within this cache.
+        loader - callable
+            Returns the current value when called with no arguments.
+
+        Returns
+        =======================================================
+        The cached or freshly loaded value.
+        """
+        value = self.backend.get(self.prefix + key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = loader()
+        self.backend.set(self.prefix + key, value, self.ttl)
+        return value
+
+    def set(self, key, value):
+        """
+        Store value under key, for values already at hand.
+        """
+        self.backend.set(self.prefix + key, value, self.ttl)
+
+    def invalidate(self, key):
+        """
+        Drop the value cached under key so the next get() reloads it.
+        """
+        self.backend.delete(self.prefix + key)
+
+    def stats(self):
+        """
+        Return the hit and miss counters as a dictionary.
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class DatabaseVersion(object):
+    """
+    DatabaseVersion class to read the version number, and the time of the
+    last change, of the data covered by a version table. Triggers in the
+    database bump a row of the table on every change to that data, so the
+    version, the sum of the rows, moves whichever process or tool made the
+    change.
+
+    The version starts from the time the table was created in milliseconds
+    rather than zero, so that a rebuilt database does not hand out version
+    numbers that were already used for different data.
+    """
+
+    def __init__(self, engine, table="catalog_version"):
+        from sqlalchemy import Column, DateTime, BigInteger, Integer
+        from sqlalchemy import MetaData, Table
+        self.engine = engine
+        self.table = Table(table, MetaData(),
+                           Column("id", Integer, primary_key=True),
+                           Column("version", BigInteger, nullable=False),
+                           Column("modified", DateTime, nullable=False))
+
+    def current(self):
+        """
+        Return the current version number and the time, as a timezone aware
+        datetime in UTC, the data last changed.
+        """
+        from sqlalchemy import func, select
+        with self.engine.connect() as conn:
+            version, modified = conn.execute(select(
+                func.sum(self.table.c.version),
+                func.max(self.table.c.modified))).one()
+        return int(version), modified.replace(tzinfo=datetime.timezone.utc)
+
+
+def invalidateOnCommit(sessionFactory, cache, models):
+    """
+    Function to register session event handlers that invalidate cache once a
+    transaction that added, changed or deleted an instance of one of models
+    has been committed.
+
+    Changes are noted in after_flush and acted on in after_commit, so a
+    rolled back transaction leaves the cache alone.
+
+    Parameters
+    =======================================================
+    sessionFactory - sqlalchemy sessionmaker or scoped_session
+        The sessions to watch.
+    cache - ReadThroughCache
+        The cache to invalidate.
+    models - tuple of classes
+        The mapped classes whose changes make the cached value stale.
+
+    Returns
+    =======================================================
+    None
+    """
+    from sqlalchemy import event
+
+    flag = "stale:" + cache.key
+
+    @event.listens_for(sessionFactory, "after_flush")
+    def noteChanges(session, flushContext):
+        for instance in session.new | session.dirty | session.deleted:
+            if isinstance(instance, models):
+                markStale(session, cache)
+                return
+
+    @event.listens_for(sessionFactory, "after_commit")
+    def invalidate(session):
+        if session.info.pop(flag, False):
+            cache.invalidate()
+
+    @event.listens_for(sessionFactory, "after_rollback")
+    def forget(session):
+        session.info.pop(flag, None)
+
+
+def forgetOnCommit(sessionFactory, cache, model, keys):
+    """
+    Function to register session event handlers that drop the entries of a
+    KeyedCache for the instances of model that a transaction changed or
+    deleted, once it has been committed.
+
+    Parameters
+    =======================================================
+    sessionFactory - sqlalchemy sessionmaker or scoped_session
+        The sessions to watch.
+    cache - KeyedCache
+        The cache to drop entries from.
+    model - class
+        The mapped class whose instances are cached.
+    keys - callable
+        Returns the keys cached for an instance of model, called while the
+        instance's attribute history still holds its old values.
+
+    Returns
+    =======================================================
+    None
+    """
+    from sqlalchemy import event
+
+    flag = "forget:" + cache.prefix
+
+    @event.listens_for(sessionFactory, "after_flush")
+    def noteChanges(session, flushContext):
+        for instance in session.dirty | session.deleted:
+            if isinstance(instance, model):
+                session.info.setdefault(flag, set()).update(keys(instance))
+
+    @event.listens_for(sessionFactory, "after_commit")
+    def invalidate(session):
+        for key in session.info.pop(flag, ()):
+            cache.invalidate(key)
+
+    @event.listens_for(sessionFactory, "after_rollback")
+    def forget(session):
+        session.info.pop(flag, None)
+
+
+def markStale(session, cache):
+    """
+    Function to have cache invalidated once session's transaction commits.
+    invalidateOnCommit() only sees changes made through the ORM, so code that
+    changes watched tables with Core INSERT, UPDATE or DELETE statements calls
+    this itself.
+
+    Parameters
+    =======================================================
+    session - sqlalchemy Session or scoped_session
+        The session the statements ran in.
+    cache - ReadThroughCache
+        The cache to invalidate.
+
+    Returns
+    =======================================================
+    None
+    """
+    session.info["stale:" + cache.key] = True
+
+
+backend = makeBackend(os.environ.get("CATALOG_CACHE_URL"))
+ttl = int(os.environ.get("CATALOG_CACHE_TTL", "300"))
+
+# The ordered list of categories drawn in the sidebar of every page, along
+# with the catalog version it was read at.
+categoryCache = ReadThroughCache("catalog:categories", backend, ttl)
+
+# Rendered pages, cached under the catalog version they were rendered at.
+pageCache = KeyedCache("catalog:page:", makeBackend(
+    os.environ.get("CATALOG_CACHE_URL"),
+    int(os.environ.get("CATALOG_PAGE_CACHE_SIZE", "256"))), ttl)
+
+# The user id for each email address, looked up on every login.
+userCache = KeyedCache("catalog:user:", backend, ttl)
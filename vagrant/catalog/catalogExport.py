@@ -0,0 +1,84 @@
+#!/usr/local/bin/python3
+"""
+The catalogExport.py module is a standalone script intended to dump every item
+in the Catalog Application database as CSV or NDJSON, in the record layout
+read by catalogImport.py.
+
+Rows are read through a server side cursor and written out as they arrive, so
+memory use does not grow with the size of the catalog.
+
+Usage
+=======================================================
+$> python catalogExport.py --format ndjson --output items.ndjson
+"""
+from sqlalchemy import select
+from models import Item, Category, User
+from catalogImport import FIELDS
+
+import argparse
+import csv
+import io
+import json
+import sys
+
+
+def exportRecords(engine, stream, fmt):
+    """
+    Function to write every item in the catalog to stream.
+
+    Parameters
+    =======================================================
+    engine - sqlalchemy Engine
+        The engine for the catalog database.
+    stream - file object
+        The text stream to write to.
+    fmt - string
+        "csv" (with a header row) or "ndjson".
+
+    Returns
+    =======================================================
+    int -
+        The number of records written.
+    """
+    query = select(Item.name, Item.description, Category.name, User.email).\
+        select_from(Item).\
+        outerjoin(Category, Item.category_id == Category.id).\
+        outerjoin(User, Item.user_id == User.id).\
+        order_by(Item.id)
+
+    if fmt == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(FIELDS)
+    count = 0
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(query)
+        for row in result:
+            if fmt == "csv":
+                writer.writerow(row)
+            else:
+                stream.write(json.dumps(dict(zip(FIELDS, row))))
+                stream.write("\n")
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Dump every catalog item as CSV or NDJSON.")
+    parser.add_argument("--format", choices=("csv", "ndjson"), default="csv")
+    parser.add_argument("--output", default="-",
+                        help="file to write to (default: stdout)")
+    args = parser.parse_args()
+
+    from database import engine
+    if args.output == "-":
+        count = exportRecords(engine, sys.stdout, args.format)
+    else:
+        with io.open(args.output, "w", encoding="utf-8",
+                     newline="") as stream:
+            count = exportRecords(engine, stream, args.format)
+    sys.stderr.write("exported {0} records\n".format(count))
+
+
+if __name__ == '__main__':
+    main()
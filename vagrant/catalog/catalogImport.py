@@ -0,0 +1,368 @@
+#!/usr/local/bin/python3
+"""
+The catalogImport.py module is a standalone script intended to bulk load items
+into the Catalog Application database from CSV or NDJSON files.
+
+Every record describes one item -
+
+name
+    The item name. Item names are unique, so records naming an item that is
+    already in the catalog are skipped.
+description
+    The item description (optional).
+category
+    The name of the category the item falls under. Missing categories are
+    created.
+user
+    The email address of the user that owns the item (optional, defaults to
+    --owner). Missing users are created.
+
+Records are inserted with executemany in batches of --batch-size rows, each
+batch in its own transaction. Categories and users are resolved through
+in-memory name->id maps so each batch costs a handful of statements no matter
+how many rows it holds. With --jobs the input files are shared out between
+that many worker processes, one file per worker at a time. On sqlite the
+triggers that keep the full text search index, the category item counts and
+the catalog version up to date are suspended for each batch inside its own
+transaction, and all three are brought up to date for the batch before it
+commits. Other connections never see the triggers missing, and a load that is
+killed leaves them in place.
+
+Usage
+=======================================================
+$> python catalogImport.py --owner someone@example.com items.csv more.ndjson
+"""
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from models import Item, Category, User
+from search import createSearchIndex, suspendSearchIndex
+from migrations import bumpCatalogVersion, createCatalogVersion
+from migrations import createItemCounts, suspendCatalogVersion
+from migrations import suspendItemCounts
+
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import sys
+import time
+
+
+FIELDS = ("name", "description", "category", "user")
+
+
+def fileFormat(path, default=None):
+    """
+    Function to work out whether a file holds CSV or NDJSON records.
+
+    Parameters
+    =======================================================
+    path - string
+        The file name.
+    default - string
+        "csv" or "ndjson" to use regardless of the file name.
+
+    Returns
+    =======================================================
+    string -
+        "csv" or "ndjson".
+    """
+    if default:
+        return default
+    if path.endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    return "csv"
+
+
+def readRecords(stream, fmt):
+    """
+    Generator that reads item records from an open text stream.
+
+    Parameters
+    =======================================================
+    stream - file object
+        The text stream to read.
+    fmt - string
+        "csv" (with a header row) or "ndjson".
+
+    Returns
+    =======================================================
+    generator of dictionaries -
+        One dictionary per record, keyed by FIELDS.
+    """
+    if fmt == "ndjson":
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        for record in csv.DictReader(stream):
+            yield record
+
+
+def batches(records, size):
+    """
+    Generator that groups records into lists of at most size records.
+    """
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insertIgnoring(conn, table, column):
+    """
+    Function to build an INSERT for table that silently skips rows clashing
+    with an existing row on the unique column, where the database supports
+    it.
+
+    Parameters
+    =======================================================
+    conn - sqlalchemy Connection
+        The connection the statement will run on.
+    table - sqlalchemy Table
+        The table to insert into.
+    column - sqlalchemy Column
+        The unique column to check for clashes on.
+
+    Returns
+    =======================================================
+    sqlalchemy Insert -
+        The insert statement.
+    """
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing(
+            index_elements=[column.name])
+    if dialect == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing(
+            index_elements=[column.name])
+    return table.insert()
+
+
+def loadIds(conn, table, column):
+    """
+    Function to read a whole lookup table into a value->id dictionary.
+    """
+    return dict((value, row_id) for row_id, value in
+                conn.execute(select(table.c.id, column)))
+
+
+def resolve(conn, ids, table, column, values, extra):
+    """
+    Function to make sure every value in values has a row in table, creating
+    the missing ones in one statement and recording their ids in ids.
+
+    Parameters
+    =======================================================
+    conn - sqlalchemy Connection
+        The connection to use, inside the batch's transaction.
+    ids - dictionary
+        The value->id map to consult and update.
+    table - sqlalchemy Table
+        The lookup table (Category or user).
+    column - sqlalchemy Column
+        The unique column holding the values.
+    values - set of strings
+        The values the current batch refers to.
+    extra - function
+        Returns the other column values for a new row given its value.
+
+    Returns
+    =======================================================
+    None
+    """
+    missing = [value for value in values if value not in ids]
+    if not missing:
+        return
+    rows = []
+    for value in missing:
+        row = extra(value)
+        row[column.name] = value
+        rows.append(row)
+    conn.execute(insertIgnoring(conn, table, column), rows)
+    for row_id, value in conn.execute(
+            select(table.c.id, column).where(column.in_(missing))):
+        ids[value] = row_id
+
+
+def insertItems(conn, rows):
+    """
+    Function to insert one batch of items, skipping names already in the
+    catalog.
+
+    On sqlite the per row triggers maintaining the search index, the category
+    item counts and the catalog version are dropped for the insert and put
+    back, with what they maintain brought up to date for the batch, before
+    the batch's transaction commits. sqlite lets one writer in at a time, so
+    no other connection sees the catalog without its triggers, and a load
+    that is killed rolls the batch back, triggers and all. Other databases
+    keep their triggers running, since dropping them would lock the Item
+    table against readers.
+
+    Parameters
+    =======================================================
+    conn - sqlalchemy Connection
+        The connection to use, inside the batch's transaction.
+    rows - list of dictionaries
+        The Item column values of each item.
+
+    Returns
+    =======================================================
+    None
+    """
+    itemTable = Item.__table__
+    insert = insertIgnoring(conn, itemTable, itemTable.c.name)
+    if conn.dialect.name != "sqlite":
+        conn.execute(insert, rows)
+        return
+
+    # The driver only opens the transaction on the first data change, so
+    # make one before any DDL runs; it also takes the write lock up front.
+    bumpCatalogVersion(conn)
+    lastId = conn.execute(select(func.max(itemTable.c.id))).scalar() or 0
+    suspendSearchIndex(conn)
+    suspendItemCounts(conn)
+    suspendCatalogVersion(conn)
+    conn.execute(insert, rows)
+    createSearchIndex(conn, afterId=lastId)
+    createItemCounts(conn, set(row["category_id"] for row in rows))
+    createCatalogVersion(conn)
+
+
+def importRecords(engine, records, owner, batchSize=10000):
+    """
+    Function to bulk load item records into the catalog.
+
+    Parameters
+    =======================================================
+    engine - sqlalchemy Engine
+        The engine for the catalog database.
+    records - iterable of dictionaries
+        The item records, keyed by FIELDS.
+    owner - string
+        The email address of the user owning records without a user.
+    batchSize - int
+        The number of records inserted per statement and transaction.
+
+    Returns
+    =======================================================
+    int -
+        The number of records read.
+    """
+    categoryTable = Category.__table__
+    userTable = User.__table__
+    with engine.connect() as conn:
+        categoryIds = loadIds(conn, categoryTable, categoryTable.c.name)
+        userIds = loadIds(conn, userTable, userTable.c.email)
+
+    count = 0
+    for batch in batches(records, batchSize):
+        with engine.begin() as conn:
+            resolve(conn, categoryIds, categoryTable, categoryTable.c.name,
+                    set(record["category"] for record in batch),
+                    lambda name: {})
+            resolve(conn, userIds, userTable, userTable.c.email,
+                    set(record.get("user") or owner for record in batch),
+                    lambda email: {"name": email})
+            insertItems(conn, [
+                {"name": record["name"],
+                 "description": record.get("description") or "",
+                 "category_id": categoryIds[record["category"]],
+                 "user_id": userIds[record.get("user") or owner]}
+                for record in batch])
+        count += len(batch)
+    return count
+
+
+def importFile(path, fmt, owner, batchSize):
+    """
+    Function to bulk load one CSV or NDJSON file into the catalog. Run in a
+    worker process when --jobs is used, so it opens its own engine.
+
+    Returns
+    =======================================================
+    tuple -
+        The path and the number of records read from it.
+    """
+    from database import makeEngine
+    engine = makeEngine()
+    with io.open(path, "r", encoding="utf-8", newline="") as stream:
+        count = importRecords(engine, readRecords(stream, fileFormat(
+            path, fmt)), owner, batchSize)
+    engine.dispose()
+    return path, count
+
+
+def importFileJob(args):
+    """
+    Unpack the arguments for importFile when run through a process pool.
+    """
+    return importFile(*args)
+
+
+def importFiles(paths, fmt, owner, batchSize, jobs):
+    """
+    Function to bulk load a list of CSV or NDJSON files, loading up to jobs
+    of them at once in separate worker processes.
+
+    Returns
+    =======================================================
+    int -
+        The total number of records read.
+    """
+    work = [(path, fmt, owner, batchSize) for path in paths]
+    total = 0
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(importFileJob, work)
+    else:
+        results = (importFileJob(job) for job in work)
+    for path, count in results:
+        print("loaded {0} records from {1}".format(count, path))
+        total += count
+    if jobs > 1:
+        pool.close()
+        pool.join()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bulk load items into the catalog from CSV or NDJSON.")
+    parser.add_argument("files", nargs="+",
+                        help="CSV or NDJSON files to load, - for stdin")
+    parser.add_argument("--owner", required=True,
+                        help="email of the user owning records without one")
+    parser.add_argument("--format", choices=("csv", "ndjson"),
+                        help="input format (default: from the file name)")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of files to load in parallel")
+    args = parser.parse_args()
+
+    # Make sure the schema is in place before any worker starts writing.
+    from database import engine
+    from cache import categoryCache
+
+    start = time.perf_counter()
+    if args.files == ["-"]:
+        total = importRecords(engine, readRecords(sys.stdin, fileFormat(
+            "-", args.format)), args.owner, args.batch_size)
+    else:
+        total = importFiles(args.files, args.format, args.owner,
+                            args.batch_size, args.jobs)
+
+    # Let any shared cache know the catalog has changed underneath it.
+    categoryCache.invalidate()
+    elapsed = time.perf_counter() - start
+    print("loaded {0} records in {1:.1f} s ({2:.0f} records/s)".format(
+        total, elapsed, total / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    main()
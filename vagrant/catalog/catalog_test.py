@@ -0,0 +1,967 @@
+#!/usr/local/bin/python3
+#
+# Test cases for application.py
+# Every test runs the Flask app against a throwaway sqlite database so the
+# development catalog.db is never touched.
+
+import base64
+import gzip
+import json
+import os
+import requests
+import sys
+import tempfile
+import threading
+
+CATALOG_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(CATALOG_DIR, "benchmarks"))
+os.environ["CATALOG_DATABASE_URL"] = "sqlite:///" + os.path.join(
+    tempfile.mkdtemp(prefix="catalog-test-"), "catalog.db")
+os.chdir(CATALOG_DIR)
+sys.path.insert(0, CATALOG_DIR)
+
+import application  # noqa: E402
+import logconfig  # noqa: E402
+import logging  # noqa: E402
+import oauth  # noqa: E402
+from database import DBSession, engine  # noqa: E402
+from cache import categoryCache, pageCache  # noqa: E402
+from models import Item, Category, User  # noqa: E402
+from sweeper import sweepEmptyCategories  # noqa: E402
+from stub_oauth import startStub  # noqa: E402
+from oauth2client.crypt import AppIdentityError  # noqa: E402
+
+
+def loggedInClient(user_id):
+    """
+    Return a Flask test client whose session is logged in as user_id.
+    """
+    client = application.app.test_client()
+    with client.session_transaction() as sess:
+        sess["username"] = "tester{0}".format(user_id)
+        sess["user_id"] = user_id
+    return client
+
+
+def createTestCategories(names):
+    """
+    Add categories to the test database ahead of time.
+    """
+    session = DBSession()
+    for name in names:
+        session.add(Category(name=name))
+    session.commit()
+    DBSession.remove()
+
+
+def createTestUser(name):
+    """
+    Add a user to the test database and return its id.
+    """
+    session = DBSession()
+    user = User(name=name, email="{0}@example.com".format(name))
+    session.add(user)
+    session.commit()
+    user_id = user.id
+    DBSession.remove()
+    return user_id
+
+
+class QueryLog(object):
+    """
+    Context manager recording the SQL statements run while it is active.
+    """
+
+    def __enter__(self):
+        from sqlalchemy import event
+        self.statements = []
+        event.listen(engine, "before_cursor_execute", self.record)
+        return self
+
+    def __exit__(self, *args):
+        from sqlalchemy import event
+        event.remove(engine, "before_cursor_execute", self.record)
+
+    def record(self, conn, cursor, statement, parameters, context,
+               executemany):
+        self.statements.append(statement)
+
+    def touching(self, table):
+        return [statement for statement in self.statements
+                if "FROM {0}".format(table) in statement or
+                'FROM "{0}"'.format(table) in statement]
+
+
+def testConcurrentReadsAndWrites():
+    """
+    Test that showItems and newItem can be served from many threads at once
+    without the requests trampling each other's database session.
+    """
+    user_id = createTestUser("concurrent")
+    createTestCategories(["stress{0}".format(index) for index in range(5)])
+    threads = 8
+    requestsPerThread = 25
+    errors = []
+
+    def worker(index):
+        client = loggedInClient(user_id)
+        try:
+            for count in range(requestsPerThread):
+                response = client.post("/catalog/item/new/", data={
+                    "name": "stress-{0}-{1}".format(index, count),
+                    "description": "added by thread {0}".format(index),
+                    "category": "stress{0}".format(count % 5)})
+                if response.status_code != 302:
+                    errors.append("newItem returned {0}".format(
+                        response.status_code))
+                response = client.get("/catalog/")
+                if response.status_code != 200:
+                    errors.append("showItems returned {0}".format(
+                        response.status_code))
+        except Exception as e:
+            errors.append(repr(e))
+
+    pool = [threading.Thread(target=worker, args=(index,))
+            for index in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+    if errors:
+        raise ValueError("Concurrent requests failed: {0}".format(errors[:5]))
+    session = DBSession()
+    added = session.query(Item).filter(Item.name.like("stress-%")).count()
+    categories = session.query(Category).filter(
+        Category.name.like("stress%")).count()
+    DBSession.remove()
+    if added != threads * requestsPerThread:
+        raise ValueError("Expected {0} items after the concurrent posts, "
+                         "found {1}".format(threads * requestsPerThread,
+                                            added))
+    if categories != 5:
+        raise ValueError("Expected 5 stress categories, found {0}".
+                         format(categories))
+    print("1. showItems and newItem can be served concurrently.")
+
+
+def testCategoryCache():
+    """
+    Test that the category list is served from the cache and that
+    committing a new category invalidates it.
+    """
+    user_id = createTestUser("cachetest")
+    client = loggedInClient(user_id)
+    categoryCache.invalidate()
+    client.get("/catalog/category/JSON")
+    misses = categoryCache.misses
+    hits = categoryCache.hits
+    client.get("/catalog/category/JSON")
+    if categoryCache.misses != misses or categoryCache.hits != hits + 1:
+        raise ValueError("A second category lookup should be a cache hit.")
+    print("2. The category list is served from the cache.")
+
+    client.post("/catalog/item/new/", data={
+        "name": "cached-item", "description": "",
+        "category": "freshly-cached"})
+    response = client.get("/catalog/category/JSON")
+    if categoryCache.misses != misses + 1:
+        raise ValueError("Adding a category should invalidate the cache.")
+    if b"freshly-cached" not in response.data:
+        raise ValueError("The new category is missing from the list.")
+    print("3. Committing a new category invalidates the cached list.")
+
+
+def testPageCacheETag():
+    """
+    Test that listing pages carry an ETag, that a matching If-None-Match gets
+    a 304 and that adding an item moves the page on to a new ETag.
+    """
+    user_id = createTestUser("etagtest")
+    client = loggedInClient(user_id)
+    response = client.get("/catalog/")
+    etag = response.headers.get("ETag")
+    if response.status_code != 200 or not etag:
+        raise ValueError("showItems should return a page with an ETag.")
+    response = client.get("/catalog/", headers={"If-None-Match": etag})
+    if response.status_code != 304:
+        raise ValueError("A matching If-None-Match should get a 304, got "
+                         "{0}".format(response.status_code))
+    other = loggedInClient(createTestUser("etagother"))
+    if other.get("/catalog/").headers.get("ETag") == etag:
+        raise ValueError("Each user should get their own cached page.")
+    hits = pageCache.hits
+    for index in range(3):
+        if client.get("/catalog/?x={0}".format(index)).headers.get(
+                "ETag") != etag:
+            raise ValueError("Unused query parameters should not change the "
+                             "cached page.")
+    if pageCache.hits != hits + 3 or \
+            pageCache.backend is categoryCache.backend:
+        raise ValueError("Pages should be cached apart from the category "
+                         "list, keyed on the parameters the view reads.")
+    print("4. Listing pages are cached per user and honour If-None-Match.")
+
+    client.post("/catalog/item/new/", data={
+        "name": "etag-item", "description": "", "category": "etag"})
+    client.get("/catalog/")  # shows and clears the flash message
+    response = client.get("/catalog/", headers={"If-None-Match": etag})
+    if response.status_code != 200 or b"etag-item" not in response.data:
+        raise ValueError("Adding an item should invalidate cached pages.")
+    print("5. Adding an item invalidates the cached pages.")
+
+
+def testKeysetPagination():
+    """
+    Test that paging through /catalog/JSON with ?limit= visits every item
+    exactly once, in name order, and ends with a null next cursor.
+    """
+    session = DBSession()
+    expected = [item.name for item in
+                session.query(Item).order_by(Item.name, Item.id)]
+    DBSession.remove()
+    client = application.app.test_client()
+    seen = []
+    url = "/catalog/JSON?limit=7"
+    pages = 0
+    while url:
+        data = client.get(url).get_json()
+        for category in data["Category"]:
+            seen.extend(item["title"] for item in category["Item"])
+        pages += 1
+        url = None
+        if data["next"]:
+            url = "/catalog/JSON?limit=7&after={0}".format(data["next"])
+    if sorted(seen) != expected or len(seen) != len(expected):
+        raise ValueError("Paging should visit every item exactly once.")
+    expectedPages = max(1, (len(expected) + 6) // 7)
+    if pages != expectedPages:
+        raise ValueError("Expected {0} pages, got {1}".format(
+            expectedPages, pages))
+    if client.get("/catalog/JSON?after=not-a-cursor").status_code != 400:
+        raise ValueError("A malformed cursor should be rejected with a 400.")
+    response = client.get("/catalog/?limit=5")
+    if b"Next page" not in response.data:
+        raise ValueError("showItems should link to the next page.")
+    print("6. Item listings are paged with keyset cursors.")
+
+
+def testSearch():
+    """
+    Test that items can be found by words in their name or description, that
+    the index follows deletes and that search box punctuation is harmless.
+    """
+    user_id = createTestUser("searcher")
+    client = loggedInClient(user_id)
+    client.post("/catalog/item/new/", data={
+        "name": "trowel", "category": "garden",
+        "description": "a small hand tool for digging"})
+    client.post("/catalog/item/new/", data={
+        "name": "spade", "category": "garden",
+        "description": "a digging tool with a flat blade"})
+
+    found = client.get("/catalog/search/JSON?q=digging").get_json()["Item"]
+    if sorted(item["title"] for item in found) != ["spade", "trowel"]:
+        raise ValueError("Searching for 'digging' should find both tools, "
+                         "found {0}".format(found))
+    found = client.get("/catalog/search/JSON?q=flat+blade").get_json()["Item"]
+    if [item["title"] for item in found] != ["spade"]:
+        raise ValueError("Every search word should have to match.")
+    found = client.get('/catalog/search/JSON?q="AND(*').get_json()["Item"]
+    if found:
+        raise ValueError("Punctuation alone should match nothing.")
+    if b"trowel" not in client.get("/catalog/search?q=trowel").data:
+        raise ValueError("The search page should list the matching item.")
+
+    session = DBSession()
+    trowel = session.query(Item).filter_by(name="trowel").one()
+    trowel_id = trowel.id
+    DBSession.remove()
+    client.post("/catalog/item/{0}/delete".format(trowel_id))
+    found = client.get("/catalog/search/JSON?q=digging").get_json()["Item"]
+    if [item["title"] for item in found] != ["spade"]:
+        raise ValueError("Deleted items should drop out of the search index.")
+    print("7. Items can be found through the full text search index.")
+
+
+def testEditItemInPlace():
+    """
+    Test that editing an item updates it in place, creating its new category
+    and removing the category it leaves empty.
+    """
+    user_id = createTestUser("edittest")
+    client = loggedInClient(user_id)
+    client.post("/catalog/item/new/", data={
+        "name": "kayak", "description": "for one", "category": "boats"})
+    session = DBSession()
+    kayak_id = session.query(Item).filter_by(name="kayak").one().id
+    DBSession.remove()
+
+    client.get("/catalog/category/JSON")
+    response = client.post("/catalog/item/{0}/edit".format(kayak_id), data={
+        "description": "for two", "category": "paddling"})
+    if response.status_code != 302:
+        raise ValueError("editItem returned {0}".format(response.status_code))
+    session = DBSession()
+    kayak = session.query(Item).filter_by(name="kayak").one()
+    boats = session.query(Category).filter_by(name="boats").count()
+    if (kayak.id, kayak.description, kayak.category.name) != (
+            kayak_id, "for two", "paddling"):
+        raise ValueError("The item should keep its id and take the edits.")
+    DBSession.remove()
+    if boats:
+        raise ValueError("The emptied category should have been removed.")
+    names = [entry["name"] for entry in
+             client.get("/catalog/category/JSON").get_json()["Category"]]
+    if "paddling" not in names or "boats" in names:
+        raise ValueError("The edit should invalidate the category list.")
+    print("8. Items are edited in place and empty categories removed.")
+
+
+def testCategoryItemCounts():
+    """
+    Test that Category.item_count follows items being added, moved and
+    deleted, and that the sweeper removes categories left empty.
+    """
+    user_id = createTestUser("counttest")
+    client = loggedInClient(user_id)
+    for name in ("sloop", "ketch"):
+        client.post("/catalog/item/new/", data={
+            "name": name, "description": "", "category": "sailing"})
+    session = DBSession()
+    ketch_id = session.query(Item).filter_by(name="ketch").one().id
+    DBSession.remove()
+    client.post("/catalog/item/{0}/edit".format(ketch_id), data={
+        "description": "", "category": "rigs"})
+
+    def counts():
+        session = DBSession()
+        found = dict((category.name, category.item_count) for category in
+                     session.query(Category).filter(
+                         Category.name.in_(["sailing", "rigs"])))
+        DBSession.remove()
+        return found
+
+    if counts() != {"sailing": 1, "rigs": 1}:
+        raise ValueError("Item counts should follow added and moved items, "
+                         "got {0}".format(counts()))
+    client.post("/catalog/item/{0}/delete".format(ketch_id))
+    if counts() != {"sailing": 1}:
+        raise ValueError("Deleting the last item should remove its category, "
+                         "got {0}".format(counts()))
+    print("9. Category item counts are maintained on every change.")
+
+    createTestCategories(["empty{0}".format(index) for index in range(7)])
+    if sweepEmptyCategories(DBSession.get_bind(), batchSize=3) != 7:
+        raise ValueError("The sweeper should remove every empty category.")
+    session = DBSession()
+    left = session.query(Category).filter(Category.item_count == 0).count()
+    DBSession.remove()
+    if left:
+        raise ValueError("{0} empty categories survived the sweep".format(
+            left))
+    print("10. The sweeper removes empty categories in batches.")
+
+
+def testOAuthLogin():
+    """
+    Test that users can log in and out with Google and Facebook, against the
+    stub OAuth server, over pooled provider connections.
+    """
+    stub = startStub()
+    saved = (oauth.GOOGLE_API_URL, oauth.GOOGLE_ACCOUNTS_URL,
+             oauth.FACEBOOK_URL)
+    oauth.GOOGLE_API_URL = oauth.GOOGLE_ACCOUNTS_URL = stub.url
+    oauth.FACEBOOK_URL = stub.url
+    oauth.googleCertCache.invalidate()
+    try:
+        client = application.app.test_client()
+        for route in ("/gconnect", "/fbconnect"):
+            for attempt in range(2):
+                with client.session_transaction() as sess:
+                    sess["state"] = "teststate"
+                response = client.post(route + "?state=teststate",
+                                       data="user7")
+                if response.status_code != 200:
+                    raise ValueError("{0} returned {1}".format(
+                        route, response.status_code))
+                with client.session_transaction() as sess:
+                    if sess.get("email") != "stub7@example.com":
+                        raise ValueError("{0} should log in stub user 7".
+                                         format(route))
+                client.get("/disconnect")
+        if stub.connections > 2:
+            raise ValueError("Provider calls should reuse pooled "
+                             "connections, {0} were opened".format(
+                                 stub.connections))
+    finally:
+        (oauth.GOOGLE_API_URL, oauth.GOOGLE_ACCOUNTS_URL,
+         oauth.FACEBOOK_URL) = saved
+        stub.shutdown()
+    session = DBSession()
+    users = session.query(User).filter_by(email="stub7@example.com").count()
+    DBSession.remove()
+    if users != 1:
+        raise ValueError("Logging in twice should create one user.")
+    print("11. Users can log in with Google and Facebook.")
+
+
+def testTokenCache():
+    """
+    Test that logging in again with the same token is answered from the token
+    cache, that Google id_tokens are checked locally and that forged ones are
+    rejected.
+    """
+    stub = startStub()
+    saved = (oauth.GOOGLE_API_URL, oauth.GOOGLE_ACCOUNTS_URL,
+             oauth.FACEBOOK_URL)
+    oauth.GOOGLE_API_URL = oauth.GOOGLE_ACCOUNTS_URL = stub.url
+    oauth.FACEBOOK_URL = stub.url
+    oauth.googleCertCache.invalidate()
+    try:
+        client = application.app.test_client()
+        calls = []
+        for attempt in range(3):
+            with client.session_transaction() as sess:
+                sess["state"] = "teststate"
+                sess.pop("access_token", None)
+            response = client.post("/fbconnect?state=teststate",
+                                   data="user8")
+            if response.status_code != 200:
+                raise ValueError("/fbconnect returned {0}".format(
+                    response.status_code))
+            calls.append(stub.calls)
+        if calls != [3, 3, 3]:
+            raise ValueError("Repeated Facebook logins with one token should "
+                             "make 3 provider calls, made {0}".format(calls))
+        client.get("/disconnect")
+        with client.session_transaction() as sess:
+            sess["state"] = "teststate"
+        client.post("/fbconnect?state=teststate", data="user8")
+        if stub.calls != 3 + 1 + 3:
+            raise ValueError("Logging out should forget the cached token.")
+        client.get("/disconnect")
+
+        calls = stub.calls
+        for attempt in range(2):
+            with client.session_transaction() as sess:
+                sess["state"] = "teststate"
+                sess.pop("access_token", None)
+            response = client.post("/gconnect?state=teststate",
+                                   data="user8")
+            if response.status_code != 200:
+                raise ValueError("/gconnect returned {0}".format(
+                    response.status_code))
+        # A code exchange per login, the certificates and the user info once.
+        if stub.calls - calls != 4:
+            raise ValueError("Google logins made {0} provider calls, "
+                             "expected 4".format(stub.calls - calls))
+
+        idToken = requests.post(stub.url + "/o/oauth2/token",
+                                data={"code": "user8"}).json()["id_token"]
+        header, payload, signature = idToken.split(".")
+        forged = json.loads(base64.urlsafe_b64decode(payload + "=="))
+        forged["sub"] = "9"
+        forged = base64.urlsafe_b64encode(json.dumps(forged).encode(
+            "utf-8")).rstrip(b"=").decode("ascii")
+        oauth.verifyGoogleIdToken(idToken, application.CLIENT_ID)
+        try:
+            oauth.verifyGoogleIdToken(".".join([header, forged, signature]),
+                                      application.CLIENT_ID)
+        except AppIdentityError:
+            pass
+        else:
+            raise ValueError("A forged id_token should be rejected.")
+    finally:
+        (oauth.GOOGLE_API_URL, oauth.GOOGLE_ACCOUNTS_URL,
+         oauth.FACEBOOK_URL) = saved
+        stub.shutdown()
+    print("12. Login answers are cached per token.")
+
+
+def testUserCache():
+    """
+    Test that item edits and deletes check ownership without loading users,
+    and that user ids are cached by email until the user changes.
+    """
+    user_id = createTestUser("usercache")
+    other_id = createTestUser("usercache-other")
+    client = loggedInClient(user_id)
+    client.post("/catalog/item/new/", data={
+        "name": "canoe", "description": "", "category": "usercache"})
+    session = DBSession()
+    canoe_id = session.query(Item).filter_by(name="canoe").one().id
+    DBSession.remove()
+
+    with QueryLog() as log:
+        client.post("/catalog/item/{0}/edit".format(canoe_id), data={
+            "description": "green", "category": "usercache"})
+        loggedInClient(other_id).post(
+            "/catalog/item/{0}/delete".format(canoe_id))
+        client.post("/catalog/item/{0}/delete".format(canoe_id))
+    if log.touching("user"):
+        raise ValueError("Ownership checks should not query users: {0}".
+                         format(log.touching("user")))
+    session = DBSession()
+    canoes = session.query(Item).filter_by(name="canoe").count()
+    DBSession.remove()
+    if canoes:
+        raise ValueError("The owner should be able to delete the item.")
+
+    with QueryLog() as log:
+        first = application.getUserID("usercache@example.com")
+        second = application.getUserID("usercache@example.com")
+    if (first, second) != (user_id, user_id) or len(log.touching("user")) != 1:
+        raise ValueError("getUserID should be cached after one query.")
+    session = DBSession()
+    session.get(User, user_id).email = "renamed@example.com"
+    session.commit()
+    DBSession.remove()
+    if application.getUserID("usercache@example.com") is not None:
+        raise ValueError("Changing a user's email should invalidate it.")
+    if application.getUserID("renamed@example.com") != user_id:
+        raise ValueError("The user should be found by the new email.")
+
+    with application.app.test_request_context():
+        new_id = application.createUser({"username": "fresh",
+                                         "email": "fresh@example.com",
+                                         "picture": ""})
+        with QueryLog() as log:
+            found = application.getUserID("fresh@example.com")
+        DBSession.remove()
+    if found != new_id or log.statements:
+        raise ValueError("createUser should cache the new user's id.")
+    print("13. User ids are cached and ownership checks skip the user table.")
+
+
+def testListingQueryCount():
+    """
+    Test that the item listings load each item's category in the same query,
+    so a page costs the same number of queries however many items it holds.
+    """
+    user_id = createTestUser("listing")
+    session = DBSession()
+    for index in range(20):
+        category = Category(name="listing-{0}".format(index))
+        session.add(category)
+        session.flush()
+        session.add(Item(name="listing item {0}".format(index),
+                         description="", category_id=category.id,
+                         user_id=user_id))
+    category_id = category.id
+    for index in range(20):
+        session.add(Item(name="listing extra {0}".format(index),
+                         description="", category_id=category_id,
+                         user_id=user_id))
+    session.commit()
+    DBSession.remove()
+
+    client = loggedInClient(user_id)
+    client.get("/catalog/category/JSON")
+    for route in ("/catalog/?", "/catalog/category/{0}/?".format(category_id),
+                  "/catalog/search?q=listing&"):
+        counts = []
+        for limit in (2, 20):
+            with QueryLog() as log:
+                response = client.get("{0}limit={1}".format(route, limit))
+            if response.status_code != 200:
+                raise ValueError("{0} returned {1}".format(
+                    route, response.status_code))
+            counts.append(len(log.statements))
+        if counts[0] != counts[1] or counts[1] > 3:
+            raise ValueError("{0} should take a fixed, small number of "
+                             "queries per page, took {1}".format(route,
+                                                                 counts))
+    print("14. Item listings take a fixed number of queries per page.")
+
+
+def testMetrics():
+    """
+    Test that requests, their SQL statements and the caches are reported at
+    '/metrics', and that ?profile=1 profiles a request when enabled.
+    """
+    client = application.app.test_client()
+    client.get("/catalog/category/JSON")
+    with QueryLog() as log:
+        client.get("/catalog/JSON")
+    body = client.get("/metrics").get_data(as_text=True)
+    expected = [
+        'catalog_requests_total{endpoint="allItemsByAllCategoryJSON",'
+        'method="GET",status="200"}',
+        'catalog_request_duration_seconds_bucket{endpoint='
+        '"allItemsByAllCategoryJSON",method="GET",le="+Inf"}',
+        'catalog_request_queries_sum{endpoint="allItemsByAllCategoryJSON"}',
+        'catalog_cache_hits_total{cache="categories"}']
+    for line in expected:
+        if line not in body:
+            raise ValueError("/metrics is missing {0}".format(line))
+    queries = [line for line in body.splitlines() if line.startswith(
+        'catalog_request_queries_sum{endpoint="allItemsByAllCategoryJSON"}')]
+    if float(queries[0].split()[-1]) < len(log.statements):
+        raise ValueError("/metrics should count the request's statements.")
+
+    response = client.get("/catalog/?profile=1")
+    if b"cumulative" in response.data:
+        raise ValueError("Profiling should be off unless PROFILE is set.")
+    application.app.config["PROFILE"] = True
+    try:
+        response = client.get("/catalog/?profile=1")
+    finally:
+        application.app.config["PROFILE"] = False
+    if response.mimetype != "text/plain" or b"cumulative" not in \
+            response.data:
+        raise ValueError("?profile=1 should return the request's profile.")
+    print("15. Requests and queries are measured at /metrics.")
+
+
+def testLogging():
+    """
+    Test that log records are written as JSON lines by the listener, that
+    per-module levels apply, that dropped records are never formatted and
+    that tracebacks are kept apart from the message.
+    """
+    class Expensive(object):
+        formatted = 0
+
+        def __str__(self):
+            Expensive.formatted += 1
+            return "expensive"
+
+    logFile = os.path.join(tempfile.mkdtemp(prefix="catalog-test-"), "log")
+    try:
+        logconfig.configureLogging({
+            "CATALOG_LOG_FILE": logFile, "CATALOG_LOG_CONSOLE": "0",
+            "CATALOG_LOG_LEVEL": "INFO",
+            "CATALOG_LOG_LEVELS": "catalogtest.loud=DEBUG"})
+        logging.getLogger("catalogtest").debug("dropped %s", Expensive())
+        logging.getLogger("catalogtest.loud").debug(
+            "kept %s", Expensive(), extra={"item_id": 7})
+        try:
+            raise KeyError("missing")
+        except KeyError:
+            logging.getLogger("catalogtest").exception("failed %s", 1)
+        logconfig.stopLogging()
+    finally:
+        logconfig.configureLogging()
+    entries = [json.loads(line) for line in open(logFile)]
+    if [entry["message"] for entry in entries] != ["kept expensive",
+                                                   "failed 1"]:
+        raise ValueError("Only records at or above their logger's level "
+                         "should be written, found {0}".format(entries))
+    if entries[0]["logger"] != "catalogtest.loud" or \
+            entries[0]["item_id"] != 7:
+        raise ValueError("Records should carry their logger and extras.")
+    if Expensive.formatted != 1:
+        raise ValueError("Dropped records should never be formatted.")
+    if "KeyError: 'missing'" not in entries[1].get("exception", "") or \
+            "exception" in entries[0]:
+        raise ValueError("A logged exception's traceback should be under "
+                         "\"exception\", found {0}".format(entries[1]))
+    print("16. Logs are written as JSON lines off the request thread.")
+
+
+def testConditionalJSON():
+    """
+    Test that the JSON API sends validators, answers conditional requests for
+    unchanged data with a 304 without querying, and compresses large
+    documents.
+    """
+    user_id = createTestUser("conditional")
+    client = loggedInClient(user_id)
+    client.post("/catalog/item/new/", data={
+        "name": "lantern", "description": "", "category": "conditional"})
+    session = DBSession()
+    lantern_id = session.query(Item).filter_by(name="lantern").one().id
+    DBSession.remove()
+
+    route = "/catalog/item/{0}/JSON".format(lantern_id)
+    first = client.get(route)
+    etag = first.headers.get("ETag", "")
+    if not etag.startswith("W/") or "Last-Modified" not in first.headers or \
+            "public" not in first.headers.get("Cache-Control", ""):
+        raise ValueError("Item JSON should carry validators, got {0}".format(
+            dict(first.headers)))
+    if client.get(route, headers={"If-None-Match": etag}).status_code != 304:
+        raise ValueError("An unchanged item should answer with a 304.")
+    client.post("/catalog/item/{0}/edit".format(lantern_id), data={
+        "description": "brighter", "category": "conditional"})
+    if client.get(route, headers={"If-None-Match": etag}).status_code != 200:
+        raise ValueError("An edited item should be sent again.")
+
+    for route in ("/catalog/JSON", "/catalog/category/JSON"):
+        etag = client.get(route).headers["ETag"]
+        with QueryLog() as log:
+            response = client.get(route, headers={"If-None-Match": etag})
+        if response.status_code != 304 or len(log.statements) != 1 or \
+                not log.touching("catalog_version"):
+            raise ValueError("{0} should answer with a 304 after reading "
+                             "only the catalog version".format(route))
+
+    # Changes made outside the application's sessions, such as by another
+    # worker process or the import tool, move the catalog version on too.
+    from database import makeEngine
+    from sqlalchemy import text
+    otherEngine = makeEngine(os.environ["CATALOG_DATABASE_URL"])
+    with otherEngine.begin() as conn:
+        conn.execute(text('INSERT INTO "Category" (name) VALUES '
+                          "('from elsewhere')"))
+    otherEngine.dispose()
+    response = client.get(route, headers={"If-None-Match": etag})
+    if response.status_code != 200 or b"from elsewhere" not in \
+            response.data or response.headers["ETag"] == etag:
+        raise ValueError("A change made by another process should be sent "
+                         "with a new ETag.")
+    client.post("/catalog/item/new/", data={
+        "name": "lantern oil", "description": "", "category": "conditional"})
+    if client.get("/catalog/JSON", headers={
+            "If-None-Match": etag}).status_code != 200:
+        raise ValueError("A changed catalog should be sent again.")
+
+    # Enough items that the catalog is past COMPRESS_MIN_SIZE however few
+    # the other tests have added.
+    session = DBSession()
+    for index in range(10):
+        category = Category(name="conditional-{0}".format(index))
+        session.add(category)
+        session.flush()
+        session.add(Item(name="conditional item {0}".format(index),
+                         description="a conditional item " * 10,
+                         category_id=category.id, user_id=user_id))
+    session.commit()
+    DBSession.remove()
+    plain = client.get("/catalog/JSON")
+    if len(plain.data) < application.app.config["COMPRESS_MIN_SIZE"]:
+        raise ValueError("The catalog should be large enough to compress.")
+    packed = client.get("/catalog/JSON", headers={"Accept-Encoding": "gzip"})
+    if packed.headers.get("Content-Encoding") != "gzip" or \
+            gzip.decompress(packed.data) != plain.data:
+        raise ValueError("Large JSON documents should be gzipped.")
+    print("17. The JSON API answers conditional requests and compresses.")
+
+
+def testBulkItems():
+    """
+    Test fetching several items in one query and changing several items in
+    one transaction, with per item results and ownership checks.
+    """
+    user_id = createTestUser("bulk")
+    other_id = createTestUser("bulk-other")
+    client = loggedInClient(user_id)
+    loggedInClient(other_id).post("/catalog/item/new/", data={
+        "name": "bulk theirs", "description": "", "category": "bulk-a"})
+    session = DBSession()
+    theirs = session.query(Item).filter_by(name="bulk theirs").one().id
+    DBSession.remove()
+
+    response = client.post("/catalog/items/bulk", json={"operations": [
+        {"op": "create", "name": "bulk one", "category": "bulk-a"},
+        {"op": "create", "name": "bulk two", "description": "2",
+         "category": "bulk-b"},
+        {"op": "create", "name": "bulk theirs", "category": "bulk-a"},
+        {"op": "update", "id": theirs, "description": "mine now"},
+        {"op": "delete", "id": 10 ** 9},
+        {"op": "rename", "id": theirs}]})
+    results = response.get_json()["results"]
+    statuses = [result["status"] for result in results]
+    if statuses != [201, 201, 409, 403, 404, 400]:
+        raise ValueError("Unexpected bulk results {0}".format(results))
+    one, two = results[0]["id"], results[1]["id"]
+
+    with QueryLog() as log:
+        response = client.get("/catalog/items/JSON?ids={0},{1},{2},{3}".
+                              format(two, 10 ** 9, one, theirs))
+    document = response.get_json()
+    if [item["id"] for item in document["Item"]] != [two, one, theirs] or \
+            document["missing"] != [10 ** 9]:
+        raise ValueError("Unexpected batch items {0}".format(document))
+    if len(log.touching("Item")) != 1:
+        raise ValueError("Items should be fetched in a single query.")
+    response = client.get("/catalog/items/JSON?ids=one,two")
+    if response.status_code != 400 or response.headers.get("ETag") or \
+            "public" in response.headers.get("Cache-Control", ""):
+        raise ValueError("Errors should not be cacheable.")
+
+    response = client.post("/catalog/items/bulk", json={"operations": [
+        {"op": "update", "id": one, "description": "moved",
+         "category": "bulk-b"},
+        {"op": "delete", "id": two}]})
+    if [result["status"] for result in response.get_json()["results"]] != \
+            [200, 200]:
+        raise ValueError("The owner should be able to change their items.")
+    session = DBSession()
+    moved = session.query(Item).filter_by(id=one).one()
+    state = (moved.description, moved.category.name,
+             session.query(Item).filter_by(id=two).count(),
+             session.query(Item).filter_by(id=theirs).one().description)
+    DBSession.remove()
+    if state != ("moved", "bulk-b", 0, ""):
+        raise ValueError("Unexpected state after bulk changes {0}".format(
+            state))
+
+    too_many = [{"op": "delete", "id": one}] * (
+        application.app.config["BULK_MAX_ITEMS"] + 1)
+    if client.post("/catalog/items/bulk", json={
+            "operations": too_many}).status_code != 413:
+        raise ValueError("Oversized bulk requests should be refused.")
+    if client.post("/catalog/items/bulk", json={"operations": [
+            {"op": "delete", "id": True}]}).status_code != 400:
+        raise ValueError("Item ids should not be booleans.")
+    if application.app.test_client().post("/catalog/items/bulk", json={
+            "operations": []}).status_code != 401:
+        raise ValueError("Bulk changes should require a login.")
+    print("18. Items can be fetched and changed in bulk.")
+
+
+def testBaselineUpgrade():
+    """
+    Test to ensure a database with the schema the application started out
+    with, duplicates and all, is brought up to date by upgrade().
+    """
+    from database import makeEngine
+    from migrations import REVISIONS, upgrade
+    from sqlalchemy import text
+
+    oldEngine = makeEngine("sqlite:///" + os.path.join(
+        tempfile.mkdtemp(prefix="catalog-test-"), "baseline.db"))
+    with oldEngine.begin() as conn:
+        for statement in [
+                """CREATE TABLE user (id INTEGER PRIMARY KEY,
+                       name VARCHAR(250) NOT NULL,
+                       email VARCHAR(250) NOT NULL, picture VARCHAR(250))""",
+                """CREATE TABLE "Category" (id INTEGER PRIMARY KEY,
+                       name VARCHAR NOT NULL)""",
+                """CREATE TABLE "Item" (id INTEGER PRIMARY KEY,
+                       name VARCHAR NOT NULL, description VARCHAR,
+                       category_id INTEGER REFERENCES "Category" (id),
+                       user_id INTEGER REFERENCES user (id))""",
+                """INSERT INTO user VALUES (1, 'old', 'old@example.com',
+                       NULL), (2, 'old again', 'old@example.com', NULL)""",
+                """INSERT INTO "Category" VALUES (1, 'Ball'), (2, 'Ball'),
+                       (3, 'Bat')""",
+                """INSERT INTO "Item" VALUES (1, 'one', '', 1, 1),
+                       (2, 'two', '', 2, 2), (3, 'three', '', 3, 2)"""]:
+            conn.execute(text(statement))
+
+    applied = upgrade(oldEngine)
+    if applied != [revision for revision, _, _ in REVISIONS]:
+        raise ValueError("Unexpected revisions applied {0}".format(applied))
+    with oldEngine.connect() as conn:
+        categories = conn.execute(text(
+            'SELECT id, name, item_count FROM "Category" ORDER BY id')).\
+            fetchall()
+        items = conn.execute(text(
+            'SELECT id, category_id, user_id, updated_at IS NOT NULL '
+            'FROM "Item" ORDER BY id')).fetchall()
+        users = conn.execute(text("SELECT id FROM user")).fetchall()
+    oldEngine.dispose()
+    if [tuple(row) for row in categories] != [(1, "Ball", 2), (3, "Bat", 1)] \
+            or [tuple(row) for row in items] != [(1, 1, 1, 1), (2, 1, 1, 1),
+                                                 (3, 3, 1, 1)] \
+            or [tuple(row) for row in users] != [(1,)]:
+        raise ValueError("Unexpected upgraded rows {0} {1} {2}".format(
+            categories, items, users))
+    print("19. A baseline database with duplicates upgrades cleanly.")
+
+
+def testImportKeepsTriggers():
+    """
+    Test that bulk loads keep the item counts and search index up to date
+    batch by batch, that a failed batch leaves every trigger in place and
+    that upgrade() puts back triggers that have gone missing.
+    """
+    from catalogImport import importRecords, insertItems
+    from migrations import existingTriggers, upgrade
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        triggers = existingTriggers(conn)
+    importRecords(engine, [
+        {"name": "imported {0}".format(index), "description": "crate",
+         "category": "imported-{0}".format(index % 3)}
+        for index in range(10)], "importer@example.com", batchSize=4)
+    with engine.connect() as conn:
+        counts = [row[0] for row in conn.execute(text(
+            'SELECT item_count FROM "Category" WHERE name LIKE '
+            "'imported-%' ORDER BY name"))]
+        found = conn.execute(text(
+            "SELECT count(*) FROM item_search WHERE item_search MATCH "
+            "'crate'")).scalar()
+        if counts != [4, 3, 3] or found != 10 or \
+                existingTriggers(conn) != triggers:
+            raise ValueError("Unexpected state after an import {0} {1}".
+                             format(counts, found))
+
+    try:
+        with engine.begin() as conn:
+            insertItems(conn, [{"name": None, "description": "",
+                                "category_id": None, "user_id": None}])
+    except Exception:
+        pass
+    else:
+        raise ValueError("An item without a name should not be inserted.")
+    with engine.connect() as conn:
+        if existingTriggers(conn) != triggers:
+            raise ValueError("A failed batch should leave its triggers.")
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP TRIGGER category_count_insert"))
+        conn.execute(text('INSERT INTO "Item" (name, category_id) SELECT '
+                          "'uncounted', id FROM \"Category\" WHERE name = "
+                          "'imported-0'"))
+    upgrade(engine)
+    with engine.connect() as conn:
+        count = conn.execute(text(
+            'SELECT item_count FROM "Category" WHERE name = '
+            "'imported-0'")).scalar()
+        if existingTriggers(conn) != triggers or count != 5:
+            raise ValueError("upgrade() should restore missing triggers and "
+                             "recount, got a count of {0}".format(count))
+    print("20. Bulk loads and restarts keep the triggers in place.")
+
+
+def testStreamedJSON():
+    """
+    Test that the streamed JSON documents are the same bytes as the buffered
+    ones, in debug mode as well, where jsonify would otherwise indent.
+    """
+    user_id = createTestUser("streamed")
+    client = loggedInClient(user_id)
+    for name in ("streamed b", "streamed a"):
+        client.post("/catalog/item/new/", data={
+            "name": name, "description": "", "category": "streamed"})
+    createTestCategories(["streamed empty"])
+    debug = application.app.debug
+    try:
+        for application.app.debug in (False, True):
+            for route in ("/catalog/JSON", "/catalog/category/JSON"):
+                buffered = client.get(route).data
+                streamed = client.get(route + "?stream=1").data
+                if streamed != buffered:
+                    raise ValueError("{0} streamed differently with debug "
+                                     "{1}".format(route,
+                                                  application.app.debug))
+    finally:
+        application.app.debug = debug
+    print("21. Streamed JSON matches the buffered documents.")
+
+
+if __name__ == '__main__':
+    testConcurrentReadsAndWrites()
+    testCategoryCache()
+    testPageCacheETag()
+    testKeysetPagination()
+    testSearch()
+    testEditItemInPlace()
+    testCategoryItemCounts()
+    testOAuthLogin()
+    testTokenCache()
+    testUserCache()
+    testListingQueryCount()
+    testMetrics()
+    testLogging()
+    testConditionalJSON()
+    testBulkItems()
+    testBaselineUpgrade()
+    testImportKeepsTriggers()
+    testStreamedJSON()
+    print("Success!  All tests pass!")
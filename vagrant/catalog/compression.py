@@ -0,0 +1,86 @@
+#!/usr/local/bin/python3
+"""
+The compression.py module is a module intended to compress the larger
+responses of the Catalog Application before they are sent.
+
+JSON and HTML responses of at least a minimum size are compressed with brotli
+when the brotli package is installed and the client accepts it, and with gzip
+otherwise. Streamed responses are sent as they are, since their size is not
+known up front.
+"""
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ("application/json", "text/html", "text/plain")
+
+
+def chooseEncoding(acceptEncodings):
+    """
+    Function to pick the best encoding the client accepts.
+
+    Parameters
+    =======================================================
+    acceptEncodings - werkzeug Accept
+        The parsed Accept-Encoding header of the request.
+
+    Returns
+    =======================================================
+    string -
+        "br", "gzip" or None when the response should be sent as it is.
+    """
+    choices = ["gzip"]
+    if brotli is not None:
+        choices.insert(0, "br")
+    return acceptEncodings.best_match(choices)
+
+
+def compressResponse(request, response, minSize=1024, level=6):
+    """
+    Function to compress response in place when it is worth compressing and
+    the client accepts a compressed encoding.
+
+    Strong ETags are weakened, since the compressed body is no longer byte
+    for byte the same as the uncompressed one.
+
+    Parameters
+    =======================================================
+    request - flask Request
+        The request being answered.
+    response - flask Response
+        The response to compress.
+    minSize - int
+        Responses smaller than this many bytes are left alone.
+    level - int
+        The compression level, 1 (fastest) to 9 (smallest).
+
+    Returns
+    =======================================================
+    flask Response -
+        The response, compressed or not.
+    """
+    if response.status_code != 200 or response.direct_passthrough or \
+            response.is_streamed or "Content-Encoding" in response.headers or \
+            response.mimetype not in COMPRESSIBLE:
+        return response
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < minSize:
+        return response
+    encoding = chooseEncoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if encoding == "br":
+        data = brotli.compress(data, quality=min(11, level + 2))
+    else:
+        data = gzip.compress(data, compresslevel=level, mtime=0)
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,82 @@
+#!/usr/local/bin/python3
+"""
+The database.py module is a module intended to own the engine, connection pool
+and session factory for the Catalog Application.
+
+The connection settings are read from the environment so the same code can run
+against the development sqlite file or a Postgres server -
+
+CATALOG_DATABASE_URL
+    sqlalchemy URL of the catalog database. Defaults to sqlite:///catalog.db
+CATALOG_POOL_SIZE, CATALOG_MAX_OVERFLOW, CATALOG_POOL_TIMEOUT,
+CATALOG_POOL_RECYCLE
+    Connection pool tuning for server databases such as Postgres.
+CATALOG_SQLITE_BUSY_TIMEOUT
+    Milliseconds a sqlite writer waits for the write lock before failing.
+
+Sessions handed out by DBSession are scoped to the current thread, so every
+request served by a threaded server or gunicorn worker gets its own session.
+Callers are expected to call DBSession.remove() once they are finished with it.
+"""
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+from migrations import upgrade
+
+import os
+
+
+DATABASE_URL = os.environ.get("CATALOG_DATABASE_URL", "sqlite:///catalog.db")
+
+
+def makeEngine(url=DATABASE_URL):
+    """
+    Function to create the engine and connection pool for the catalog
+    database.
+
+    sqlite databases are switched to WAL journaling so that any number of
+    readers can run alongside the single writer sqlite allows, and writers
+    queue on the write lock for up to CATALOG_SQLITE_BUSY_TIMEOUT ms instead
+    of failing straight away. Other databases get a sized connection pool.
+
+    Parameters
+    =======================================================
+    url - string
+        The sqlalchemy URL of the database to connect to.
+
+    Returns
+    =======================================================
+    sqlalchemy Engine -
+        The engine to use for the catalog database.
+    """
+    if url.startswith("sqlite"):
+        busyTimeout = int(os.environ.get("CATALOG_SQLITE_BUSY_TIMEOUT",
+                                         "30000"))
+        engine = create_engine(url, connect_args={
+            "check_same_thread": False,
+            "timeout": busyTimeout / 1000.0})
+
+        @event.listens_for(engine, "connect")
+        def setSqlitePragmas(dbapiConnection, connectionRecord):
+            cursor = dbapiConnection.cursor()
+            if ":memory:" not in url and url != "sqlite://":
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA busy_timeout={0}".format(busyTimeout))
+            cursor.close()
+
+        return engine
+
+    return create_engine(
+        url,
+        pool_size=int(os.environ.get("CATALOG_POOL_SIZE", "5")),
+        max_overflow=int(os.environ.get("CATALOG_MAX_OVERFLOW", "10")),
+        pool_timeout=int(os.environ.get("CATALOG_POOL_TIMEOUT", "30")),
+        pool_recycle=int(os.environ.get("CATALOG_POOL_RECYCLE", "1800")),
+        pool_pre_ping=True)
+
+
+engine = makeEngine()
+# Build any missing tables and bring existing ones up to date with models.py
+upgrade(engine)
+
+DBSession = scoped_session(sessionmaker(bind=engine))
@@ -0,0 +1,176 @@
+#!/usr/local/bin/python3
+"""
+The logconfig.py module is a module intended to set up logging for the
+Catalog Application without slowing its requests down.
+
+Request threads only put their records on a queue. A single listener thread
+takes them off the queue and writes them out, as one JSON object per line, to
+a log file that is rotated once it grows past a size limit, and optionally to
+the console. Records below a logger's level are dropped before their message
+is ever formatted, so log calls should pass their arguments separately -
+log.debug("Item %s was added", name) - rather than formatting them up front.
+
+Logging is configured from the environment -
+
+CATALOG_LOG_LEVEL
+    Level of every logger without a level of its own. Default DEBUG.
+CATALOG_LOG_LEVELS
+    Comma separated logger=LEVEL pairs for individual modules, such as
+    "sqlalchemy.engine=INFO,oauth=WARNING".
+CATALOG_LOG_FILE
+    The log file, or nothing to only log to the console. Default debug.log.
+CATALOG_LOG_MAX_BYTES, CATALOG_LOG_BACKUPS
+    Size at which the log file is rotated, and the number of rotated files
+    kept. Defaults 10MB and 5.
+CATALOG_LOG_CONSOLE
+    Set to 0 to stop logging to the console. Default 1.
+"""
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+import atexit
+import copy
+import datetime
+import json
+import logging
+import os
+import queue
+
+# The attributes every LogRecord has, so that anything else on a record was
+# passed through extra= and belongs in the JSON object.
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord(
+    "", logging.INFO, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    JSONFormatter class to render a record as a single line JSON object with
+    its time, level, logger, thread and message, along with any fields passed
+    through extra= and the traceback of a logged exception.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()}
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RecordQueueHandler(QueueHandler):
+    """
+    RecordQueueHandler class to put records on the listener's queue with their
+    message merged with its arguments, and the traceback of a logged
+    exception rendered into exc_text, where formatters look for it.
+    QueueHandler would instead fold the traceback into the message.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parseLevels(spec):
+    """
+    Function to read logger=LEVEL pairs, as found in CATALOG_LOG_LEVELS.
+
+    Parameters
+    =======================================================
+    spec - string
+        Comma separated logger=LEVEL pairs.
+
+    Returns
+    =======================================================
+    dictionary -
+        The level name for each logger name.
+    """
+    levels = {}
+    for pair in spec.split(","):
+        if "=" in pair:
+            name, level = pair.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configureLogging(environ=os.environ):
+    """
+    Function to route every log record through a queue to a listener thread
+    that writes it to a rotating JSON log file and the console, replacing
+    any handlers already on the root logger.
+
+    Parameters
+    =======================================================
+    environ - dictionary
+        The settings described in the module docstring.
+
+    Returns
+    =======================================================
+    logging.handlers.QueueListener -
+        The running listener. It is stopped, flushing whatever is still
+        queued, when the process exits or logging is configured again.
+    """
+    handlers = []
+    logFile = environ.get("CATALOG_LOG_FILE", "debug.log")
+    if logFile:
+        fileHandler = RotatingFileHandler(
+            logFile,
+            maxBytes=int(environ.get("CATALOG_LOG_MAX_BYTES",
+                                     str(10 * 1024 * 1024))),
+            backupCount=int(environ.get("CATALOG_LOG_BACKUPS", "5")),
+            delay=True)
+        fileHandler.setFormatter(JSONFormatter())
+        handlers.append(fileHandler)
+    if environ.get("CATALOG_LOG_CONSOLE", "1") != "0":
+        consoleHandler = logging.StreamHandler()
+        consoleHandler.setFormatter(logging.Formatter(
+            "%(levelname)s:%(name)s:%(message)s"))
+        handlers.append(consoleHandler)
+
+    global listener
+    stopLogging()
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, *handlers)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(RecordQueueHandler(records))
+    root.setLevel(environ.get("CATALOG_LOG_LEVEL", "DEBUG").upper())
+    for name, level in parseLevels(
+            environ.get("CATALOG_LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level)
+
+    listener.start()
+    return listener
+
+
+def stopLogging():
+    """
+    Function to stop the listener started by configureLogging, once every
+    record queued so far has been written out.
+    """
+    global listener
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        listener = None
+
+
+# The running QueueListener, stopped when the process exits.
+listener = None
+atexit.register(stopLogging)
@@ -0,0 +1,234 @@
+#!/usr/local/bin/python3
+"""
+The metrics.py module is a module intended to measure how the Catalog
+Application spends its time, request by request.
+
+Every request is timed, and every SQL statement it runs is counted and timed
+through the engine's before_cursor_execute and after_cursor_execute events.
+The totals are kept per route in latency histograms and counters, together
+with the hit and miss counts of the caches, and rendered in the Prometheus
+text format for the '/metrics' endpoint.
+
+When CATALOG_PROFILE is set, passing ?profile=1 to any route runs it under
+cProfile and returns the profile instead of the page.
+"""
+from flask import Response, g, has_app_context, request
+
+import cProfile
+import io
+import pstats
+import threading
+import time
+
+# Upper bounds of the histogram buckets, in seconds for latencies and in
+# statements for query counts.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram(object):
+    """
+    Histogram class to count observations into cumulative buckets, keeping
+    their sum and count, per set of label values.
+    """
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labelValues, value):
+        series = self.series.get(labelValues)
+        if series is None:
+            series = self.series[labelValues] = [
+                [0] * len(self.buckets), 0, 0.0]
+        counts = series[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        series[1] += 1
+        series[2] += value
+
+    def render(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.help),
+                 "# TYPE {0} histogram".format(self.name)]
+        for labelValues, (counts, count, total) in sorted(
+                self.series.items()):
+            labels = formatLabels(self.labels, labelValues)
+            for bound, bucketCount in zip(self.buckets, counts):
+                lines.append('{0}_bucket{1} {2}'.format(
+                    self.name, formatLabels(self.labels + ("le",),
+                                            labelValues + (str(bound),)),
+                    bucketCount))
+            lines.append('{0}_bucket{1} {2}'.format(
+                self.name, formatLabels(self.labels + ("le",),
+                                        labelValues + ("+Inf",)), count))
+            lines.append("{0}_sum{1} {2}".format(self.name, labels, total))
+            lines.append("{0}_count{1} {2}".format(self.name, labels, count))
+        return lines
+
+
+class Counter(object):
+    """
+    Counter class to keep a running total per set of label values.
+    """
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, labelValues, value=1):
+        self.series[labelValues] = self.series.get(labelValues, 0) + value
+
+    def render(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.help),
+                 "# TYPE {0} counter".format(self.name)]
+        for labelValues, value in sorted(self.series.items()):
+            lines.append("{0}{1} {2}".format(
+                self.name, formatLabels(self.labels, labelValues), value))
+        return lines
+
+
+def formatLabels(names, values):
+    """
+    Function to render label names and values as {name="value",...}.
+    """
+    return "{" + ",".join('{0}="{1}"'.format(
+        name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(names, values)) + "}"
+
+
+class Metrics(object):
+    """
+    Metrics class to collect the request and SQL measurements of an app and
+    render them, along with the counters of its caches, for Prometheus.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter(
+            "catalog_requests_total", "Requests handled.",
+            ("endpoint", "method", "status"))
+        self.latency = Histogram(
+            "catalog_request_duration_seconds", "Time spent per request.",
+            ("endpoint", "method"), LATENCY_BUCKETS)
+        self.queries = Histogram(
+            "catalog_request_queries", "SQL statements run per request.",
+            ("endpoint",), QUERY_BUCKETS)
+        self.sqlTime = Histogram(
+            "catalog_request_sql_seconds", "Time spent in SQL per request.",
+            ("endpoint",), LATENCY_BUCKETS)
+        self.caches = {}
+
+    def instrument(self, app, engine):
+        """
+        Function to start measuring the requests app handles and the SQL
+        statements they run on engine.
+
+        Parameters
+        =======================================================
+        app - Flask
+            The application to measure.
+        engine - sqlalchemy Engine
+            The engine the application's sessions are bound to.
+
+        Returns
+        =======================================================
+        None
+        """
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def startQuery(conn, cursor, statement, parameters, context,
+                       executemany):
+            conn.info.setdefault("query_start", []).append(
+                time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def endQuery(conn, cursor, statement, parameters, context,
+                     executemany):
+            elapsed = time.perf_counter() - conn.info["query_start"].pop()
+            if has_app_context() and "requestStart" in g:
+                g.queryCount += 1
+                g.queryTime += elapsed
+
+        @app.before_request
+        def startRequest():
+            g.requestStart = time.perf_counter()
+            g.queryCount = 0
+            g.queryTime = 0.0
+            if app.config.get("PROFILE") and \
+                    request.args.get("profile") == "1":
+                g.profiler = cProfile.Profile()
+                g.profiler.enable()
+
+        @app.after_request
+        def endRequest(response):
+            if "requestStart" not in g:
+                return response
+            elapsed = time.perf_counter() - g.requestStart
+            endpoint = request.endpoint or "none"
+            with self.lock:
+                self.requests.inc((endpoint, request.method,
+                                   str(response.status_code)))
+                self.latency.observe((endpoint, request.method), elapsed)
+                self.queries.observe((endpoint,), g.queryCount)
+                self.sqlTime.observe((endpoint,), g.queryTime)
+            profiler = g.pop("profiler", None)
+            if profiler is not None:
+                profiler.disable()
+                return profileResponse(profiler, elapsed, g.queryCount,
+                                       g.queryTime)
+            return response
+
+    def watchCache(self, name, cache):
+        """
+        Function to include the hit and miss counters of cache, anything with
+        a stats() method, in the rendered metrics.
+        """
+        self.caches[name] = cache
+
+    def render(self):
+        """
+        Function to render every metric in the Prometheus text format.
+
+        Returns
+        =======================================================
+        string -
+            The body for the '/metrics' endpoint.
+        """
+        lines = []
+        with self.lock:
+            for metric in (self.requests, self.latency, self.queries,
+                           self.sqlTime):
+                lines.extend(metric.render())
+        for kind in ("hits", "misses"):
+            lines.append("# HELP catalog_cache_{0}_total Cache {0}.".format(
+                kind))
+            lines.append("# TYPE catalog_cache_{0}_total counter".format(
+                kind))
+            for name, cache in sorted(self.caches.items()):
+                lines.append('catalog_cache_{0}_total{{cache="{1}"}} {2}'.
+                             format(kind, name, cache.stats()[kind]))
+        return "\n".join(lines) + "\n"
+
+
+def profileResponse(profiler, elapsed, queryCount, queryTime):
+    """
+    Function to build a plain text response out of a request's profile, with
+    the functions that took the most cumulative time first.
+    """
+    out = io.StringIO()
+    out.write("request took {0:.2f} ms, {1} SQL statements in {2:.2f} ms\n\n".
+              format(elapsed * 1000, queryCount, queryTime * 1000))
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+    return Response(out.getvalue(), mimetype="text/plain")
+
+
+# The measurements of the application, served at '/metrics'.
+metrics = Metrics()
@@ -0,0 +1,580 @@
+#!/usr/local/bin/python3
+"""
+The migrations.py module is a module intended to upgrade an existing catalog
+database to match the object model in models.py.
+
+Base.metadata.create_all only creates tables that are missing, so changes to
+tables that already exist (new indexes, new columns) are applied here as an
+ordered list of revisions. The revisions that have been applied are recorded
+in the schema_version table, in the same spirit as Alembic's alembic_version
+table, and every revision is written so that it is safe to run against a
+database that create_all has just built from the current models.
+
+database.py runs upgrade() on start up. The module can also be run directly
+to upgrade a database and report its current revision.
+
+Usage
+=======================================================
+$> python migrations.py
+"""
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer
+from sqlalchemy import MetaData, String, Table
+from sqlalchemy import column, func, inspect, select, table, text
+from models import Base
+from search import createSearchIndex
+
+import datetime
+import logging
+import time
+
+
+versionTable = Table("schema_version", MetaData(),
+                     Column("version_num", String(32), primary_key=True))
+
+# Revisions work on frozen copies of the tables, holding only the columns
+# that existed when the revision was written, rather than on the classes in
+# models.py. The models describe the newest schema, and their defaults and
+# onupdate columns would otherwise reach into columns that later revisions
+# have not added yet.
+lookupTables = MetaData()
+userLookup = Table("user", lookupTables,
+                   Column("id", Integer, primary_key=True),
+                   Column("email", String(250)))
+categoryLookup = Table("Category", lookupTables,
+                       Column("id", Integer, primary_key=True),
+                       Column("name", String))
+itemLookup = Table("Item", lookupTables,
+                   Column("id", Integer, primary_key=True),
+                   Column("name", String),
+                   Column("category_id", Integer),
+                   Column("user_id", Integer))
+LOOKUP_INDEXES = [
+    Index("ix_user_email", userLookup.c.email, unique=True),
+    Index("ix_Category_name", categoryLookup.c.name, unique=True),
+    Index("ix_Item_name", itemLookup.c.name, unique=True),
+    Index("ix_Item_user_id", itemLookup.c.user_id),
+    Index("ix_Item_category_id_name", itemLookup.c.category_id,
+          itemLookup.c.name),
+]
+
+
+def mergeDuplicates(conn, table, column, references):
+    """
+    Function to collapse rows of table that share the same value of column
+    into the row with the lowest id, repointing any foreign keys at the
+    surviving row first.
+
+    Parameters
+    =======================================================
+    conn - sqlalchemy Connection
+        The connection to run the statements on.
+    table - sqlalchemy Table or TableClause
+        The table holding the duplicate rows.
+    column - sqlalchemy Column
+        The column whose values should be unique.
+    references - list of sqlalchemy Columns
+        Foreign key columns that point at table.id.
+
+    Returns
+    =======================================================
+    None
+    """
+    duplicates = conn.execute(
+        select(column, func.min(table.c.id)).group_by(column).having(
+            func.count() > 1)).fetchall()
+    for value, keepId in duplicates:
+        extraIds = [row[0] for row in conn.execute(
+            select(table.c.id).where(column == value, table.c.id != keepId))]
+        logging.info("merging %s rows %s into %s for %s",
+                     table.name, extraIds, keepId, value)
+        for reference in references:
+            conn.execute(reference.table.update().where(
+                reference.in_(extraIds)).values({reference.name: keepId}))
+        conn.execute(table.delete().where(table.c.id.in_(extraIds)))
+
+
+def addLookupIndexes(conn):
+    """
+    Revision 0001 - add the lookup indexes and unique constraints on
+    Item.name, Category.name, User.email, Item.category_id and Item.user_id.
+
+    Duplicate categories and users are merged before the unique indexes are
+    built. Duplicate item names cannot be merged without losing data, so they
+    abort the upgrade and have to be resolved by hand.
+    """
+    mergeDuplicates(conn, categoryLookup, categoryLookup.c.name,
+                    [itemLookup.c.category_id])
+    mergeDuplicates(conn, userLookup, userLookup.c.email,
+                    [itemLookup.c.user_id])
+    duplicates = conn.execute(
+        select(itemLookup.c.name).group_by(itemLookup.c.name).having(
+            func.count() > 1)).fetchall()
+    if duplicates:
+        raise RuntimeError("Item names must be unique before upgrading, "
+                           "duplicates found for {0}".
+                           format([row[0] for row in duplicates]))
+
+    for index in LOOKUP_INDEXES:
+        index.create(conn, checkfirst=True)
+
+
+def addSearchIndex(conn):
+    """
+    Revision 0002 - add the full text index over item names and descriptions
+    used by '/catalog/search' and fill it from the existing items.
+    """
+    createSearchIndex(conn)
+
+
+ITEM_COUNT_SQLITE_DDL = [
+    """CREATE TRIGGER IF NOT EXISTS category_count_insert
+           AFTER INSERT ON "Item" WHEN new.category_id IS NOT NULL BEGIN
+           UPDATE "Category" SET item_count = item_count + 1
+           WHERE id = new.category_id;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS category_count_delete
+           AFTER DELETE ON "Item" WHEN old.category_id IS NOT NULL BEGIN
+           UPDATE "Category" SET item_count = item_count - 1
+           WHERE id = old.category_id;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS category_count_update
+           AFTER UPDATE OF category_id ON "Item"
+           WHEN old.category_id IS NOT new.category_id BEGIN
+           UPDATE "Category" SET item_count = item_count - 1
+           WHERE id = old.category_id;
+           UPDATE "Category" SET item_count = item_count + 1
+           WHERE id = new.category_id;
+       END""",
+]
+
+ITEM_COUNT_POSTGRES_DDL = [
+    """CREATE OR REPLACE FUNCTION category_item_count() RETURNS trigger AS $$
+       BEGIN
+           IF TG_OP IN ('DELETE', 'UPDATE') AND old.category_id IS NOT NULL
+           THEN
+               UPDATE "Category" SET item_count = item_count - 1
+               WHERE id = old.category_id;
+           END IF;
+           IF TG_OP IN ('INSERT', 'UPDATE') AND new.category_id IS NOT NULL
+           THEN
+               UPDATE "Category" SET item_count = item_count + 1
+               WHERE id = new.category_id;
+           END IF;
+           RETURN NULL;
+       END
+       $$ LANGUAGE plpgsql""",
+    'DROP TRIGGER IF EXISTS category_count ON "Item"',
+    """CREATE TRIGGER category_count
+           AFTER INSERT OR DELETE OR UPDATE OF category_id ON "Item"
+           FOR EACH ROW EXECUTE PROCEDURE category_item_count()""",
+]
+
+
+def createItemCounts(conn, categoryIds=None):
+    """
+    Function to fill in Category.item_count from the Item table and add the
+    triggers that keep it up to date as items are added, moved and deleted,
+    however the change is made.
+
+    Parameters
+    =======================================================
+    conn - sqlalchemy Connection
+        The connection to run the statements on.
+    categoryIds - collection of ints
+        When given, only these categories, the ones whose items changed
+        while the counts were suspended, are counted again.
+
+    Returns
+    =======================================================
+    None
+    """
+    categoryTable = table("Category", column("id"), column("item_count"))
+    itemTable = table("Item", column("id"), column("category_id"))
+    recount = categoryTable.update().values(item_count=select(
+        func.count(itemTable.c.id)).where(
+        itemTable.c.category_id == categoryTable.c.id).scalar_subquery())
+    if categoryIds is not None:
+        recount = recount.where(categoryTable.c.id.in_(list(categoryIds)))
+    conn.execute(recount)
+
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        statements = ITEM_COUNT_SQLITE_DDL
+    elif dialect == "postgresql":
+        statements = ITEM_COUNT_POSTGRES_DDL
+    else:
+        statements = []
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+def suspendItemCounts(conn):
+    """
+    Function to stop Category.item_count following changes to the Item
+    table, for bulk loads where the per row trigger would slow the load down.
+    createItemCounts() puts the triggers back and recounts the categories.
+    Call both in the same transaction, so that no other connection ever sees
+    the counts without their triggers.
+
+    Parameters
+    =======================================================
+    conn - sqlalchemy Connection
+        The connection to run the DDL on.
+
+    Returns
+    =======================================================
+    None
+    """
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        for trigger in ("insert", "update", "delete"):
+            conn.execute(text("DROP TRIGGER IF EXISTS category_count_" +
+                              trigger))
+    elif dialect == "postgresql":
+        conn.execute(text('DROP TRIGGER IF EXISTS category_count ON "Item"'))
+
+
+def addItemCounts(conn):
+    """
+    Revision 0003 - add Category.item_count, so that editItem and deleteItem
+    can tell a category has been emptied without counting its items, fill it
+    in from the existing items and add the triggers that maintain it.
+    """
+    columns = [column["name"] for column in
+               inspect(conn).get_columns("Category")]
+    if "item_count" not in columns:
+        conn.execute(text('ALTER TABLE "Category" ADD COLUMN item_count '
+                          'INTEGER NOT NULL DEFAULT 0'))
+    createItemCounts(conn)
+
+
+def addItemTimestamps(conn):
+    """
+    Revision 0004 - add Item.updated_at, which the JSON API's ETag and
+    Last-Modified headers are derived from, and stamp the existing items with
+    the time of the upgrade.
+    """
+    columns = [column["name"] for column in
+               inspect(conn).get_columns("Item")]
+    if "updated_at" not in columns:
+        conn.execute(text('ALTER TABLE "Item" ADD COLUMN updated_at '
+                          'TIMESTAMP'))
+    itemTable = table("Item", column("updated_at"))
+    conn.execute(itemTable.update().where(
+        itemTable.c.updated_at.is_(None)).values(
+        updated_at=datetime.datetime.utcnow()))
+
+
+CATALOG_VERSION_SQLITE_DDL = [
+    """CREATE TRIGGER IF NOT EXISTS catalog_version_{0}_{1}
+           AFTER {2} ON "{3}" BEGIN
+           UPDATE catalog_version SET version = version + 1,
+               modified = CURRENT_TIMESTAMP;
+       END""".format(name.lower(), operation.lower(), operation, name)
+    for name in ("Item", "Category")
+    for operation in ("INSERT", "UPDATE", "DELETE")
+]
+
+# On Postgres every backend counts its changes in a row of its own, keyed on
+# its process id, so concurrent writers never wait on each other's row lock.
+# The version is the sum of the rows.
+CATALOG_VERSION_POSTGRES_DDL = [
+    """CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+       BEGIN
+           INSERT INTO catalog_version (id, version, modified)
+               VALUES (pg_backend_pid(), 1, now() AT TIME ZONE 'utc')
+               ON CONFLICT (id) DO UPDATE
+               SET version = catalog_version.version + 1,
+                   modified = EXCLUDED.modified;
+           RETURN NULL;
+       END
+       $$ LANGUAGE plpgsql""",
+] + [
+    statement.format(name)
+    for name in ("Item", "Category")
+    for statement in (
+        'DROP TRIGGER IF EXISTS catalog_version ON "{0}"',
+        """CREATE TRIGGER catalog_version
+               AFTER INSERT OR UPDATE OR DELETE ON "{0}"
+               FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version()""")
+]
+
+
+def createCatalogVersion(conn):
+    """
+    Function to add the catalog_version table, whose rows add up to the
+    version number, and hold the last modified time, of the catalog, and the
+    triggers that bump it whenever an item or category is added, changed or
+    deleted, by whichever process makes the change. Row 1 holds the starting
+    version and changes made by hand; sqlite's triggers bump it as well.
+
+    Parameters
+    =======================================================
+    conn - sqlalchemy Connection
+        The connection to run the statements on.
+
+    Returns
+    =======================================================
+    None
+    """
+    versionRow = Table("catalog_version", MetaData(),
+                       Column("id", Integer, primary_key=True),
+                       Column("version", BigInteger, nullable=False),
+                       Column("modified", DateTime, nullable=False))
+    versionRow.create(conn, checkfirst=True)
+    if conn.execute(select(func.count()).select_from(versionRow)).scalar() \
+            == 0:
+        conn.execute(versionRow.insert().values(
+            id=1, version=int(time.time() * 1000),
+            modified=datetime.datetime.utcnow()))
+
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        statements = CATALOG_VERSION_SQLITE_DDL
+    elif dialect == "postgresql":
+        statements = CATALOG_VERSION_POSTGRES_DDL
+    else:
+        statements = []
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+def suspendCatalogVersion(conn):
+    """
+    Function to stop sqlite's per row triggers from bumping catalog_version,
+    for bulk loads that bump it once with bumpCatalogVersion() instead.
+    createCatalogVersion() puts the triggers back. Postgres bumps the version
+    once per statement and is left alone.
+
+    Parameters
+    =======================================================
+    conn - sqlalchemy Connection
+        The connection to run the DDL on.
+
+    Returns
+    =======================================================
+    None
+    """
+    if conn.dialect.name == "sqlite":
+        for name in ("item", "category"):
+            for operation in ("insert", "update", "delete"):
+                conn.execute(text("DROP TRIGGER IF EXISTS "
+                                  "catalog_version_{0}_{1}".format(
+                                      name, operation)))
+
+
+def bumpCatalogVersion(conn):
+    """
+    Function to move the catalog version on by hand, for changes made while
+    its triggers were suspended.
+
+    Parameters
+    =======================================================
+    conn - sqlalchemy Connection
+        The connection to run the statement on.
+
+    Returns
+    =======================================================
+    None
+    """
+    conn.execute(text("UPDATE catalog_version SET version = version + 1, "
+                      "modified = :modified WHERE id = 1"),
+                 {"modified": datetime.datetime.utcnow()})
+
+
+def foldCatalogVersion(conn):
+    """
+    Function to add the catalog_version rows of Postgres backends that have
+    gone away into row 1, so that the table does not grow with every new
+    connection. The version, their sum, stays the same.
+
+    Parameters
+    =======================================================
+    conn - sqlalchemy Connection
+        The connection to run the statement on.
+
+    Returns
+    =======================================================
+    None
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(
+            """WITH gone AS (
+                   DELETE FROM catalog_version
+                   WHERE id <> 1
+                   AND id NOT IN (SELECT pid FROM pg_stat_activity)
+                   RETURNING version, modified)
+               UPDATE catalog_version
+               SET version = version + (SELECT coalesce(sum(version), 0)
+                                        FROM gone),
+                   modified = greatest(modified, (SELECT max(modified)
+                                                  FROM gone))
+               WHERE id = 1"""))
+
+
+def restoreCatalogVersion(conn):
+    """
+    Function to put back the catalog_version triggers and move the version
+    on, since changes made while they were missing went unrecorded.
+    """
+    createCatalogVersion(conn)
+    bumpCatalogVersion(conn)
+
+
+def addCatalogVersion(conn):
+    """
+    Revision 0005 - add the catalog_version table that the ETags of cached
+    pages and the JSON API's validators are derived from, so that they move
+    with changes made by other worker processes and command line tools.
+    """
+    createCatalogVersion(conn)
+
+
+REVISIONS = [
+    ("0001", "add lookup indexes and unique constraints", addLookupIndexes),
+    ("0002", "add full text item search index", addSearchIndex),
+    ("0003", "add maintained Category.item_count", addItemCounts),
+    ("0004", "add Item.updated_at", addItemTimestamps),
+    ("0005", "add trigger maintained catalog_version", addCatalogVersion),
+]
+
+
+# The triggers each dialect should have, and the functions that put them back
+# and bring what they maintain up to date when any of them is missing.
+TRIGGERS = {
+    "sqlite": [
+        (["item_search_insert", "item_search_update", "item_search_delete"],
+         createSearchIndex),
+        (["category_count_insert", "category_count_update",
+          "category_count_delete"], createItemCounts),
+        (["catalog_version_{0}_{1}".format(name, operation)
+          for name in ("item", "category")
+          for operation in ("insert", "update", "delete")],
+         restoreCatalogVersion),
+    ],
+    "postgresql": [
+        (["Item.category_count"], createItemCounts),
+        (["Item.catalog_version", "Category.catalog_version"],
+         restoreCatalogVersion),
+    ],
+}
+
+
+def existingTriggers(conn):
+    """
+    Function to list the triggers in the connection's database.
+
+    Parameters
+    =======================================================
+    conn - sqlalchemy Connection
+        The connection to look through.
+
+    Returns
+    =======================================================
+    set of strings -
+        The trigger names, prefixed with "<table>." on Postgres where they
+        are only unique per table.
+    """
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        return set(row[0] for row in conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger'")))
+    if dialect == "postgresql":
+        return set(row[0] for row in conn.execute(text(
+            "SELECT replace(tgrelid::regclass::text, '\"', '') || '.' || "
+            "tgname FROM pg_trigger WHERE NOT tgisinternal")))
+    return set()
+
+
+def ensureTriggers(conn):
+    """
+    Function to put back any trigger that has gone missing, for instance
+    because a bulk load that suspended it was killed, and to bring up to date
+    whatever the trigger maintains.
+
+    Parameters
+    =======================================================
+    conn - sqlalchemy Connection
+        The connection to run the statements on.
+
+    Returns
+    =======================================================
+    list of strings -
+        The names of the triggers that were missing.
+    """
+    present = existingTriggers(conn)
+    missing = []
+    for names, restore in TRIGGERS.get(conn.dialect.name, []):
+        absent = [name for name in names if name not in present]
+        if absent:
+            restore(conn)
+            missing.extend(absent)
+    return missing
+
+
+def currentRevision(engine):
+    """
+    Function to report the newest revision applied to a database.
+
+    Parameters
+    =======================================================
+    engine - sqlalchemy Engine
+        The engine for the database to inspect.
+
+    Returns
+    =======================================================
+    string -
+        The newest applied revision id or None if none have been applied.
+    """
+    versionTable.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return conn.execute(select(func.max(versionTable.c.version_num))).\
+            scalar()
+
+
+def upgrade(engine):
+    """
+    Function to create any missing tables, apply every revision that has
+    not yet been applied to the database, each in its own transaction, and
+    put back any trigger the revisions added that has since gone missing.
+    The catalog_version rows of departed Postgres backends are folded too.
+
+    Parameters
+    =======================================================
+    engine - sqlalchemy Engine
+        The engine for the database to upgrade.
+
+    Returns
+    =======================================================
+    list of strings -
+        The revision ids that were applied.
+    """
+    Base.metadata.create_all(engine)
+    versionTable.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        applied = set(row[0] for row in conn.execute(
+            select(versionTable.c.version_num)))
+
+    upgraded = []
+    for revision, description, step in REVISIONS:
+        if revision in applied:
+            continue
+        logging.info("applying revision %s - %s", revision, description)
+        with engine.begin() as conn:
+            step(conn)
+            conn.execute(versionTable.insert(), {"version_num": revision})
+        upgraded.append(revision)
+
+    with engine.begin() as conn:
+        for trigger in ensureTriggers(conn):
+            logging.warning("trigger %s was missing and has been restored",
+                            trigger)
+        foldCatalogVersion(conn)
+    return upgraded
+
+
+if __name__ == '__main__':
+    from database import engine
+    for revision in upgrade(engine):
+        print("applied revision {0}".format(revision))
+    print("database is at revision {0}".format(currentRevision(engine)))
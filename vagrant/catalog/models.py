@@ -6,10 +6,10 @@ Catalog Application.
 This object model should be used heavily by the application.py standalone
 module.
 """
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy.orm import relationship
+import datetime
 import random
 import string
 
@@ -28,7 +28,7 @@ class User(Base):
     __tablename__ = "user"
     id = Column(Integer, primary_key=True)
     name = Column(String(250), nullable=False)
-    email = Column(String(250), nullable=False)
+    email = Column(String(250), nullable=False, unique=True, index=True)
     picture = Column(String(250))
 
 
@@ -44,7 +44,13 @@ class Category(Base):
     """
     __tablename__ = "Category"
     id = Column(Integer, primary_key=True)
-    name = Column(String, nullable=False)
+    name = Column(String, nullable=False, unique=True, index=True)
+    # Number of items under the category, kept up to date by the database
+    # triggers added in migrations.py rather than by the ORM.
+    item_count = Column(Integer, nullable=False, default=0,
+                        server_default="0")
+    items = relationship("Item", back_populates="category",
+                         order_by="Item.name")
 
     @property
     def serialize(self):
@@ -78,13 +84,22 @@ class Item(Base):
         A sqlalchemy declarative_base
     """
     __tablename__ = "Item"
+    # Items are listed per category in name order, so index the pair. The
+    # index also serves plain lookups by category_id.
+    __table_args__ = (
+        Index("ix_Item_category_id_name", "category_id", "name"),
+    )
     id = Column(Integer, primary_key=True)
-    name = Column(String, nullable=False)
+    name = Column(String, nullable=False, unique=True, index=True)
     description = Column(String)
     category_id = Column(Integer, ForeignKey("Category.id"))
-    category = relationship(Category)
-    user_id = Column(Integer, ForeignKey("user.id"))
+    category = relationship(Category, back_populates="items")
+    user_id = Column(Integer, ForeignKey("user.id"), index=True)
     user = relationship(User)
+    # When the item was last added or changed, in UTC. The JSON API derives
+    # its ETag and Last-Modified headers from it.
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow,
+                        onupdate=datetime.datetime.utcnow)
 
     @property
     def serialize(self):
@@ -107,8 +122,3 @@ class Item(Base):
             "id": self.id,
             "title": self.name,
         }
-
-
-engine = create_engine("sqlite:///catalog.db")
-
-Base.metadata.create_all(engine)
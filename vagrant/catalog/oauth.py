@@ -0,0 +1,475 @@
+#!/usr/local/bin/python3
+"""
+The oauth.py module is a module intended to hold the calls the Catalog
+Application makes to the Google and Facebook OAuth servers when users log in
+and out.
+
+Every call goes through one shared HTTP client that keeps connections to the
+providers alive between requests and gives up after a timeout rather than
+holding a worker for as long as a provider takes to answer. Each provider call
+is described by a Call tuple and sent with that client.
+
+The client is configured through environment variables -
+
+CATALOG_OAUTH_TIMEOUT
+    Seconds to wait to connect to, or hear back from, a provider. Default 5.
+CATALOG_OAUTH_POOL_SIZE
+    Connections kept open to each provider host. Default 10.
+CATALOG_GOOGLE_API_URL, CATALOG_GOOGLE_ACCOUNTS_URL, CATALOG_FACEBOOK_URL
+    Base URLs of the providers, so that a stub server such as
+    benchmarks/stub_oauth.py can stand in for them.
+CATALOG_TOKEN_CACHE_SIZE, CATALOG_TOKEN_CACHE_TTL
+    How many tokens the provider's answers are remembered for, and for at
+    most how many seconds. Defaults 1024 and 300.
+
+What a provider said about a token is remembered in tokenCache until shortly
+before the token expires, so a user logging in again with the same token
+costs no provider calls. Google's id_token is checked against Google's public
+certificates, fetched once and cached for as long as Google allows, instead
+of asking Google's tokeninfo endpoint about every login.
+"""
+from collections import namedtuple
+from oauth2client import crypt
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cache import LocalBackend
+
+import hashlib
+import json
+import os
+import re
+import requests
+import threading
+import time
+
+
+GOOGLE_API_URL = os.environ.get(
+    "CATALOG_GOOGLE_API_URL", "https://www.googleapis.com")
+GOOGLE_ACCOUNTS_URL = os.environ.get(
+    "CATALOG_GOOGLE_ACCOUNTS_URL", "https://accounts.google.com")
+FACEBOOK_URL = os.environ.get(
+    "CATALOG_FACEBOOK_URL", "https://graph.facebook.com")
+TIMEOUT = float(os.environ.get("CATALOG_OAUTH_TIMEOUT", "5"))
+POOL_SIZE = int(os.environ.get("CATALOG_OAUTH_POOL_SIZE", "10"))
+TOKEN_CACHE_SIZE = int(os.environ.get("CATALOG_TOKEN_CACHE_SIZE", "1024"))
+TOKEN_CACHE_TTL = int(os.environ.get("CATALOG_TOKEN_CACHE_TTL", "300"))
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+
+# A single request to a provider.
+Call = namedtuple("Call", ["method", "url", "params"])
+
+
+class HTTPClient(object):
+    """
+    HTTPClient class to send provider calls over a pool of keep-alive
+    connections with a timeout on every request. A GET that fails because a
+    pooled connection was dropped, or could not connect, is retried once.
+    """
+
+    def __init__(self, timeout=TIMEOUT, poolSize=POOL_SIZE):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=poolSize,
+                              pool_maxsize=poolSize,
+                              max_retries=Retry(total=1, status=0,
+                                                allowed_methods=["GET"],
+                                                backoff_factor=0.1))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def send(self, call):
+        """
+        Send call and return the requests Response.
+        """
+        return self.session.request(call.method, call.url,
+                                    params=call.params, timeout=self.timeout)
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        """
+        Send a request in the manner of httplib2.Http.request, so the client
+        can be handed to oauth2client as its http object.
+
+        Returns
+        =======================================================
+        tuple -
+            A response object with a status attribute and the body bytes.
+        """
+        response = self.session.request(method, uri, data=body,
+                                        headers=headers, timeout=self.timeout)
+        response.status = response.status_code
+        return response, response.content
+
+
+class TokenCache(object):
+    """
+    TokenCache class to remember what a provider said about a token until a
+    minute before the token expires, or for at most ttl seconds, dropping the
+    least recently used tokens once maxEntries are held. Tokens are hashed
+    before being used as keys. Entries are kept in the memory of the current
+    process rather than a shared cache, since they hold access tokens.
+    """
+
+    def __init__(self, maxEntries=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL):
+        self.backend = LocalBackend(maxEntries)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, provider, token):
+        if not isinstance(token, bytes):
+            token = token.encode("utf-8")
+        return provider + ":" + hashlib.sha256(token).hexdigest()
+
+    def get(self, provider, token):
+        """
+        Return what was stored for provider's token, or None.
+        """
+        value = self.backend.get(self.key(provider, token))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, provider, token, value, expiresIn=None):
+        """
+        Store value for provider's token, which expires in expiresIn seconds
+        if known.
+        """
+        ttl = self.ttl
+        if expiresIn is not None:
+            ttl = min(ttl, int(expiresIn) - 60)
+        if ttl > 0:
+            self.backend.set(self.key(provider, token), value, ttl)
+
+    def forget(self, provider, token):
+        """
+        Drop what was stored for provider's token.
+        """
+        self.backend.delete(self.key(provider, token))
+
+    def stats(self):
+        """
+        Return the hit and miss counters as a dictionary.
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class CertCache(object):
+    """
+    CertCache class to hold the public certificates Google signs id_tokens
+    with. They are fetched again once the max-age Google serves them with has
+    passed, or when a token is signed with a key that is not held, but no more
+    than once every minRefresh seconds.
+    """
+
+    def __init__(self, minRefresh=60):
+        self.minRefresh = minRefresh
+        self.certs = None
+        self.expires = 0
+        self.fetched = 0
+        self.lock = threading.Lock()
+
+    def get(self, refresh=False):
+        """
+        Return the certificates as a dictionary of key id to PEM.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if refresh and now - self.fetched < self.minRefresh:
+                refresh = False
+            if self.certs is None or refresh or now >= self.expires:
+                response = httpClient.send(googleCerts())
+                response.raise_for_status()
+                maxAge = re.search(r"max-age=(\d+)",
+                                   response.headers.get("Cache-Control", ""))
+                self.certs = json.loads(response.text)
+                self.fetched = now
+                self.expires = now + (int(maxAge.group(1)) if maxAge
+                                      else 3600)
+            return self.certs
+
+    def invalidate(self):
+        """
+        Drop the certificates so the next get() fetches them again.
+        """
+        with self.lock:
+            self.certs = None
+
+
+def decode(response):
+    """
+    Function to read the JSON body of a provider's response.
+
+    Parameters
+    =======================================================
+    response - requests Response
+        The provider's response.
+
+    Returns
+    =======================================================
+    dictionary -
+        The decoded body, or an "error" entry if it was not JSON.
+    """
+    try:
+        return json.loads(response.text)
+    except ValueError:
+        return {"error": "invalid response from {0}: {1}".format(
+            response.url, response.status_code)}
+
+
+def fetchJSON(call, client=None):
+    """
+    Function to send a provider call and decode its JSON response.
+
+    Parameters
+    =======================================================
+    call - Call
+        The call to send.
+    client - HTTPClient
+        The client to send it with, by default the shared httpClient.
+
+    Returns
+    =======================================================
+    dictionary -
+        The decoded response.
+    """
+    return decode((client or httpClient).send(call))
+
+
+def googleTokenInfo(access_token):
+    """
+    The call that checks a Google access token is valid.
+    """
+    return Call("GET", GOOGLE_API_URL + "/oauth2/v1/tokeninfo",
+                {"access_token": access_token})
+
+
+def googleUserInfo(access_token):
+    """
+    The call that fetches the name, picture and email of a Google user.
+    """
+    return Call("GET", GOOGLE_API_URL + "/oauth2/v1/userinfo",
+                {"access_token": access_token, "alt": "json"})
+
+
+def googleRevoke(access_token):
+    """
+    The call that revokes a Google access token on logout.
+    """
+    return Call("GET", GOOGLE_ACCOUNTS_URL + "/o/oauth2/revoke",
+                {"token": access_token})
+
+
+def googleCerts():
+    """
+    The call that fetches the certificates Google signs id_tokens with.
+    """
+    return Call("GET", GOOGLE_API_URL + "/oauth2/v1/certs", None)
+
+
+def googleTokenURI():
+    """
+    The URI oauth2client exchanges Google authorization codes at.
+    """
+    return GOOGLE_ACCOUNTS_URL + "/o/oauth2/token"
+
+
+def facebookExchange(app_id, app_secret, access_token):
+    """
+    The call that swaps a short lived Facebook token for a long lived one.
+    """
+    return Call("GET", FACEBOOK_URL + "/oauth/access_token",
+                {"grant_type": "fb_exchange_token", "client_id": app_id,
+                 "client_secret": app_secret,
+                 "fb_exchange_token": access_token})
+
+
+def facebookUserInfo(access_token):
+    """
+    The call that fetches the name, id and email of a Facebook user.
+    """
+    return Call("GET", FACEBOOK_URL + "/v2.10/me",
+                {"access_token": access_token, "fields": "name,id,email"})
+
+
+def facebookPicture(access_token):
+    """
+    The call that fetches the profile picture of a Facebook user.
+    """
+    return Call("GET", FACEBOOK_URL + "/v2.10/me/picture",
+                {"access_token": access_token, "redirect": "0",
+                 "height": "200", "width": "200"})
+
+
+def facebookRevoke(facebook_id, access_token):
+    """
+    The call that removes the app's permissions for a Facebook user on
+    logout.
+    """
+    return Call("DELETE", FACEBOOK_URL + "/{0}/permissions".format(
+        facebook_id), {"access_token": access_token})
+
+
+def verifyGoogleIdToken(id_token_jwt, client_id):
+    """
+    Function to check a Google id_token locally - its signature against
+    Google's cached certificates, its expiry, that it was issued by Google
+    and that it was issued to client_id.
+
+    Parameters
+    =======================================================
+    id_token_jwt - string
+        The id_token as returned by Google's token endpoint.
+    client_id - string
+        The app's Google client id.
+
+    Returns
+    =======================================================
+    dictionary -
+        The token's claims. crypt.AppIdentityError is raised if the token
+        does not check out.
+    """
+    try:
+        payload = crypt.verify_signed_jwt_with_certs(
+            id_token_jwt, googleCertCache.get(), client_id)
+    except crypt.AppIdentityError:
+        # Google may have rotated its keys since the certificates were cached.
+        payload = crypt.verify_signed_jwt_with_certs(
+            id_token_jwt, googleCertCache.get(refresh=True), client_id)
+    if payload.get("iss") not in GOOGLE_ISSUERS:
+        raise crypt.AppIdentityError("Wrong issuer: {0}".format(
+            payload.get("iss")))
+    return payload
+
+
+def checkGoogleToken(credentials, client_id):
+    """
+    Function to check that the credentials returned by Google's token endpoint
+    belong to the user their id_token names and were issued to this app.
+
+    The access token arrives in the same answer as the id_token, from Google
+    over TLS, so checking the signed id_token locally is enough. Without an
+    id_token the access token is looked up with Google's tokeninfo endpoint,
+    and the answer cached until the token expires.
+
+    Parameters
+    =======================================================
+    credentials - oauth2client OAuth2Credentials
+        The credentials from the authorization code exchange.
+    client_id - string
+        The app's Google client id.
+
+    Returns
+    =======================================================
+    tuple -
+        None, None if the credentials check out, otherwise the HTTP status
+        and the message to fail the login with.
+    """
+    if credentials.id_token_jwt:
+        try:
+            verifyGoogleIdToken(credentials.id_token_jwt, client_id)
+        except crypt.AppIdentityError as e:
+            return 401, "Token's ID token is invalid: {0}".format(e)
+        return None, None
+
+    access_token = credentials.access_token
+    result = tokenCache.get("google", access_token)
+    if result is None:
+        result = fetchJSON(googleTokenInfo(access_token))
+        if result.get("error") is not None:
+            return 500, result.get("error")
+        tokenCache.set("google", access_token, result,
+                       result.get("expires_in"))
+    if result["user_id"] != credentials.id_token["sub"]:
+        return 401, "Token's user ID doesn't match given user ID."
+    if result["issued_to"] != client_id:
+        return 401, "Token's client ID does not match app's."
+    return None, None
+
+
+def googleUser(access_token, expiresIn=None, client=None):
+    """
+    Function to fetch the Google user an access token belongs to, caching the
+    answer until the token expires.
+
+    Returns
+    =======================================================
+    dictionary -
+        The user info.
+    """
+    data = tokenCache.get("google:userinfo", access_token)
+    if data is None:
+        data = fetchJSON(googleUserInfo(access_token), client)
+        if "error" not in data:
+            tokenCache.set("google:userinfo", access_token, data, expiresIn)
+    return data
+
+
+def facebookLogin(app_id, app_secret, access_token, client=None):
+    """
+    Function to exchange a Facebook token and fetch the user it belongs to.
+    The answers are cached until the exchanged token expires, so logging in
+    again with the same token makes no calls to Facebook.
+
+    Returns
+    =======================================================
+    tuple -
+        The long lived token, the user info and the picture info.
+    """
+    cached = tokenCache.get("facebook", access_token)
+    if cached is not None:
+        return tuple(cached)
+    exchanged = fetchJSON(facebookExchange(app_id, app_secret, access_token),
+                          client)
+    token = exchanged.get("access_token")
+    if token is None:
+        return None, exchanged, {}
+    userInfo = fetchJSON(facebookUserInfo(token), client)
+    picture = fetchJSON(facebookPicture(token), client)
+    if "error" not in userInfo and "error" not in picture:
+        tokenCache.set("facebook", access_token, (token, userInfo, picture),
+                       exchanged.get("expires_in"))
+        tokenCache.set("facebook:exchanged", token, access_token,
+                       exchanged.get("expires_in"))
+    return token, userInfo, picture
+
+
+def revokeGoogle(access_token, client=None):
+    """
+    Function to revoke a Google access token and forget what was cached
+    about it.
+
+    Returns
+    =======================================================
+    requests Response -
+        Google's answer.
+    """
+    tokenCache.forget("google", access_token)
+    tokenCache.forget("google:userinfo", access_token)
+    return (client or httpClient).send(googleRevoke(access_token))
+
+
+def revokeFacebook(facebook_id, token, client=None):
+    """
+    Function to revoke the app's Facebook permissions for a user and forget
+    what was cached about the token they logged in with.
+
+    Returns
+    =======================================================
+    requests Response -
+        Facebook's answer.
+    """
+    loginToken = tokenCache.get("facebook:exchanged", token)
+    if loginToken is not None:
+        tokenCache.forget("facebook", loginToken)
+    tokenCache.forget("facebook:exchanged", token)
+    return (client or httpClient).send(facebookRevoke(facebook_id, token))
+
+
+# The client, token answers and Google certificates shared by every thread
+# of the process.
+httpClient = HTTPClient()
+tokenCache = TokenCache()
+googleCertCache = CertCache()
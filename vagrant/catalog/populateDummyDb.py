@@ -4,16 +4,10 @@ The populateDummyDb.py module is a module intended utilize the object model for
 the Catalog Application and prepopulate the DB with some content to develop
 against.
 """
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models import Base, Item, Category, User
+from models import User
+from database import DBSession, engine
+from catalogImport import importRecords
 
-engine = create_engine("sqlite:///catalog.db")
-# Bind the engine to the metadata of the Base class so that the
-# declaratives can be accessed through a DBSession instance
-Base.metadata.bind = engine
-
-DBSession = sessionmaker(bind=engine)
 # A DBSession() instance establishes all conversations with the database
 # and represents a "staging zone" for all the objects loaded into the
 # database session object. Any change made against the objects in the
@@ -50,22 +44,12 @@ defUser = User(name="Jon Cronin", email="jonjoncronin@gmail.com",
 session.add(defUser)
 session.commit()
 
-# Create dummy items
-for category in itemsList:
-    someCategory = Category(name=category["category"])
-    session.add(someCategory)
-    session.commit()
-    newCat = session.query(Category).filter_by(name=someCategory.name).one()
-    print("New Category {0}\n".format(category))
-    for item in category["items"]:
-        someItem = Item(
-            user_id=defUser.id,
-            name=item["name"],
-            description=item["description"],
-            category_id=newCat.id)
-
-        session.add(someItem)
-        print("added {0}\n".format(item))
-    print("=======================\n")
-session.commit()
+# Create dummy items, letting the bulk loader resolve the categories
+records = [{"name": item["name"],
+            "description": item["description"],
+            "category": category["category"]}
+           for category in itemsList for item in category["items"]]
+importRecords(engine, records, defUser.email)
+print("added {0} items in {1} categories\n".format(len(records),
+                                                   len(itemsList)))
 print("DB populated")
@@ -0,0 +1,184 @@
+#!/usr/local/bin/python3
+"""
+The search.py module is a module intended to provide full text search over the
+names and descriptions of items in the Catalog Application.
+
+On sqlite the items are indexed in an FTS5 virtual table, item_search, that
+is kept in step with the Item table by triggers and ranked with bm25. On
+Postgres a GIN index over the items' tsvector serves the same purpose and
+results are ranked with ts_rank_cd. Any other database falls back to a plain
+substring match.
+
+createSearchIndex() is applied to existing databases by migrations.py.
+Bulk loaders can call suspendSearchIndex() before a batch and
+createSearchIndex() after it, in the same transaction, to index the batch's
+items in one pass.
+"""
+from sqlalchemy import or_, text
+from sqlalchemy.orm import joinedload
+from models import Item
+
+import re
+
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS item_search USING fts5(
+           name, description, content='Item', content_rowid='id')""",
+    """CREATE TRIGGER IF NOT EXISTS item_search_insert
+           AFTER INSERT ON "Item" BEGIN
+           INSERT INTO item_search(rowid, name, description)
+           VALUES (new.id, new.name, new.description);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS item_search_delete
+           AFTER DELETE ON "Item" BEGIN
+           INSERT INTO item_search(item_search, rowid, name, description)
+           VALUES ('delete', old.id, old.name, old.description);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS item_search_update
+           AFTER UPDATE OF name, description ON "Item" BEGIN
+           INSERT INTO item_search(item_search, rowid, name, description)
+           VALUES ('delete', old.id, old.name, old.description);
+           INSERT INTO item_search(rowid, name, description)
+           VALUES (new.id, new.name, new.description);
+       END""",
+]
+
+SQLITE_REBUILD = "INSERT INTO item_search(item_search) VALUES ('rebuild')"
+
+SQLITE_CATCH_UP = """INSERT INTO item_search(rowid, name, description)
+    SELECT id, name, description FROM "Item" WHERE id > :afterId"""
+
+POSTGRES_DOCUMENT = ("to_tsvector('english', coalesce(\"Item\".name, '') "
+                     "|| ' ' || coalesce(\"Item\".description, ''))")
+
+POSTGRES_DDL = [
+    """CREATE INDEX IF NOT EXISTS "ix_Item_search" ON "Item"
+           USING GIN ({0})""".format(POSTGRES_DOCUMENT),
+]
+
+
+def createSearchIndex(conn, afterId=None):
+    """
+    Function to build the full text index for the connection's database and
+    fill it from the existing items.
+
+    Parameters
+    =======================================================
+    conn - sqlalchemy Connection
+        The connection to run the DDL on.
+    afterId - int
+        When given, only items with a higher id, added while the index was
+        suspended, are indexed instead of the whole table.
+
+    Returns
+    =======================================================
+    None
+    """
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        statements = SQLITE_DDL
+    elif dialect == "postgresql":
+        statements = POSTGRES_DDL
+    else:
+        statements = []
+    for statement in statements:
+        conn.execute(text(statement))
+    if dialect == "sqlite":
+        if afterId is None:
+            conn.execute(text(SQLITE_REBUILD))
+        else:
+            conn.execute(text(SQLITE_CATCH_UP), {"afterId": afterId})
+
+
+def suspendSearchIndex(conn):
+    """
+    Function to stop the search index following changes to the Item table,
+    for bulk loads where updating the index row by row would dominate the load
+    time. createSearchIndex() puts the index back. Only inserts made while it
+    is suspended can be caught up with afterId.
+
+    Parameters
+    =======================================================
+    conn - sqlalchemy Connection
+        The connection to run the DDL on.
+
+    Returns
+    =======================================================
+    None
+    """
+    if conn.dialect.name == "sqlite":
+        for trigger in ("insert", "update", "delete"):
+            conn.execute(text("DROP TRIGGER IF EXISTS item_search_" +
+                              trigger))
+
+
+def ftsQuery(terms):
+    """
+    Function to turn the words a user typed into an FTS5 query that matches
+    items containing every word. Each word is quoted so punctuation in the
+    search box cannot be read as FTS5 query syntax.
+
+    Parameters
+    =======================================================
+    terms - string
+        The search box contents.
+
+    Returns
+    =======================================================
+    string -
+        The FTS5 MATCH expression, or an empty string if there are no words.
+    """
+    words = re.findall(r"\w+", terms, re.UNICODE)
+    return " ".join('"{0}"'.format(word) for word in words)
+
+
+def searchItems(session, terms, limit):
+    """
+    Function to find the items whose name or description match the search
+    terms, best match first.
+
+    Parameters
+    =======================================================
+    session - sqlalchemy Session
+        The session to query with.
+    terms - string
+        The search box contents.
+    limit - int
+        The maximum number of items to return.
+
+    Returns
+    =======================================================
+    list of Items -
+        The matching items ordered by relevance.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        match = ftsQuery(terms)
+        if not match:
+            return []
+        ids = [row[0] for row in session.execute(text(
+            "SELECT rowid FROM item_search WHERE item_search MATCH :match "
+            "ORDER BY bm25(item_search) LIMIT :limit"),
+            {"match": match, "limit": limit})]
+    elif dialect == "postgresql":
+        if not terms.strip():
+            return []
+        ids = [row[0] for row in session.execute(text(
+            "SELECT id FROM \"Item\" "
+            "WHERE {0} @@ plainto_tsquery('english', :terms) "
+            "ORDER BY ts_rank_cd({0}, plainto_tsquery('english', :terms)) "
+            "DESC LIMIT :limit".format(POSTGRES_DOCUMENT)),
+            {"terms": terms, "limit": limit})]
+    else:
+        pattern = "%{0}%".format(terms.strip())
+        return session.query(Item).options(joinedload(Item.category)).\
+            filter(or_(Item.name.ilike(pattern),
+                       Item.description.ilike(pattern))).\
+            order_by(Item.name).limit(limit).all()
+
+    if not ids:
+        return []
+    found = dict((item.id, item) for item in
+                 session.query(Item).options(joinedload(Item.category)).
+                 filter(Item.id.in_(ids)))
+    return [found[item_id] for item_id in ids if item_id in found]
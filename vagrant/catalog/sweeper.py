@@ -0,0 +1,109 @@
+#!/usr/local/bin/python3
+"""
+The sweeper.py module is a module intended to remove categories that no
+longer hold any items from the Catalog Application database in the
+background.
+
+editItem and deleteItem remove the category an item leaves behind as part of
+the same transaction. When CATALOG_SWEEP_INTERVAL is set to a number of
+seconds they leave that to a sweeper thread instead, which deletes empty
+categories in batches every interval, keeping the write path as short as
+possible. Categories are only deleted while their item_count is still 0, so
+an item added to a category between the sweep finding it and deleting it
+keeps its category.
+
+The module can also be run directly to sweep once, for instance from cron.
+
+Usage
+=======================================================
+$> python sweeper.py [--batch-size 500]
+"""
+from sqlalchemy import select
+from models import Category
+from cache import categoryCache
+
+import argparse
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+def sweepEmptyCategories(engine, batchSize=500):
+    """
+    Function to delete every category with no items, batchSize categories
+    per transaction.
+
+    Parameters
+    =======================================================
+    engine - sqlalchemy Engine
+        The engine for the catalog database.
+    batchSize - int
+        The number of categories deleted per transaction.
+
+    Returns
+    =======================================================
+    int -
+        The number of categories deleted.
+    """
+    table = Category.__table__
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            ids = [row[0] for row in conn.execute(
+                select(table.c.id).where(table.c.item_count <= 0).
+                limit(batchSize))]
+            if ids:
+                deleted += conn.execute(table.delete().where(
+                    table.c.id.in_(ids), table.c.item_count <= 0)).rowcount
+        if len(ids) < batchSize:
+            break
+    if deleted:
+        log.debug("Swept %s empty categories", deleted)
+        categoryCache.invalidate()
+    return deleted
+
+
+def startSweeper(engine, interval, batchSize=500):
+    """
+    Function to start a daemon thread that calls sweepEmptyCategories every
+    interval seconds.
+
+    Parameters
+    =======================================================
+    engine - sqlalchemy Engine
+        The engine for the catalog database.
+    interval - float
+        Seconds to wait between sweeps.
+    batchSize - int
+        The number of categories deleted per transaction.
+
+    Returns
+    =======================================================
+    threading.Event -
+        Set it to stop the sweeper.
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                sweepEmptyCategories(engine, batchSize)
+            except Exception:
+                log.exception("Sweeping empty categories failed")
+
+    thread = threading.Thread(target=run, name="category-sweeper")
+    thread.daemon = True
+    thread.start()
+    return stop
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Delete every category that holds no items.")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    from database import engine
+    print("deleted {0} empty categories".format(
+        sweepEmptyCategories(engine, args.batch_size)))
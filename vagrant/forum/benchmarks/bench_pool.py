@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#
+# Benchmark of get_posts() in solution/forumdb_solved.py, opening a new
+# connection for every call as the forum used to versus borrowing one from
+# the connection pool.
+#
+# Needs the forum database from forum.sql. Usage:
+#   python3 benchmarks/bench_pool.py [--calls 2000] [--threads 1,4,8]
+
+import argparse, os, sys, threading, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "solution"))
+
+import psycopg2
+import forumdb_solved
+
+
+def connect_per_call():
+  """get_posts() as it was before the pool, with its own connection."""
+  db = psycopg2.connect(database=forumdb_solved.DBNAME)
+  c = db.cursor()
+  c.execute("select content, time, id from posts "
+            "order by time desc, id desc limit %s", (50,))
+  posts = c.fetchall()
+  db.close()
+  return posts
+
+
+def run(get_posts, calls, threads):
+  """Call get_posts calls times from threads threads and return the sorted
+  latencies and the wall time."""
+  latencies = []
+  lock = threading.Lock()
+
+  def worker(index):
+    for count in range(index, calls, threads):
+      start = time.perf_counter()
+      get_posts()
+      elapsed = time.perf_counter() - start
+      with lock:
+        latencies.append(elapsed)
+
+  pool = [threading.Thread(target=worker, args=(index,))
+          for index in range(threads)]
+  start = time.perf_counter()
+  for thread in pool:
+    thread.start()
+  for thread in pool:
+    thread.join()
+  return sorted(latencies), time.perf_counter() - start
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description="Compare per-call connections with the connection pool.")
+  parser.add_argument("--calls", type=int, default=2000)
+  parser.add_argument("--threads", default="1,4,8")
+  args = parser.parse_args()
+
+  print("{0:>7} {1:<8} {2:>9} {3:>9} {4:>9}".format(
+      "threads", "mode", "calls/s", "p50 ms", "p99 ms"))
+  for threads in [int(count) for count in args.threads.split(",")]:
+    for mode, get_posts in (("connect", connect_per_call),
+                            ("pooled", forumdb_solved.get_posts)):
+      latencies, wall = run(get_posts, args.calls, threads)
+      print("{0:>7} {1:<8} {2:>9.1f} {3:>9.2f} {4:>9.2f}".format(
+          threads, mode, len(latencies) / wall,
+          latencies[len(latencies) // 2] * 1000,
+          latencies[int(len(latencies) * 0.99)] * 1000))
+  forumdb_solved.close_pool()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+#
+# Benchmark of add_post() in solution/forumdb_solved.py under a burst of
+# posts, inserting each post as it is made versus queueing them for the
+# write-behind Writer, in strict and relaxed mode.
+#
+# Needs the forum database from forum.sql, and adds posts to it. Usage:
+#   python3 benchmarks/bench_write.py [--posts 2000] [--threads 1,8,32]
+
+import argparse, os, sys, threading, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "solution"))
+
+import forumdb_solved
+
+
+def run(add_post, posts, threads):
+  """Call add_post posts times from threads threads and return the sorted
+  latencies and the wall time."""
+  latencies = []
+  lock = threading.Lock()
+
+  def worker(index):
+    for count in range(index, posts, threads):
+      start = time.perf_counter()
+      add_post("bench post {0}".format(count))
+      elapsed = time.perf_counter() - start
+      with lock:
+        latencies.append(elapsed)
+
+  pool = [threading.Thread(target=worker, args=(index,))
+          for index in range(threads)]
+  start = time.perf_counter()
+  for thread in pool:
+    thread.start()
+  for thread in pool:
+    thread.join()
+  return sorted(latencies), time.perf_counter() - start
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description="Compare per-post inserts with write-behind batches.")
+  parser.add_argument("--posts", type=int, default=2000)
+  parser.add_argument("--threads", default="1,8,32")
+  args = parser.parse_args()
+
+  print("{0:>7} {1:<8} {2:>9} {3:>9} {4:>9}".format(
+      "threads", "mode", "posts/s", "p50 ms", "p99 ms"))
+  for threads in [int(count) for count in args.threads.split(",")]:
+    for mode in ("direct", "strict", "relaxed"):
+      writer = None
+      if mode == "direct":
+        add_post = forumdb_solved.add_post
+      else:
+        writer = forumdb_solved.Writer(strict=(mode == "strict"))
+        add_post = writer.put
+      start = time.perf_counter()
+      latencies, wall = run(add_post, args.posts, threads)
+      if writer is not None:
+        writer.close()
+        # Relaxed posts are only written once the queue is drained.
+        wall = time.perf_counter() - start
+      print("{0:>7} {1:<8} {2:>9.1f} {3:>9.2f} {4:>9.2f}".format(
+          threads, mode, len(latencies) / wall,
+          latencies[len(latencies) // 2] * 1000,
+          latencies[int(len(latencies) * 0.99)] * 1000))
+  forumdb_solved.close_pool()
+
+
+if __name__ == '__main__':
+  main()
@@ -3,3 +3,12 @@ CREATE TABLE posts ( content TEXT,
                      time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                      id SERIAL );
 
+-- Posts are listed newest first, a page at a time, so keep them in that order.
+CREATE INDEX IF NOT EXISTS posts_time_id ON posts (time DESC, id DESC);
+-- The id of the last post shown is looked up to find the next page.
+CREATE UNIQUE INDEX IF NOT EXISTS posts_id ON posts (id);
+
+-- Each post is kept as it was written, and also as the HTML fragment it is
+-- shown as, along with the RENDER_VERSION of solution/render.py that made it.
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS rendered_html TEXT;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS render_version INTEGER;
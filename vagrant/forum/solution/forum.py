@@ -2,14 +2,19 @@
 # 
 # A buggy web service in need of a database.
 
-from flask import Flask, request, redirect, url_for
+from flask import Flask, Response, request, redirect, stream_with_context, \
+  url_for
+from psycopg2.pool import PoolError
 
-from forumdb_initial import get_posts, add_post
+from forumdb_solved import get_posts, add_post
+
+# Number of posts shown on a page.
+PAGE_SIZE = 50
 
 app = Flask(__name__)
 
-# HTML template for the forum page
-HTML_WRAP = '''\
+# HTML for the forum page, sent before and after the posts
+HTML_HEAD = '''\
 <!DOCTYPE html>
 <html>
   <head>
@@ -19,9 +24,10 @@ HTML_WRAP = '''\
       textarea { width: 400px; height: 100px; }
       div.post { border: 1px solid #999;
                  padding: 10px 10px;
-                 margin: 10px 20%%; }
-      hr.postbound { width: 50%%; }
+                 margin: 10px 20%; }
+      hr.postbound { width: 50%; }
       em.date { color: #999 }
+      p.older { text-align: center; }
     </style>
   </head>
   <body>
@@ -31,23 +37,41 @@ HTML_WRAP = '''\
       <div><button id="go" type="submit">Post message</button></div>
     </form>
     <!-- post content will go here -->
-%s
+'''
+HTML_FOOT = '''\
   </body>
 </html>
 '''
 
-# HTML template for an individual comment
-POST = '''\
-    <div class=post><em class=date>%s</em><br>%s</div>
+# HTML template for the link to the next page of older posts
+OLDER = '''\
+    <p class=older><a href="%s">Older posts</a></p>
 '''
 
 
 @app.route('/', methods=['GET'])
 def main():
-  '''Main page of the forum.'''
-  posts = "".join(POST % (date, text) for text, date in get_posts())
-  html = HTML_WRAP % posts
-  return html
+  '''Main page of the forum, or the page of posts older than ?before=id.
+  The page is streamed, each post's stored HTML sent in turn.'''
+  before = request.args.get('before', type=int)
+  # The page is read before the response starts, so that its connection goes
+  # back to the pool at once rather than once a slow client has read the
+  # whole page, and so that a busy pool is answered with a 503. One extra
+  # post tells whether there is an older page to link to.
+  posts = get_posts(before, PAGE_SIZE + 1)
+
+  def render():
+    yield HTML_HEAD
+    last = None
+    for count, (html, post_id) in enumerate(posts):
+      if count < PAGE_SIZE:
+        yield html
+        last = post_id
+      else:
+        yield OLDER % url_for('main', before=last)
+    yield HTML_FOOT
+
+  return Response(stream_with_context(render()), mimetype='text/html')
 
 
 @app.route('/', methods=['POST'])
@@ -58,5 +82,12 @@ def post():
   return redirect(url_for('main'))
 
 
+@app.errorhandler(PoolError)
+def busy(error):
+  '''Answer with a 503 when no database connection came free in time.'''
+  return 'The forum is busy, please try again shortly.', 503, \
+    {'Retry-After': '5'}
+
+
 if __name__ == '__main__':
   app.run(host='0.0.0.0', port=8000)
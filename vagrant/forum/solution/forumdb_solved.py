@@ -1,23 +1,320 @@
 # Database code for the DB Forum, full solution!
 
-import psycopg2, bleach
+import atexit, contextlib, logging, os, queue, threading, time
+import psycopg2, psycopg2.extras, psycopg2.pool
+from render import RENDER_VERSION, render_post
 
 DBNAME = "forum"
 
-def get_posts():
-  """Return all posts from the 'database', most recent first."""
-  db = psycopg2.connect(database=DBNAME)
-  c = db.cursor()
-  c.execute("select content, time from posts order by time desc")
-  posts = c.fetchall()
-  db.close()
-  return posts
+# Connections are shared through a pool instead of opened for every call.
+POOL_MIN = int(os.environ.get("FORUM_POOL_MIN", "1"))
+POOL_MAX = int(os.environ.get("FORUM_POOL_MAX", "10"))
+# Seconds a connection is used for before it is replaced.
+MAX_LIFETIME = float(os.environ.get("FORUM_POOL_MAX_LIFETIME", "1800"))
+# Seconds a connection may sit idle before it is checked with a query.
+CHECK_IDLE = float(os.environ.get("FORUM_POOL_CHECK_IDLE", "30"))
+# Seconds to wait for a free connection before giving up with a PoolError.
+POOL_TIMEOUT = float(os.environ.get("FORUM_POOL_TIMEOUT", "10"))
 
-def add_post(content):
-  """Add a post to the 'database' with the current timestamp."""
-  db = psycopg2.connect(database=DBNAME)
-  c = db.cursor()
-  c.execute("insert into posts values (%s)", (bleach.clean(content),))  # good
-  db.commit()
-  db.close()
+# Set to 1 to queue new posts and insert them in batches from a background
+# thread, instead of inserting each one as it is made.
+WRITE_BEHIND = os.environ.get("FORUM_WRITE_BEHIND", "0") == "1"
+# A batch is written once it has this many posts, or this many milliseconds
+# after its first post was queued, whichever comes first.
+WRITE_BATCH = int(os.environ.get("FORUM_WRITE_BATCH", "100"))
+WRITE_INTERVAL_MS = float(os.environ.get("FORUM_WRITE_INTERVAL_MS", "50"))
+# Posts that may wait in the queue; add_post() blocks once it is full.
+WRITE_QUEUE = int(os.environ.get("FORUM_WRITE_QUEUE", "1000"))
+# With strict set to 1, add_post() returns only once its post is committed.
+# With 0 it returns as soon as the post is queued, and queued posts are lost
+# if the process dies before they are written.
+WRITE_STRICT = os.environ.get("FORUM_WRITE_STRICT", "1") == "1"
+
+log = logging.getLogger(__name__)
+
+
+class Pool(object):
+  """A thread-safe pool of connections to the forum database.
+
+  Callers wait for a free connection once maxconn are in use, for up to
+  timeout seconds before a PoolError is raised. Connections idle for more
+  than check_idle seconds are checked with a query before they are handed
+  out, and connections older than max_lifetime seconds, or broken by an
+  error, are closed and replaced.
+  """
+
+  def __init__(self, minconn=POOL_MIN, maxconn=POOL_MAX,
+               max_lifetime=MAX_LIFETIME, check_idle=CHECK_IDLE,
+               timeout=POOL_TIMEOUT, **kwargs):
+    self.pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn,
+                                                     **kwargs)
+    self.slots = threading.BoundedSemaphore(maxconn)
+    self.max_lifetime = max_lifetime
+    self.check_idle = check_idle
+    self.timeout = timeout
+    self.lock = threading.Lock()
+    self.opened = {}
+    self.last_used = {}
+
+  def healthy(self, conn, now):
+    """Return whether conn is open, young enough and still answering."""
+    with self.lock:
+      opened = self.opened.setdefault(conn, now)
+      last_used = self.last_used.get(conn, now)
+    if conn.closed or now - opened > self.max_lifetime:
+      return False
+    if now - last_used > self.check_idle:
+      try:
+        c = conn.cursor()
+        c.execute("select 1")
+        c.close()
+        conn.rollback()
+      except psycopg2.Error:
+        return False
+    return True
+
+  def discard(self, conn):
+    """Close conn and drop it from the pool."""
+    with self.lock:
+      self.opened.pop(conn, None)
+      self.last_used.pop(conn, None)
+    self.pool.putconn(conn, close=True)
+
+  @contextlib.contextmanager
+  def connection(self):
+    """Lend out a connection, committing on success and rolling back on
+    error before it goes back to the pool."""
+    if not self.slots.acquire(timeout=self.timeout):
+      raise psycopg2.pool.PoolError(
+          "no connection came free within %s seconds" % self.timeout)
+    try:
+      while True:
+        conn = self.pool.getconn()
+        if self.healthy(conn, time.monotonic()):
+          break
+        self.discard(conn)
+      try:
+        yield conn
+        conn.commit()
+      except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        self.discard(conn)
+        raise
+      except:
+        if not conn.closed:
+          conn.rollback()
+        self.pool.putconn(conn)
+        raise
+      else:
+        with self.lock:
+          self.last_used[conn] = time.monotonic()
+        self.pool.putconn(conn)
+    finally:
+      self.slots.release()
+
+  @contextlib.contextmanager
+  def cursor(self):
+    """Lend out a cursor on a pooled connection, inside one transaction."""
+    with self.connection() as conn:
+      c = conn.cursor()
+      try:
+        yield c
+      finally:
+        c.close()
+
+  def close(self):
+    """Close every connection in the pool."""
+    self.pool.closeall()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+  """Return the shared pool, connecting it on first use."""
+  global _pool
+  with _pool_lock:
+    if _pool is None:
+      _pool = Pool(database=DBNAME)
+    return _pool
+
+def close_pool():
+  """Close the shared pool, for instance when the server shuts down, once
+  any queued posts are written."""
+  global _pool
+  close_writer()
+  with _pool_lock:
+    if _pool is not None:
+      _pool.close()
+      _pool = None
+
+# Up to date fragments are read as they are; the content and time of posts
+# whose fragment is missing or stale are read instead, to render them again.
+_COLUMNS = ("select case when render_version = %(version)s "
+            "then rendered_html end, "
+            "case when render_version = %(version)s then null else content end, "
+            "case when render_version = %(version)s then null else time end, "
+            "id from posts ")
+
+def _page(before, limit):
+  """Return the query and parameters for a page of posts older than the post
+  whose id is before, or the newest page when it is None."""
+  params = {"version": RENDER_VERSION, "before": before, "limit": limit}
+  if before is None:
+    return (_COLUMNS + "order by time desc, id desc limit %(limit)s", params)
+  return (_COLUMNS +
+          "where (time, id) < "
+          "(select time, id from posts where id = %(before)s) "
+          "order by time desc, id desc limit %(limit)s", params)
 
+def _post(row):
+  """Return the (html, id) of a post read by a _page() query."""
+  html, content, time, post_id = row
+  if html is None:
+    html = render_post(content, time)
+  return html, post_id
+
+def get_posts(before=None, limit=50):
+  """Return up to limit posts from the 'database', most recent first, as
+  (html, id) tuples holding the sanitized HTML fragment of each post.
+  Passing the id of a post as before returns the posts older than it, so a
+  page is found through the posts_time_id index however far back it is."""
+  with get_pool().cursor() as c:
+    c.execute(*_page(before, limit))
+    return [_post(row) for row in c.fetchall()]
+
+def insert_posts(contents):
+  """Insert posts, along with their rendered fragments, with one multi-row
+  insert."""
+  with get_pool().cursor() as c:
+    # The time the default would have given, so it can go in the fragment.
+    c.execute("select localtimestamp")
+    now = c.fetchone()[0]
+    psycopg2.extras.execute_values(
+        c, "insert into posts (content, time, rendered_html, render_version) "
+        "values %s",
+        [(content, now, render_post(content, now), RENDER_VERSION)
+         for content in contents], page_size=len(contents))
+
+def rerender_posts(batch=500):
+  """Render again every post whose fragment is missing or was made by an
+  older RENDER_VERSION, batch posts to a transaction, and return how many
+  were rendered."""
+  count, last = 0, 0
+  while True:
+    with get_pool().cursor() as c:
+      c.execute("select id, content, time from posts "
+                "where id > %s and render_version is distinct from %s "
+                "order by id limit %s", (last, RENDER_VERSION, batch))
+      rows = c.fetchall()
+      if not rows:
+        return count
+      psycopg2.extras.execute_values(
+          c, "update posts set rendered_html = v.html, render_version = %s "
+          "from (values %%s) as v (id, html) where posts.id = v.id"
+          % RENDER_VERSION,
+          [(post_id, render_post(content, time))
+           for post_id, content, time in rows], page_size=len(rows))
+    count += len(rows)
+    last = rows[-1][0]
+
+
+class Writer(object):
+  """Write-behind for new posts.
+
+  Posts are put on a bounded queue, and a background thread inserts them in
+  batches of up to batch posts, at most interval_ms after the first of a
+  batch was queued. In strict mode put() waits until its post is committed
+  and raises if the batch failed.
+  """
+
+  def __init__(self, batch=WRITE_BATCH, interval_ms=WRITE_INTERVAL_MS,
+               maxsize=WRITE_QUEUE, strict=WRITE_STRICT):
+    self.batch = batch
+    self.interval = interval_ms / 1000.0
+    self.strict = strict
+    self.queue = queue.Queue(maxsize)
+    self.thread = threading.Thread(target=self.run, name="forum-writer",
+                                   daemon=True)
+    self.thread.start()
+
+  def put(self, content):
+    """Queue a post, waiting for it to be written if strict."""
+    if not self.strict:
+      self.queue.put((content, None))
+      return
+    done = {"event": threading.Event(), "error": None}
+    self.queue.put((content, done))
+    done["event"].wait()
+    if done["error"] is not None:
+      raise done["error"]
+
+  def run(self):
+    """Take batches off the queue and write them until close() is called."""
+    stopping = False
+    while not stopping:
+      entry = self.queue.get()
+      if entry is None:
+        break
+      pending = [entry]
+      deadline = time.monotonic() + self.interval
+      while len(pending) < self.batch:
+        try:
+          entry = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+          break
+        if entry is None:
+          stopping = True
+          break
+        pending.append(entry)
+      self.flush(pending)
+
+  def flush(self, pending):
+    """Insert a batch and tell any strict callers how it went."""
+    error = None
+    try:
+      insert_posts([content for content, _ in pending])
+    except Exception as e:
+      error = e
+      log.exception("Could not write %d queued posts", len(pending))
+    for _, done in pending:
+      if done is not None:
+        done["error"] = error
+        done["event"].set()
+
+  def close(self):
+    """Write everything queued so far and stop the background thread."""
+    self.queue.put(None)
+    self.thread.join()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+  """Return the shared Writer, started on first use, or None when
+  FORUM_WRITE_BEHIND is off."""
+  global _writer
+  with _writer_lock:
+    if _writer is None and WRITE_BEHIND:
+      _writer = Writer()
+      atexit.register(close_writer)
+    return _writer
+
+def close_writer():
+  """Drain and stop the shared Writer, for instance when the server shuts
+  down."""
+  global _writer
+  with _writer_lock:
+    if _writer is not None:
+      _writer.close()
+      _writer = None
+
+def add_post(content):
+  """Add a post to the 'database' with the current timestamp. The post is
+  kept as written and sanitized into its fragment. In write-behind mode the
+  post is queued and written with a batch."""
+  writer = get_writer()
+  if writer is not None:
+    writer.put(content)
+  else:
+    insert_posts([content])
@@ -0,0 +1,22 @@
+# Rendering of forum posts into the HTML fragments shown on the page.
+
+import bleach
+
+# Bump this whenever POST or the sanitizing policy below changes, then run
+# rerender.py to bring the stored fragments up to date.
+RENDER_VERSION = 1
+
+# Tags and attributes a post may keep; everything else is escaped.
+ALLOWED_TAGS = bleach.sanitizer.ALLOWED_TAGS
+ALLOWED_ATTRIBUTES = bleach.sanitizer.ALLOWED_ATTRIBUTES
+
+# HTML template for an individual comment
+POST = '''\
+    <div class=post><em class=date>%s</em><br>%s</div>
+'''
+
+
+def render_post(content, time):
+  """Return the sanitized HTML fragment for a post written at time."""
+  return POST % (time, bleach.clean(content, tags=ALLOWED_TAGS,
+                                    attributes=ALLOWED_ATTRIBUTES))
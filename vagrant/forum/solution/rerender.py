@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+#
+# Brings the stored HTML of every forum post up to date after RENDER_VERSION
+# in render.py is bumped. Pages render stale posts on the fly until it has
+# run, so it can run while the forum is up. Usage:
+#   python3 rerender.py [--batch 500]
+
+import argparse
+
+import forumdb_solved
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description="Render forum posts again with the current policy.")
+  parser.add_argument("--batch", type=int, default=500)
+  args = parser.parse_args()
+  count = forumdb_solved.rerender_posts(args.batch)
+  print("Rendered {0} posts.".format(count))
+  forumdb_solved.close_pool()
+
+
+if __name__ == '__main__':
+  main()